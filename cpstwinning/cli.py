@@ -3,6 +3,8 @@
 from mininet.wifi.cli import CLI_wifi
 from mininet.log import output, error
 from cpstwinning.twins import Plc, Motor, Hmi, RfidReaderMqttWiFi
+from cpstwinning.plcmessages import StepResponseMessage
+from cpstwinning.cosim import COSIM_STEP_SIZE
 
 
 class CpsTwinningCli(CLI_wifi):
@@ -95,6 +97,94 @@ class CpsTwinningCli(CLI_wifi):
                 return
         error("No PLC found with name '{}'.\n".format(args[0]))
 
+    def do_set_time_mode(self, line):
+        """Sets the time mode of a PLC, i.e., real-time, dilated by a factor, as fast as possible or stepping.
+           Usage: set_time_mode <plc_name> <realtime|dilated|asap|step> [factor]
+        """
+        args = line.split()
+        if len(args) < 2 or len(args) > 3:
+            error('Invalid number of args: set_time_mode <plc_name> <realtime|dilated|asap|step> [factor]\n')
+            return
+
+        for node in self.mn.values():
+            if node.name == args[0] and isinstance(node, Plc):
+                output(node.set_time_mode(*args[1:]))
+                return
+        error("No PLC found with name '{}'.\n".format(args[0]))
+
+    def do_step_plc(self, line):
+        """Pauses a PLC and executes exactly n scan cycles (default: 1), shows the changed tags.
+           Resume the PLC with set_time_mode.
+           Usage: step_plc <plc_name> [n]
+        """
+        args = line.split()
+        if len(args) < 1 or len(args) > 2:
+            error('Invalid number of args: step_plc <plc_name> [n]\n')
+            return
+        try:
+            n = int(args[1]) if len(args) == 2 else 1
+        except ValueError:
+            error("Invalid number of steps '{}'.\n".format(args[1]))
+            return
+
+        for node in self.mn.values():
+            if node.name == args[0] and isinstance(node, Plc):
+                result = node.step(n)
+                if isinstance(result, StepResponseMessage):
+                    out = 'Tick: {}, time: {} ns\n'.format(result.tick, result.current_time)
+                    for tag in result.tags:
+                        out = out + '{}|{}|{}\n'.format(str(tag['tick']).ljust(10), tag['name'].ljust(30), tag['value'])
+                    output(out)
+                else:
+                    output(result)
+                return
+        error("No PLC found with name '{}'.\n".format(args[0]))
+
+    def do_start_cosim(self, line):
+        """Advances all PLCs and devices in lockstep at a common step size (default: 10 ms), paced to factor times
+           real time (default: 1, 0 runs as fast as possible), for the given number of steps (default: until stopped).
+           Usage: start_cosim [step_ms] [factor] [steps]
+        """
+        args = line.split()
+        if len(args) > 3:
+            error('Invalid number of args: start_cosim [step_ms] [factor] [steps]\n')
+            return
+        try:
+            step_size = float(args[0]) / 1000 if len(args) > 0 else COSIM_STEP_SIZE
+            factor = float(args[1]) if len(args) > 1 else 1.0
+            steps = int(args[2]) if len(args) > 2 else None
+        except ValueError:
+            error('Invalid args: start_cosim [step_ms] [factor] [steps]\n')
+            return
+        self.mn.start_cosim(step_size, factor, steps)
+
+    def do_stop_cosim(self, _line):
+        """Stops the co-simulation, the PLCs resume in real time.
+           Usage: stop_cosim
+        """
+        self.mn.stop_cosim()
+
+    def do_cosim_status(self, _line):
+        """Shows the progress of the co-simulation.
+           Usage: cosim_status
+        """
+        output(self.mn.get_cosim_status())
+
+    def do_plc_stats(self, line):
+        """Shows the timing statistics (execution time, lateness, overruns) of the scan cycles of a PLC.
+           Usage: plc_stats <plc_name> [reset]
+        """
+        args = line.split()
+        if len(args) < 1 or len(args) > 2 or (len(args) == 2 and args[1] != 'reset'):
+            error('Invalid number of args: plc_stats <plc_name> [reset]\n')
+            return
+
+        for node in self.mn.values():
+            if node.name == args[0] and isinstance(node, Plc):
+                output(node.show_scan_stats(len(args) == 2))
+                return
+        error("No PLC found with name '{}'.\n".format(args[0]))
+
     def do_show_motor_status(self, line):
         """Shows a motor's status.
            Usage: show_motor_status <motor_name>
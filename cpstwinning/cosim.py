@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+from threading import Thread, Event
+from cpstwinning.plcmessages import StepResponseMessage
+
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Default communication step size in s
+COSIM_STEP_SIZE = 0.01
+
+
+class CoSimulation(Thread):
+    """Co-simulation master, which advances all PLCs and device models in lockstep at a common step size.
+
+    The PLCs run in the step time mode. Per communication step, each PLC executes the scan cycles within the step
+    (step_size must be a multiple of the tick time of each PLC), while the device models wait. Then the tags changed by
+    the step are passed on to the device models (cf. DeviceRuntime.dispatch), which process them and their timed
+    behaviour due by the PLCs' new time, while the PLCs wait. Tags written by the device models are read by the PLCs
+    in the next step, i.e., inputs and outputs are exchanged once per step as in FMI co-simulation, so that a run is
+    reproducible.
+
+    With factor > 0, the steps are paced to factor times real time (i.e., 1 for real time), otherwise they are made as
+    fast as possible. If given, the co-simulation ends after steps steps.
+    """
+
+    def __init__(self, plcs, runtime, step_size=COSIM_STEP_SIZE, factor=1.0, steps=None):
+        Thread.__init__(self)
+        self.daemon = True
+        self.plcs = plcs
+        self.runtime = runtime
+        self.step_size = step_size
+        self.factor = factor
+        self.steps = steps
+        # Steps made so far
+        self.step_count = 0
+        # { PLC name: scan cycles per step }
+        self.cycles = {}
+        self.stop_event = Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def get_status(self):
+        return "Co-simulation: {} steps of {:g} ms made (simulated time: {:g} s, factor: {:g}).\n".format(
+            self.step_count, self.step_size * 1e3, self.step_count * self.step_size, self.factor)
+
+    def __init_cycles(self):
+        """Returns an error text, if a PLC cannot be stepped at the step size."""
+        step_ns = int(round(self.step_size * 1e9))
+        for plc in self.plcs:
+            tick_time = plc.get_tick_time()
+            if tick_time <= 0 or step_ns % tick_time != 0:
+                return "Step size {:g} ms is not a multiple of the tick time {:g} ms of PLC '{}'.".format(
+                    self.step_size * 1e3, tick_time / 1e6, plc.name)
+            self.cycles[plc.name] = step_ns // tick_time
+        return ""
+
+    def __step(self):
+        """Makes one communication step, returns False if a PLC could not be stepped."""
+        # The PLCs execute their scan cycles concurrently, after the tags written by the device models before
+        futures = [(plc, plc.step_async(self.cycles[plc.name])) for plc in self.plcs]
+        for plc, future in futures:
+            result = future.result()
+            if not isinstance(result, StepResponseMessage):
+                logger.error("Could not step PLC '%s': %s", plc.name, result)
+                return False
+            self.runtime.dispatch(plc, result.tags, result.current_time)
+        self.runtime.wait_idle()
+        return True
+
+    def run(self):
+        err = self.__init_cycles()
+        if err:
+            logger.error(err)
+            return
+        logger.info("Starting co-simulation [step_size=%s, factor=%s].", self.step_size, self.factor)
+        try:
+            for plc in self.plcs:
+                err = plc.set_time_mode('step')
+                if err:
+                    logger.error("Could not set time mode of PLC '%s': %s", plc.name, err)
+                    return
+            self.runtime.set_lockstep(True)
+            # Let the device models process the changes received before
+            self.runtime.wait_idle()
+            start = time.time()
+            while not self.stop_event.is_set() and (self.steps is None or self.step_count < self.steps):
+                if not self.__step():
+                    break
+                self.step_count += 1
+                if self.factor > 0:
+                    delay = start + self.step_count * self.step_size / self.factor - time.time()
+                    if delay > 0:
+                        self.stop_event.wait(delay)
+        finally:
+            self.runtime.set_lockstep(False)
+            for plc in self.plcs:
+                plc.set_time_mode('realtime')
+            logger.info("Co-simulation ended after %d steps.", self.step_count)
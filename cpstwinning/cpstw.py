@@ -3,14 +3,18 @@
 from mininet.node import Controller
 from mininet.wifi.net import Mininet_wifi
 from mininet.wifi.node import OVSKernelAP
-from mininet.log import error
+from mininet.log import error, info
 from cpstwinning.topo import CpsTwinningTopo
-from cpstwinning.twins import Motor, Plc, Hmi, CandySensor
+from cpstwinning.twins import Motor, Plc, Hmi, CandySensor, PlcSupervisorHostProcess
+from cpstwinning.deviceruntime import DeviceRuntime
+from cpstwinning.physics import MotorPhysics
+from cpstwinning.cosim import CoSimulation, COSIM_STEP_SIZE
 from cpstwinning.amlparser import AmlParser
 from cpstwinning.securitymanager import SecurityManager, RuleTypes
 from cpstwinning.viz import Viz
 from cpstwinning.replication import Replication
 from cpstwinning.statelogging import StateLogging
+from cpstwinning.plcbuild import build_plcs, clear_ready, wait_until_ready
 import os
 
 import logging
@@ -20,13 +24,24 @@ logger = logging.getLogger(__name__)
 kafka_logger = logging.getLogger('kafka')
 kafka_logger.setLevel(logging.INFO)
 
+# Environment variable, which runs all PLCs by a single supervisor process if set to 1 (cf. run.py)
+SHARED_SUPERVISOR_ENV = 'PLC_SHARED_SUPERVISOR'
+
 
 class CpsTwinning(Mininet_wifi):
 
-    def __init__(self):
+    def __init__(self, shared_supervisor=False):
         super(CpsTwinning, self).__init__(controller=Controller, accessPoint=OVSKernelAP)
         self.topo = None
+        # Whether all PLCs are run by a single supervisor process instead of a process per PLC
+        self.shared_supervisor = shared_supervisor
+        self.supervisor_host = None
         self.physical_devices = []
+        # Runs the behaviour of all physical devices
+        self.device_runtime = None
+        # { PLC name: MotorPhysics }, simulates the motors controlled by the PLC
+        self.motor_physics = {}
+        self.cosim = None
         self.security_manager = None
         self.replication = None
         self.viz = None
@@ -54,27 +69,48 @@ class CpsTwinning(Mininet_wifi):
             'rfidrs': parser.rfidrs,
             'iiotgws': parser.iiotgws
         }
+        plc_names = [plc['name'] for plc in parser.plcs]
+        for plc_name in plc_names:
+            clear_ready(plc_name)
+        # Build the libs of all PLCs concurrently, their supervisors then restore them from the build cache
+        info('*** Building PLCs\n')
+        build_results = build_plcs([(plc['name'], plc['st_path']) for plc in parser.plcs if 'st_path' in plc])
+        if self.shared_supervisor:
+            self.supervisor_host = PlcSupervisorHostProcess()
         # Create topology
-        self.topo = CpsTwinningTopo(aml_topo=aml_topo)
+        self.topo = CpsTwinningTopo(aml_topo=aml_topo, shared_supervisor=self.shared_supervisor)
         # Start net
         self.start()
+        # Wait until all PLC supervisors are up
+        info('*** Waiting for PLCs\n')
+        self.__report_plc_startup(build_results, wait_until_ready(plc_names))
 
+        self.device_runtime = DeviceRuntime()
+        self.device_runtime.start()
         for motor in parser.motors:
+            plc = self.get(motor['plc_name'])
+            if motor['plc_name'] not in self.motor_physics:
+                self.motor_physics[motor['plc_name']] = MotorPhysics(self.device_runtime, plc)
             self.physical_devices.append(
                 Motor(
                     motor['name'],
                     motor['vars'],
-                    self.get(motor['plc_name']),
-                    motor['plc_var_map']
+                    plc,
+                    motor['plc_var_map'],
+                    self.device_runtime,
+                    self.motor_physics[motor['plc_name']]
                 )
             )
+        for physics in self.motor_physics.values():
+            physics.start()
         # Add candy sensor
         self.physical_devices.append(
             CandySensor(
                 'CandySensor1',
                 self.get('PLC1'),
                 {'EXTRACTORRUNNING': 1},
-                self.get('RFIDr1')
+                self.get('RFIDr1'),
+                self.device_runtime
             )
         )
 
@@ -111,6 +147,33 @@ class CpsTwinning(Mininet_wifi):
         self.viz = Viz(self, parser)
         self.state_logging = StateLogging(self)
 
+    def __report_plc_startup(self, build_results, readiness):
+        builds = dict((r.name, r) for r in build_results)
+        titles = ["PLC", "Build [s]", "Cached", "Load [s]", "Status"]
+        data = [titles]
+        for name in sorted(set(builds.keys()) | set(readiness.keys())):
+            build = builds.get(name)
+            plc_info = readiness.get(name)
+            if plc_info is None:
+                status = 'TIMEOUT'
+            elif plc_info.get('ready'):
+                status = 'READY'
+            else:
+                status = 'ERROR: {}'.format(plc_info.get('error', 'not running'))
+            data.append([name,
+                         '{:.2f}'.format(build.duration) if build else '-',
+                         build.cached if build else '-',
+                         '{:.2f}'.format(plc_info['load_time']) if plc_info and 'load_time' in plc_info else '-',
+                         status])
+            logger.info("PLC '%s' start-up: %s.", name,
+                        ', '.join('{}={}'.format(k, v) for k, v in zip(titles[1:], data[-1][1:])))
+        out = ""
+        for i, d in enumerate(data):
+            out = out + '|'.join(str(x).ljust(15) for x in d) + '\n'
+            if i == 0:
+                out = out + '-' * len(out) + '\n'
+        info(out)
+
     def start_viz(self, print_err=True):
         if not self.__is_topo_built(print_err):
             return
@@ -141,13 +204,47 @@ class CpsTwinning(Mininet_wifi):
             return
         self.replication.stop()
 
+    def start_cosim(self, step_size=COSIM_STEP_SIZE, factor=1.0, steps=None, print_err=True):
+        """Advances all PLCs and physical devices in lockstep (cf. CoSimulation)."""
+        if not self.__is_topo_built(print_err):
+            return
+        if self.cosim is not None and self.cosim.is_alive():
+            error("Co-simulation is already running!\n")
+            return
+        plcs = [node for node in self.values() if isinstance(node, Plc)]
+        self.cosim = CoSimulation(plcs, self.device_runtime, step_size, factor, steps)
+        self.cosim.start()
+
+    def stop_cosim(self, print_err=True):
+        if self.cosim is None or not self.cosim.is_alive():
+            if print_err:
+                error("Co-simulation is not running!\n")
+            return
+        self.cosim.stop()
+        self.cosim.join()
+
+    def get_cosim_status(self):
+        if self.cosim is None:
+            return "Co-simulation has not been started.\n"
+        return self.cosim.get_status()
+
     def stop(self):
         logger.debug("Terminating CPS Twinning...")
+        self.stop_cosim(False)
+        for physics in self.motor_physics.values():
+            physics.stop()
         for pd in self.physical_devices:
             pd.terminate()
+        if self.device_runtime is not None:
+            self.device_runtime.stop()
+            self.device_runtime.join()
         self.stop_replication(False)
         self.stop_viz(False)
         super(CpsTwinning, self).stop()
+        # The PLCs have been terminated by stopping their hosts
+        if self.supervisor_host is not None:
+            self.supervisor_host.terminate()
+            self.supervisor_host = None
 
     def __is_topo_built(self, print_err):
         if not self.topo or not self.build:
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+from collections import deque
+from threading import Thread, Condition, Lock
+from kafka import KafkaProducer
+from constants import KAFKA_BOOTSTRAP_SERVERS
+
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceRuntime(Thread):
+    """Runs the behaviour of all physical device models in a single thread.
+
+    Devices do not start threads on their own: changes of PLC tags are dispatched to them via call_soon (cf.
+    PlcVarsMonitor) and timed behaviour is scheduled via call_later, which keeps due times in a heap instead of
+    sleeping. Callbacks are invoked one at a time by the runtime's thread, so they must not block. Devices publish
+    via the runtime's KafkaProducer, which is shared by all of them.
+
+    In lockstep (cf. CoSimulation), the PLC tag changes are passed on by the co-simulation master via dispatch, which
+    then waits until the devices have processed them via wait_idle. Timers in the virtual time of a PLC are then due
+    by the PLC's time passed to dispatch, as the PLC's current time advances while the master steps it. Otherwise, the
+    runtime waits as long as the PLC predicts its time to take (cf. Plc.get_wait_time), and is woken up by the PLC
+    when its time has been advanced by a step.
+    """
+
+    def __init__(self):
+        Thread.__init__(self)
+        self.daemon = True
+        self.lock = Lock()
+        # Notified when callbacks are added or the runtime stops
+        self.cond = Condition(self.lock)
+        # Notified when the runtime's thread has invoked the callbacks that were due
+        self.idle_cond = Condition(self.lock)
+        # Set while the runtime's thread invokes callbacks
+        self.busy = False
+        # [clbk, args]
+        self.events = deque()
+        # [(due time in s, sequence number, plc or None, clbk, args)], due according to time.time()
+        self.timers = []
+        # [(due time in ns, sequence number, plc, clbk, args)], due according to the virtual time of the PLC
+        self.virtual_timers = []
+        # Keeps timers with equal due times in the order they have been scheduled in
+        self.seq = itertools.count()
+        self.stopped = False
+        self._kafka_producer = None
+        # { PLC name: [PlcVarsMonitor, ...] }
+        self.monitors = {}
+        # Set during a co-simulation, when the monitors must ignore the changes received via the subscription hubs
+        self.lockstep = False
+        # { PLC name: virtual time in ns }, by which timers are due in lockstep
+        self.lockstep_times = {}
+
+    def set_lockstep(self, lockstep):
+        """Enters or leaves lockstep, must be called while the PLCs do not run in real time.
+
+        Timers of a PLC pending on entering are moved to the PLC's virtual time and those pending on leaving back to
+        real time, so that no timer scheduled before keeps the time it has been scheduled in.
+        """
+        with self.cond:
+            self.lockstep = lockstep
+            self.lockstep_times = {}
+            now = time.time()
+            if lockstep:
+                timers = []
+                for timer in self.timers:
+                    due, seq, plc, clbk, args = timer
+                    if plc is not None:
+                        plc_time = plc.get_current_time()
+                        self.lockstep_times[plc.name] = plc_time
+                        self.virtual_timers.append((plc_time + int((due - now) * 1e9), seq, plc, clbk, args))
+                    else:
+                        timers.append(timer)
+                heapq.heapify(timers)
+                self.timers = timers
+            else:
+                for due, seq, plc, clbk, args in self.virtual_timers:
+                    heapq.heappush(self.timers, (now + (due - plc.get_current_time()) / 1e9, seq, plc, clbk, args))
+                self.virtual_timers = []
+            self.cond.notify()
+
+    @property
+    def kafka_producer(self):
+        with self.cond:
+            if self._kafka_producer is None:
+                self._kafka_producer = KafkaProducer(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS)
+            return self._kafka_producer
+
+    def call_soon(self, clbk, *args):
+        """Invokes clbk(*args) in the runtime's thread, never blocks."""
+        with self.cond:
+            self.events.append((clbk, args))
+            self.cond.notify()
+
+    def call_later(self, delay, clbk, args=(), plc=None):
+        """Invokes clbk(*args) in the runtime's thread after delay s, of the (virtual) time of the plc if given."""
+        with self.cond:
+            if plc is not None and not plc.is_realtime():
+                due = plc.get_current_time() + int(delay * 1e9)
+                self.virtual_timers.append((due, next(self.seq), plc, clbk, args))
+                plc.add_time_clbk(self.time_advanced)
+            else:
+                heapq.heappush(self.timers, (time.time() + delay, next(self.seq), plc, clbk, args))
+            self.cond.notify()
+
+    def time_advanced(self, plc):
+        """Wakes up the runtime, as the time of the plc has advanced."""
+        with self.cond:
+            self.cond.notify()
+
+    def add_monitor(self, monitor):
+        with self.lock:
+            self.monitors.setdefault(monitor.plc.name, []).append(monitor)
+
+    def remove_monitor(self, monitor):
+        with self.lock:
+            monitors = self.monitors.get(monitor.plc.name, [])
+            if monitor in monitors:
+                monitors.remove(monitor)
+
+    def dispatch(self, plc, tags, current_time):
+        """Passes the changed tags [{'name': ..., 'value': ...}] of the plc on to the monitors of the tags, and makes
+        the timers in the plc's virtual time due by current_time."""
+        with self.cond:
+            self.lockstep_times[plc.name] = current_time
+            for monitor in self.monitors.get(plc.name, ()):
+                for tag in tags:
+                    if tag['name'] in monitor.tag_names:
+                        self.events.append((monitor.update, (tag['name'], tag['value'])))
+            self.cond.notify()
+
+    def wait_idle(self):
+        """Waits until the callbacks due by now (and those they have added meanwhile) have been invoked, i.e., for
+        timers in the virtual time of a PLC until the PLC's current time (in lockstep, the time dispatched last)."""
+        with self.lock:
+            while not self.stopped and (self.busy or self.__is_due()):
+                self.idle_cond.wait()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+            self.idle_cond.notify_all()
+
+    def __is_due(self):
+        """Returns whether callbacks are due, must be called holding lock."""
+        if self.events or (self.timers and self.timers[0][0] <= time.time()):
+            return True
+        return any(self.__get_virtual_time(plc) >= due for due, _, plc, _, _ in self.virtual_timers)
+
+    def __get_virtual_time(self, plc):
+        """Returns the time of the plc, by which its virtual timers are due, must be called holding lock."""
+        if self.lockstep:
+            # Timers must not become due while the PLC is being stepped, their writes would take effect after the step
+            return self.lockstep_times.get(plc.name, -1)
+        return plc.get_current_time()
+
+    def __get_due(self):
+        """Returns the callbacks that are due, must be called holding cond."""
+        due = list(self.events)
+        self.events.clear()
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, _, clbk, args = heapq.heappop(self.timers)
+            due.append((clbk, args))
+        if self.virtual_timers:
+            pending = []
+            for timer in sorted(self.virtual_timers):
+                if self.__get_virtual_time(timer[2]) >= timer[0]:
+                    due.append(timer[3:])
+                else:
+                    pending.append(timer)
+            self.virtual_timers = pending
+        return due
+
+    def __get_timeout(self):
+        """Returns the time in s until the next timer may be due (None if there is none), must be called holding
+        cond."""
+        timeout = None
+        if self.timers:
+            timeout = max(self.timers[0][0] - time.time(), 0)
+        # In lockstep, virtual timers only become due by dispatch, which wakes up the runtime
+        if self.virtual_timers and not self.lockstep:
+            # { PLC name: (earliest due time in ns, plc) }
+            dues = {}
+            for due, _, plc, _, _ in self.virtual_timers:
+                if plc.name not in dues or due < dues[plc.name][0]:
+                    dues[plc.name] = (due, plc)
+            for due, plc in dues.itervalues():
+                wait_time = plc.get_wait_time(due)
+                if wait_time is not None:
+                    timeout = wait_time if timeout is None else min(timeout, wait_time)
+        return timeout
+
+    def run(self):
+        while True:
+            with self.cond:
+                due = self.__get_due()
+                while not due and not self.stopped:
+                    self.busy = False
+                    self.idle_cond.notify_all()
+                    self.cond.wait(self.__get_timeout())
+                    due = self.__get_due()
+                if self.stopped:
+                    break
+                self.busy = True
+            for clbk, args in due:
+                try:
+                    clbk(*args)
+                except Exception:
+                    logger.exception("Device callback %s failed.", clbk)
+        with self.cond:
+            if self._kafka_producer is not None:
+                self._kafka_producer.close()
+                self._kafka_producer = None
@@ -2,7 +2,7 @@
 
 from cpstwinning.constants import LOG_FILE_LOC, LOG_LEVEL
 from cpstwinning.utils import ModbusTables
-from multiprocessing.connection import Listener
+from cpstwinning.ipc import MB_SOCKET_NAME, Server, get_socket_path
 from pymodbus.client.sync import ModbusTcpClient
 from pymodbus.bit_read_message import ReadCoilsResponse, ReadDiscreteInputsResponse
 from pymodbus.register_read_message import ReadHoldingRegistersResponse, ReadInputRegistersResponse
@@ -44,26 +44,20 @@ class HmiMbClient(object):
         # Create HMI base path if it does not exist
         if not os.path.exists(hmi_base_path):
             os.makedirs(hmi_base_path)
-        address = os.path.join(hmi_base_path, 'mb_socket')
-        # Ensure that socket does not exist
-        try:
-            os.unlink(address)
-        except OSError:
-            if os.path.exists(address):
-                logger.exception('Could not remove socket file.')
-        # Create listener
-        listener = Listener(address)
-        while True:
-            conn = listener.accept()
-            msg = conn.recv()
-            if isinstance(msg, ReadMessage):
-                conn.send(self.mb_tbls[msg.mb_table][self.actions[0]](msg.ip, msg.starting_addr))
-            elif isinstance(msg, WriteMessage):
-                conn.send(self.mb_tbls[msg.mb_table][self.actions[1]](msg.ip, msg.starting_addr, msg.values))
-            elif isinstance(msg, CloseMessage):
-                conn.close()
-                break
-        listener.close()
+        # Serves many long-lived client connections concurrently, Modbus requests of a connection are independent,
+        # so they are handled concurrently, too
+        self.server = Server(get_socket_path(self.name, MB_SOCKET_NAME), self.__handle_message, ordered=False)
+        self.server.serve_forever()
+
+    def __handle_message(self, conn, msg):
+        if isinstance(msg, ReadMessage):
+            conn.send(self.mb_tbls[msg.mb_table][self.actions[0]](msg.ip, msg.starting_addr))
+        elif isinstance(msg, WriteMessage):
+            conn.send(self.mb_tbls[msg.mb_table][self.actions[1]](msg.ip, msg.starting_addr, msg.values))
+        elif isinstance(msg, CloseMessage):
+            self.server.shutdown()
+            return None
+        return True
 
     def read_coils(self, ip, address):
         with ModbusTcpClient(ip, timeout=TIMEOUT) as client:
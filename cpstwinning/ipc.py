@@ -0,0 +1,636 @@
+#!/usr/bin/env python
+
+from multiprocessing.connection import Client
+from ctypes import CDLL, get_errno, c_int, c_char_p, c_uint32
+from ctypes.util import find_library
+from multiprocessing.pool import ThreadPool
+from select import select, poll, POLLIN, POLLNVAL
+from threading import Thread, Event, Lock, local
+from cpstwinning.wireformat import Codec, MAX_REQUEST_ID
+from time import sleep, time
+
+import os
+import errno
+import socket
+import struct
+import logging
+import utils
+
+logger = logging.getLogger(__name__)
+
+# Names of the sockets of the listeners of PLC supervisors, HMI Modbus clients and MQTT clients
+PLC_SOCKET_NAME = 'plc_socket'
+MB_SOCKET_NAME = 'mb_socket'
+MQTT_SOCKET_NAME = 'mqtt_socket'
+# Socket of the supervisor host, which runs the supervisors of several PLCs in one process (in the tmp base directory)
+SUPERVISOR_HOST_SOCKET_NAME = 'supervisor_host_socket'
+# Command line argument of plc_supervisor.py, which runs the supervisor host instead of the supervisor of a single PLC
+SUPERVISOR_HOST_ARG = '--host'
+
+# Cf. <sys/inotify.h>
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+INOTIFY_READ_SIZE = 4096
+
+# Interval in s of checking the existence of a path, if inotify is not available
+POLL_INTERVAL = 0.05
+# Time in s between connection attempts, while the socket exists but the listener does not yet accept connections
+CONNECT_RETRY_INTERVAL = 0.01
+# Max. number of idle connections kept by a connection pool
+POOL_SIZE = 4
+# Time in s a connection pool waits for its listener to become ready
+POOL_CONNECT_TIMEOUT = 10
+# Number of threads of a server handling requests concurrently
+SERVER_WORKERS = 8
+# Max. number of connections pending to be accepted by a server
+SERVER_BACKLOG = 64
+SERVER_WAKEUP_READ_SIZE = 4096
+# Time in s a server thread waits for the next request on a connection before returning it to the polling thread
+SERVER_LINGER = 0.001
+# Length prefix of a message sent via a connection, as framed by multiprocessing's connections (cf. Client)
+MESSAGE_LENGTH = struct.Struct('!i')
+
+
+def load_inotify():
+    try:
+        libc = CDLL(find_library('c'), use_errno=True)
+        init = libc.inotify_init1
+        init.restype = c_int
+        init.argtypes = [c_int]
+        add_watch = libc.inotify_add_watch
+        add_watch.restype = c_int
+        add_watch.argtypes = [c_int, c_char_p, c_uint32]
+        return init, add_watch
+    except (OSError, AttributeError):
+        logger.warn('inotify is not available, falling back to polling.')
+        return None
+
+
+inotify = load_inotify()
+
+
+def get_socket_path(dev_name, socket_name):
+    return os.path.join(utils.get_tmp_base_path_from_mkfile(), dev_name, socket_name)
+
+
+def get_plc_socket_path(plc_name):
+    return get_socket_path(plc_name, PLC_SOCKET_NAME)
+
+
+def get_supervisor_host_socket_path():
+    return os.path.join(utils.get_tmp_base_path_from_mkfile(), SUPERVISOR_HOST_SOCKET_NAME)
+
+
+def get_remaining(deadline):
+    """Returns the remaining time in s until deadline (None: no deadline), at least 0."""
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time())
+
+
+def get_existing_ancestor(path):
+    path = os.path.abspath(path)
+    while not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def wait_for_path(path, timeout=None):
+    """Blocks until path exists, returns False if it did not appear within timeout (in s).
+
+    Uses inotify on the nearest existing ancestor directory of path, so that the path (and any of
+    its missing parent directories) may be created at any time.
+    """
+    deadline = None if timeout is None else time() + timeout
+    while not os.path.exists(path):
+        remaining = get_remaining(deadline)
+        if remaining == 0:
+            return False
+        if inotify is None:
+            sleep(POLL_INTERVAL if remaining is None else min(POLL_INTERVAL, remaining))
+            continue
+        init, add_watch = inotify
+        fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(get_errno(), os.strerror(get_errno()))
+        try:
+            watched = get_existing_ancestor(os.path.dirname(path))
+            if add_watch(fd, watched, IN_CREATE | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF) < 0:
+                raise OSError(get_errno(), os.strerror(get_errno()))
+            # Path may have been created before the watch has been added
+            if os.path.exists(path):
+                break
+            # Any event in the watched directory is a reason to check again
+            readable, _, _ = select([fd], [], [], get_remaining(deadline))
+            if readable:
+                os.read(fd, INOTIFY_READ_SIZE)
+        finally:
+            os.close(fd)
+    return True
+
+
+def connect(address, timeout=None):
+    """Returns a connection to the listener at address, blocking until the listener is ready.
+
+    Raises socket.error, if the listener is not ready within timeout (in s).
+    """
+    deadline = None if timeout is None else time() + timeout
+    while True:
+        if not wait_for_path(address, get_remaining(deadline)):
+            raise socket.error(errno.ETIMEDOUT, "Listener '{}' is not ready.".format(address))
+        try:
+            return MessageConnection(Client(address))
+        except socket.error as e:
+            # Socket file exists, but the listener does not listen yet (or has just been removed)
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+            if get_remaining(deadline) == 0:
+                raise
+            sleep(CONNECT_RETRY_INTERVAL)
+
+
+def connect_to_plc(plc_name, timeout=None):
+    """Returns a connection to the supervisor of a PLC, blocking until it is ready."""
+    return connect(get_plc_socket_path(plc_name), timeout)
+
+
+class ConnectionPool(object):
+    """Keeps long-lived connections to a listener, so that a request costs one round trip only.
+
+    Each connection is used by one request at a time, i.e., for each request the listener sends exactly one
+    response. Connections that broke, because the listener has been restarted, are replaced transparently, if
+    sending a request via them fails. A request is never sent twice, as it may have been handled already, if the
+    connection breaks while waiting for its response.
+    """
+
+    def __init__(self, address, size=POOL_SIZE, timeout=POOL_CONNECT_TIMEOUT):
+        self.address = address
+        self.size = size
+        self.timeout = timeout
+        self.idle = []
+        self.lock = Lock()
+        self.closed = False
+
+    def __acquire(self):
+        """Returns an idle connection (or a new one) and whether it has been reused."""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        return connect(self.address, self.timeout), False
+
+    def __release(self, conn):
+        with self.lock:
+            if not self.closed and len(self.idle) < self.size:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def __discard(self, conn):
+        try:
+            conn.close()
+        except (EOFError, IOError):
+            pass
+
+    def __call(self, msg, expect_response):
+        while True:
+            conn, reused = self.__acquire()
+            try:
+                conn.send(msg)
+            except (EOFError, IOError):
+                self.__discard(conn)
+                if not reused:
+                    raise
+                # Listener has been restarted, so all idle connections are stale
+                logger.debug("Reconnecting to listener '%s'.", self.address)
+                self.clear()
+                continue
+            except Exception:
+                self.__discard(conn)
+                raise
+            try:
+                result = conn.recv() if expect_response else None
+            except Exception:
+                # Connection is in an undefined state (e.g., it broke or the response could not be unpickled)
+                self.__discard(conn)
+                raise
+            self.__release(conn)
+            return result
+
+    def request(self, msg):
+        """Sends msg and returns the listener's response."""
+        return self.__call(msg, True)
+
+    def send(self, msg):
+        """Sends msg, for which the listener does not respond."""
+        self.__call(msg, False)
+
+    def clear(self):
+        with self.lock:
+            idle = self.idle
+            self.idle = []
+        for conn in idle:
+            self.__discard(conn)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.clear()
+
+
+class Future(object):
+    """The result of a request, which is available once the response has been received."""
+
+    def __init__(self):
+        self.event = Event()
+        self.value = None
+        self.exception = None
+
+    def set_result(self, value):
+        self.value = value
+        self.event.set()
+
+    def set_exception(self, exception):
+        self.exception = exception
+        self.event.set()
+
+    def done(self):
+        return self.event.is_set()
+
+    def result(self, timeout=None):
+        """Blocks until the response is available and returns it (or raises the exception of the request)."""
+        if not self.event.wait(timeout):
+            raise socket.error(errno.ETIMEDOUT, "Request timed out.")
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+    def then(self, fn):
+        """Returns a future of fn(result), fn is called by the thread that calls its result()."""
+        return MappedFuture(self, fn)
+
+
+class MappedFuture(Future):
+
+    def __init__(self, future, fn):
+        super(MappedFuture, self).__init__()
+        self.future = future
+        self.fn = fn
+        self.lock = Lock()
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        if not self.future.event.wait(timeout):
+            raise socket.error(errno.ETIMEDOUT, "Request timed out.")
+        with self.lock:
+            if not self.event.is_set():
+                try:
+                    self.set_result(self.fn(self.future.result()))
+                except Exception as e:
+                    self.set_exception(e)
+        return super(MappedFuture, self).result()
+
+
+class PipelinedClient(object):
+    """Sends any number of requests via one connection without waiting for their responses.
+
+    Each request gets an id, which the listener repeats in its response, so responses may arrive in any order. A
+    receiver thread resolves the future of each request. If the connection breaks, the futures of all pending
+    requests fail and the next request reconnects.
+    """
+
+    def __init__(self, address, timeout=POOL_CONNECT_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self.conn = None
+        # { request id: future } of the current connection
+        self.pending = {}
+        self.next_request_id = 1
+        # Guards the connection and request ids, and ensures that requests are sent in order of their ids
+        self.lock = Lock()
+
+    def request_async(self, msg):
+        """Sends msg and returns a future of the listener's response."""
+        future = Future()
+        with self.lock:
+            try:
+                if self.conn is None:
+                    self.conn = connect(self.address, self.timeout)
+                    self.pending = {}
+                    receiver = Thread(target=self.__receive, args=(self.conn, self.pending))
+                    receiver.daemon = True
+                    receiver.start()
+                request_id = self.next_request_id
+                self.next_request_id = self.next_request_id % MAX_REQUEST_ID + 1
+                self.pending[request_id] = future
+                self.conn.send(msg, request_id)
+            except (EOFError, IOError) as e:
+                self.__reset()
+                future.set_exception(e)
+        return future
+
+    def request(self, msg, timeout=None):
+        return self.request_async(msg).result(timeout)
+
+    def __receive(self, conn, pending):
+        try:
+            while True:
+                request_id, result = conn.recv_frame()
+                with self.lock:
+                    future = pending.pop(request_id, None)
+                if future is not None:
+                    future.set_result(result)
+                else:
+                    logger.error("Received response to unknown request %d.", request_id)
+        except (EOFError, IOError) as e:
+            with self.lock:
+                if self.conn is conn:
+                    self.__reset()
+                failed = pending.values()
+                pending.clear()
+            for future in failed:
+                future.set_exception(e if isinstance(e, IOError) else IOError(errno.ECONNRESET, "Connection lost."))
+
+    def __reset(self):
+        # Must hold lock, the receiver thread fails the pending futures once the connection has been shut down
+        if self.conn is not None:
+            try:
+                # Wakes up the receiver thread, which may be blocked in recv
+                self.conn.shutdown()
+                self.conn.close()
+            except (EOFError, IOError):
+                pass
+            self.conn = None
+
+    def close(self):
+        with self.lock:
+            self.__reset()
+
+
+class SocketConnection(object):
+    """A connection accepted by a Server, which frames messages like multiprocessing's connections (cf. Client)."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.poller = poll()
+        self.poller.register(sock.fileno(), POLLIN)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def poll(self, timeout=0.0):
+        return bool(self.poller.poll(None if timeout is None else timeout * 1000))
+
+    def recv_bytes(self):
+        size, = MESSAGE_LENGTH.unpack(self.__recv_exactly(MESSAGE_LENGTH.size, True))
+        return self.__recv_exactly(size)
+
+    def __recv_exactly(self, size, first=False):
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = self.sock.recv(remaining)
+            if not chunk:
+                # Closed between two messages or within a message
+                if first and remaining == size:
+                    raise EOFError
+                raise IOError("Connection closed during message.")
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b''.join(chunks)
+
+    def send_bytes(self, data):
+        self.sock.sendall(MESSAGE_LENGTH.pack(len(data)) + data)
+
+    def close(self):
+        self.sock.close()
+
+
+class MessageConnection(object):
+    """A connection, which sends and receives messages in the wire format (cf. wireformat.Codec)."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        # Still known after the connection has been closed
+        self.fd = conn.fileno()
+        self.codec = Codec()
+
+    def fileno(self):
+        return self.fd
+
+    def poll(self, timeout=0.0):
+        return self.conn.poll(timeout)
+
+    def recv(self):
+        return self.codec.decode(self.conn.recv_bytes())
+
+    def recv_frame(self):
+        """Returns the request id and the message received next."""
+        return self.codec.decode_frame(self.conn.recv_bytes())
+
+    def send(self, obj, request_id=0):
+        self.conn.send_bytes(self.codec.encode(obj, request_id))
+
+    def shutdown(self):
+        """Shuts down both directions of the connection, which wakes up a thread blocked in recv."""
+        sock = socket.fromfd(self.fd, socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        finally:
+            sock.close()
+
+    def close(self):
+        self.conn.close()
+
+
+class ServerConnection(MessageConnection):
+    """A connection accepted by a Server, which may be sent to by several threads (e.g., monitoring).
+
+    A response sent by the thread, which has received the request, repeats the request's id.
+    """
+
+    def __init__(self, conn):
+        super(ServerConnection, self).__init__(conn)
+        # Messages must be encoded in the order in which they are sent
+        self.send_lock = Lock()
+        # Id of the request received last by the current thread
+        self.local = local()
+
+    def recv(self):
+        self.local.request_id, msg = self.recv_frame()
+        return msg
+
+    def send(self, obj, request_id=None):
+        if request_id is None:
+            request_id = getattr(self.local, 'request_id', 0)
+        with self.send_lock:
+            super(ServerConnection, self).send(obj, request_id)
+
+    def close(self):
+        with self.send_lock:
+            super(ServerConnection, self).close()
+
+
+class Server(object):
+    """Serves many long-lived connections at address, each of which may carry any number of requests.
+
+    A single thread polls the listener and all connections. Whenever a connection is readable, it is removed
+    from the poll set and its next message is received and handled by a worker thread, so that neither a slow
+    client nor a slow request holds up the other connections. handler(conn, msg) is called for every message
+    and returns True to keep reading from conn, False if no further messages should be read from conn (e.g.,
+    because conn has been handed over to another thread), or None if conn should be closed. Handlers must not
+    close conn themselves, as its fd could be reused by a new connection before the server forgets about conn.
+    """
+
+    def __init__(self, address, handler, workers=SERVER_WORKERS, ordered=True):
+        self.address = address
+        self.handler = handler
+        self.workers = workers
+        # If False, the requests of a connection are handled concurrently (and responded to in any order)
+        self.ordered = ordered
+        self.stopped = Event()
+        # Connections whose request has been handled: [(conn, keep reading)], passed back to the polling thread
+        self.done = []
+        self.done_lock = Lock()
+        self.wakeup_r, self.wakeup_w = os.pipe()
+        self.closed = False
+
+    def serve_forever(self):
+        # Ensure that socket does not exist
+        try:
+            os.unlink(self.address)
+        except OSError:
+            if os.path.exists(self.address):
+                logger.exception('Could not remove socket file.')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.address)
+        listener.listen(SERVER_BACKLOG)
+        listener_fd = listener.fileno()
+        poller = poll()
+        poller.register(listener_fd, POLLIN)
+        poller.register(self.wakeup_r, POLLIN)
+        pool = ThreadPool(self.workers)
+        # { fd: ServerConnection }
+        conns = {}
+        logger.debug("Listener '%s' ready.", self.address)
+        try:
+            while not self.stopped.is_set():
+                for fd, event in poller.poll():
+                    if fd == listener_fd:
+                        conn = ServerConnection(SocketConnection(listener.accept()[0]))
+                        conns[conn.fileno()] = conn
+                        poller.register(conn.fileno(), POLLIN)
+                    elif fd == self.wakeup_r:
+                        os.read(self.wakeup_r, SERVER_WAKEUP_READ_SIZE)
+                        with self.done_lock:
+                            done = self.done
+                            self.done = []
+                        for conn, keep_reading in done:
+                            self.__rearm(poller, conns, conn, keep_reading)
+                    elif fd in conns:
+                        # Connection is not polled while its request is being handled
+                        poller.unregister(fd)
+                        if event & POLLNVAL:
+                            del conns[fd]
+                        else:
+                            pool.apply_async(self.__serve_request, (conns[fd],))
+        finally:
+            pool.close()
+            listener.close()
+            # Clients must not connect to the closed server's socket file
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+            for conn in conns.values():
+                conn.close()
+            with self.done_lock:
+                self.closed = True
+                os.close(self.wakeup_r)
+                os.close(self.wakeup_w)
+        logger.debug("Listener '%s' closed.", self.address)
+
+    def __rearm(self, poller, conns, conn, keep_reading):
+        """Polls conn again or forgets about it, must only be called by the polling thread."""
+        fd = conn.fileno()
+        # conn has already been closed (e.g., by the request of an unordered server handled first), its fd may have
+        # been reused by a new connection
+        if conns.get(fd) is not conn:
+            return
+        if keep_reading:
+            poller.register(fd, POLLIN)
+            return
+        del conns[fd]
+        try:
+            poller.unregister(fd)
+        except KeyError:
+            # Not polled while its request is being handled
+            pass
+        if keep_reading is None:
+            conn.close()
+
+    def __serve_request(self, conn):
+        if not self.ordered:
+            self.__serve_request_unordered(conn)
+            return
+        keep_reading = True
+        try:
+            # Clients usually send their next request right after the response, so keep serving the connection
+            # for a moment instead of handing it back to the polling thread after each request
+            while keep_reading:
+                keep_reading = self.__handle(conn, conn.recv())
+                if not keep_reading or not conn.poll(SERVER_LINGER):
+                    break
+        except (EOFError, IOError):
+            # Connection has been closed by the client
+            keep_reading = None
+        except Exception:
+            logger.exception("Handling message received by listener '%s' failed.", self.address)
+            keep_reading = None
+        self.__release(conn, keep_reading)
+
+    def __serve_request_unordered(self, conn):
+        try:
+            msg = conn.recv()
+        except (EOFError, IOError):
+            self.__release(conn, None)
+            return
+        # Next request of the connection may be handled by another thread in the meantime
+        self.__release(conn, True)
+        try:
+            keep_reading = self.__handle(conn, msg)
+        except Exception:
+            logger.exception("Handling message received by listener '%s' failed.", self.address)
+            keep_reading = None
+        if not keep_reading:
+            self.__release(conn, keep_reading)
+
+    def __handle(self, conn, msg):
+        """Returns whether to keep reading from conn (None, if it should be closed)."""
+        result = self.handler(conn, msg)
+        return None if result is None else result is not False
+
+    def __release(self, conn, keep_reading):
+        """Passes conn back to the polling thread."""
+        with self.done_lock:
+            self.done.append((conn, keep_reading))
+            self.__wakeup()
+
+    def __wakeup(self):
+        # Must hold done_lock, pipe is closed once the server has stopped
+        if not self.closed:
+            os.write(self.wakeup_w, b'x')
+
+    def shutdown(self):
+        """Stops serving, may be called by the handler."""
+        self.stopped.set()
+        with self.done_lock:
+            self.__wakeup()
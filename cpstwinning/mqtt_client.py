@@ -2,7 +2,8 @@
 
 from cpstwinning.constants import LOG_FILE_LOC, LOG_LEVEL
 from cpstwinning.mqttmessages import ConnectMessage, PublishMessage, DisconnectMessage, CloseMessage
-from multiprocessing.connection import Listener
+from cpstwinning.ipc import MQTT_SOCKET_NAME, Server, get_socket_path
+from threading import Lock
 
 import paho.mqtt.client as mqtt
 import sys
@@ -20,6 +21,7 @@ class MqttClient(object):
     def __init__(self, name):
         self.name = name
         self.is_connected = False
+        self.lock = Lock()
         self.__init_listener()
 
     def __init_listener(self):
@@ -32,6 +34,33 @@ class MqttClient(object):
             self.client.disconnect()
             self.is_connected = False
 
+        def handle_message(conn, msg):
+            # Messages of concurrent connections are handled one after another
+            with self.lock:
+                if isinstance(msg, ConnectMessage):
+                    if msg.auth is not None:
+                        username = msg.auth['username']
+                        password = msg.auth['password']
+                        if username is None:
+                            logger.error(
+                                "Could not authenticate MQTT client [name=%s], " +
+                                "because username has no username has been provided.",
+                                self.name
+                            )
+                        else:
+                            self.client.username_pw_set(username, password=password)
+                    self.client.connect(msg.host, msg.port, msg.keepalive, msg.bind_address)
+                    self.client.loop_start()
+                elif isinstance(msg, PublishMessage):
+                    self.client.publish(msg.topic, msg.payload, msg.qos, msg.retain)
+                elif isinstance(msg, DisconnectMessage):
+                    disconnect()
+                elif isinstance(msg, CloseMessage):
+                    disconnect()
+                    self.server.shutdown()
+                    return None
+                return True
+
         # Create MQTT client
         self.client = mqtt.Client()
         self.client.on_connect = on_connect
@@ -40,41 +69,9 @@ class MqttClient(object):
         # Create device base path if it does not exist
         if not os.path.exists(dev_base_path):
             os.makedirs(dev_base_path)
-        address = os.path.join(dev_base_path, 'mqtt_socket')
-        # Ensure that socket does not exist
-        try:
-            os.unlink(address)
-        except OSError:
-            if os.path.exists(address):
-                logger.exception('Could not remove socket file.')
-        # Create listener
-        listener = Listener(address)
-        while True:
-            conn = listener.accept()
-            msg = conn.recv()
-            if isinstance(msg, ConnectMessage):
-                if msg.auth is not None:
-                    username = msg.auth['username']
-                    password = msg.auth['password']
-                    if username is None:
-                        logger.error(
-                            "Could not authenticate MQTT client [name=%s], " +
-                            "because username has no username has been provided.",
-                            self.name
-                        )
-                    else:
-                        self.client.username_pw_set(username, password=password)
-                self.client.connect(msg.host, msg.port, msg.keepalive, msg.bind_address)
-                self.client.loop_start()
-            elif isinstance(msg, PublishMessage):
-                self.client.publish(msg.topic, msg.payload, msg.qos, msg.retain)
-            elif isinstance(msg, DisconnectMessage):
-                disconnect()
-            elif isinstance(msg, CloseMessage):
-                disconnect()
-                conn.close()
-                break
-        listener.close()
+        # Serves many long-lived client connections concurrently
+        self.server = Server(get_socket_path(self.name, MQTT_SOCKET_NAME), handle_message)
+        self.server.serve_forever()
 
 
 def main():
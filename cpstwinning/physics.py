@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fixed step of the simulation in s (of the PLC's virtual time)
+PHYSICS_STEP = 0.05
+# Steps made at most per tick, the simulation skips time beyond (e.g., if the device runtime has been busy)
+PHYSICS_MAX_STEPS_PER_TICK = 10
+# Time constant in s, with which the speed of a motor follows its target velocity
+MOTOR_TIME_CONSTANT = 0.5
+# Maximum acceleration of a motor in velocity units per s
+MOTOR_MAX_ACCELERATION = 100.0
+# Load of a motor in % per velocity unit (friction) and per velocity unit per s of acceleration (inertia)
+MOTOR_FRICTION_LOAD = 0.2
+MOTOR_INERTIA_LOAD = 0.1
+MOTOR_MAX_LOAD = 100.0
+
+
+class MotorVars(object):
+    """Names of the motor vars, which the physics engine reads (commands) or writes (state).
+
+    The state vars are only simulated if they are declared in the motor's PLCVarMap of the specification, and are only
+    fed back to the PLC if they are linked to PLC variables there (cf. Motor1 in CandyFactory.aml).
+    """
+    RUN = 'Run'
+    VELOCITY = 'Velocity'
+    SPEED = 'Speed'
+    POSITION = 'Position'
+    LOAD = 'Load'
+
+    def __setattr__(self, *_):
+        pass
+
+
+# Order of the columns of the state written back
+MOTOR_STATE_VARS = [MotorVars.SPEED, MotorVars.POSITION, MotorVars.LOAD]
+
+
+class MotorPhysics(object):
+    """Fixed-step simulation of the motors controlled by a PLC.
+
+    The state of all motors is kept in NumPy arrays, which are advanced together by one integration step per tick of
+    the device runtime, so that the cost of a tick hardly grows with the number of motors. The speed of a running motor
+    follows its velocity (set by the PLC) with a first-order lag and limited acceleration. State that has changed is
+    written to the motor's vars and to the PLC tags mapped to them (cf. plc_vars_map), i.e., fed back to the PLC.
+    """
+
+    def __init__(self, runtime, plc, step=PHYSICS_STEP):
+        self.runtime = runtime
+        self.plc = plc
+        self.step = step
+        self.motors = []
+        # Commands
+        self.run = np.zeros(0, dtype=bool)
+        self.velocity = np.zeros(0)
+        # State
+        self.speed = np.zeros(0)
+        self.position = np.zeros(0)
+        self.load = np.zeros(0)
+        # Index of the motor var of each state var (-1 if the motor has no such var), one row per motor
+        self.state_var_idxs = np.zeros((0, len(MOTOR_STATE_VARS)), dtype=np.int64)
+        # Values of the state vars last written, one row per motor
+        self.written = np.zeros((0, len(MOTOR_STATE_VARS)), dtype=np.int64)
+        # { (motor idx, state var idx): PLC tag name }
+        self.state_tags = {}
+        # Virtual time of the PLC in ns up to which the simulation has been advanced
+        self.time = None
+        self.running = False
+
+    def add_motor(self, motor):
+        """Adds the motor to the simulation, returns its index in the state arrays."""
+        idx = len(self.motors)
+        self.motors.append(motor)
+        var_idxs = dict((v['name'], i) for i, v in enumerate(motor.vars))
+        tags = dict((i, tag) for tag, i in motor.plc_vars_map.iteritems())
+        state_var_idxs = []
+        for col, name in enumerate(MOTOR_STATE_VARS):
+            var_idx = var_idxs.get(name, -1)
+            state_var_idxs.append(var_idx)
+            if var_idx in tags:
+                self.state_tags[(idx, col)] = tags[var_idx]
+        self.run = np.append(self.run, False)
+        self.velocity = np.append(self.velocity, 0.0)
+        self.speed = np.append(self.speed, 0.0)
+        self.position = np.append(self.position, 0.0)
+        self.load = np.append(self.load, 0.0)
+        self.state_var_idxs = np.vstack((self.state_var_idxs, state_var_idxs))
+        self.written = np.vstack((self.written, np.zeros(len(MOTOR_STATE_VARS), dtype=np.int64)))
+        return idx
+
+    def get_command_tags(self, motor):
+        """Returns the PLC tags mapped to vars of the motor that are no state vars, i.e., are not written back."""
+        return [tag for tag, i in motor.plc_vars_map.iteritems() if motor.vars[i]['name'] not in MOTOR_STATE_VARS]
+
+    def set_command(self, idx, name, value):
+        """Sets the command of the motor with the given index, must be called by the device runtime's thread."""
+        if name == MotorVars.RUN:
+            self.run[idx] = value
+        elif name == MotorVars.VELOCITY:
+            self.velocity[idx] = value
+
+    def start(self):
+        """Starts the simulation, no motors must be added afterwards."""
+        self.running = True
+        self.runtime.call_soon(self.__start)
+
+    def __start(self):
+        # Commands set while motors were added may have been lost, when the arrays were replaced
+        for idx, motor in enumerate(self.motors):
+            for var in motor.vars:
+                self.set_command(idx, var['name'], var['value'])
+        self.time = self.plc.get_current_time()
+        self.runtime.call_later(self.step, self.__tick, (), self.plc)
+
+    def stop(self):
+        self.running = False
+
+    def __tick(self):
+        if not self.running:
+            return
+        step_ns = int(self.step * 1e9)
+        now = self.plc.get_current_time()
+        steps = (now - self.time) // step_ns
+        if steps > PHYSICS_MAX_STEPS_PER_TICK:
+            logger.debug("Physics simulation of PLC '%s' skips %d steps.", self.plc.name,
+                         steps - PHYSICS_MAX_STEPS_PER_TICK)
+            steps = PHYSICS_MAX_STEPS_PER_TICK
+            self.time = now
+        else:
+            self.time += steps * step_ns
+        for _ in xrange(steps):
+            self.__integrate()
+        if steps > 0:
+            self.__write_back()
+        self.runtime.call_later(self.step, self.__tick, (), self.plc)
+
+    def __integrate(self):
+        """Advances the state of all motors by one step (explicit Euler)."""
+        target = np.where(self.run, self.velocity, 0.0)
+        acceleration = np.clip((target - self.speed) / MOTOR_TIME_CONSTANT, -MOTOR_MAX_ACCELERATION,
+                               MOTOR_MAX_ACCELERATION)
+        self.speed += acceleration * self.step
+        self.position += self.speed * self.step
+        self.load = np.minimum(MOTOR_FRICTION_LOAD * np.abs(self.speed) + MOTOR_INERTIA_LOAD * np.abs(acceleration),
+                               MOTOR_MAX_LOAD)
+
+    def __write_back(self):
+        state = np.rint(np.column_stack((self.speed, self.position, self.load))).astype(np.int64)
+        changed = np.logical_and(self.state_var_idxs >= 0, state != self.written)
+        for idx, col in zip(*np.nonzero(changed)):
+            value = int(state[idx, col])
+            self.motors[idx].vars[self.state_var_idxs[idx, col]]['value'] = value
+            tag = self.state_tags.get((idx, col))
+            if tag is not None:
+                # Not waited for, the PLC processes the writes in order
+                self.plc.write_var_value_async(tag, value)
+        self.written[changed] = state[changed]
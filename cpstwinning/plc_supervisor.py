@@ -2,16 +2,20 @@
 
 from cpstwinning.utils import UnknownPlcTagException, NotSupportedPlcTagTypeException, NotSupportedPlcTagClassException
 from cpstwinning.constants import LOG_FILE_LOC, LOG_LEVEL
+from cpstwinning.processimage import get_process_image_path, PLC_TIME_MODES
+from cpstwinning.plcbuild import build_plc, signal_ready
+from cpstwinning.ipc import PLC_SOCKET_NAME, SUPERVISOR_HOST_ARG, Server, get_supervisor_host_socket_path
 from cpstwinning.plcmessages import StartMessage, StopMessage, ShowTagsMessage, ShowTagsResponseMessage, \
     GetTagMessage, GetTagResponseMessage, SetTagMessage, SetTagResponseMessage, CloseMessage, TerminateMessage, \
     MonitorMessage, MonitorResponseMessage, GetTagsMessage, GetTagsResponseMessage, GetAllTagNamesMessage, \
-    GetAllTagNamesResponseMessage, StopMonitoringMessage
-from multiprocessing.connection import Listener
-from subprocess import Popen
-from threading import Event, Thread
-from ctypes import c_void_p, c_int, byref, POINTER, cdll, cast, \
-    c_bool, CFUNCTYPE
-from time import sleep
+    GetAllTagNamesResponseMessage, StopMonitoringMessage, GetAllValuesMessage, GetAllValuesResponseMessage, \
+    SetTimeModeMessage, StepMessage, StepResponseMessage, GetScanStatsMessage, ScanStatsResponseMessage, \
+    MonitorPolicies, MonitorBatchResponseMessage, HostPlcMessage, SuccessPlcMessage, FailedPlcMessage
+from threading import Event, Lock, Thread, Condition
+from collections import deque, OrderedDict
+from ctypes import c_void_p, c_int, byref, POINTER, CDLL, RTLD_LOCAL, cast, \
+    c_bool, c_int8, c_int16, c_int32, c_int64, c_uint, c_uint64, c_ulong, c_char_p, c_double, Structure
+from time import time
 from pymodbus.server.sync import ModbusTcpServer
 from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext, ModbusSparseDataBlock, ModbusSequentialDataBlock
 # from pymodbusexamples.thread_safe_datastore import ThreadSafeDataBlock
@@ -27,6 +31,17 @@ import pickle
 logging.basicConfig(filename=LOG_FILE_LOC, level=LOG_LEVEL)
 logger = logging.getLogger('plc_supervisor')
 
+# Maximum number of variable changes fetched from the PLC runtime per lib call
+VAR_CHANGES_BATCH_SIZE = 256
+# Time in ms the drain thread blocks in the PLC runtime waiting for variable changes
+VAR_CHANGES_TIMEOUT_MS = 100
+# Number of log2 buckets of the scan cycle histograms (cf. plcruntime/inc/plc_scan_stats.h)
+SCAN_STATS_BUCKETS = 32
+# Maximum number of changes queued per monitoring connection
+MONITOR_QUEUE_SIZE = 4096
+# Time in s to wait for a monitoring connection to send its final message (e.g., on termination)
+MONITOR_CLOSE_TIMEOUT = 1.0
+
 
 class PlcClasses(object):
     IN = "in"
@@ -49,16 +64,117 @@ class PlcTypes(object):
         pass
 
 
+# C types of the values of the supported PLC types (cf. iec_types.h of MatIEC)
+PLC_TYPES_CTYPES = {
+    PlcTypes.BOOL: c_bool,
+    PlcTypes.SINT: c_int8,
+    PlcTypes.INT: c_int16,
+    PlcTypes.DINT: c_int32
+}
+# Classes of variables whose struct holds a pointer to the value
+PLC_LOCATED_CLASSES = (PlcClasses.IN, PlcClasses.OUT, PlcClasses.MEM)
+
+
+class PlcVar(object):
+    """Entry of the vars table, its position in the table equals the index of the var in the PLC runtime."""
+    __slots__ = ('idx', 'name', 'clazz', 'type', 'value', 'accessor')
+
+    def __init__(self, idx, name, clazz, type):
+        self.idx = idx
+        self.name = name
+        self.clazz = clazz
+        self.type = type
+        # Last value reported by the PLC runtime (only up to date while the var is watched)
+        self.value = None
+        # Typed ctypes pointer to the value, bound once the lib has been loaded
+        self.accessor = None
+
+    def is_supported(self):
+        return self.type in PLC_TYPES_CTYPES
+
+    def convert(self, raw):
+        """Converts a raw int64 value of the PLC runtime, returns None for not supported types."""
+        if self.type == PlcTypes.BOOL:
+            return bool(raw)
+        elif self.type == PlcTypes.INT or self.type == PlcTypes.DINT or self.type == PlcTypes.SINT:
+            return int(raw)
+        return None
+
+    def read(self):
+        if self.clazz in PLC_LOCATED_CLASSES:
+            return self.accessor[0][0]
+        return self.accessor[0]
+
+    def to_dict(self):
+        return {'class': self.clazz, 'name': self.name, 'type': self.type, 'value': self.value}
+
+
+class VarChange(Structure):
+    """Variable change recorded by the PLC runtime (cf. plcruntime/inc/plc_vars.h)."""
+    _fields_ = [('idx', c_int32), ('tick', c_int32), ('value', c_int64), ('timestamp', c_int64)]
+
+
+class ScanStats(Structure):
+    """Timing statistics of the scan cycles (cf. plcruntime/inc/plc_scan_stats.h)."""
+    _fields_ = [('cycles', c_uint64), ('overruns', c_uint64), ('missed_ticks', c_uint64), ('timed_cycles', c_uint64),
+                ('lateness_sum', c_int64), ('lateness_max', c_int64), ('exec_sum', c_int64), ('exec_max', c_int64),
+                ('lateness_hist', c_uint64 * SCAN_STATS_BUCKETS), ('exec_hist', c_uint64 * SCAN_STATS_BUCKETS)]
+
+    def to_dict(self):
+        return {
+            'cycles': self.cycles,
+            'overruns': self.overruns,
+            'missed_ticks': self.missed_ticks,
+            'timed_cycles': self.timed_cycles,
+            'lateness_sum': self.lateness_sum,
+            'lateness_max': self.lateness_max,
+            'exec_sum': self.exec_sum,
+            'exec_max': self.exec_max,
+            # Bucket i counts durations in [2^i, 2^(i+1)) ns
+            'lateness_hist': list(self.lateness_hist),
+            'exec_hist': list(self.exec_hist)
+        }
+
+
 class PlcSupervisor(object):
+    """Supervises the PLC runtime of a single PLC, several of which may run in the same process (cf.
+    PlcSupervisorHost).
 
-    def __init__(self):
-        # TODO: Error handling
-        self.name = sys.argv[1]
-        st_path = sys.argv[2]
-        mb_map_path = sys.argv[3]
+    The Modbus server of the PLC listens in the network namespace at netns_path (if given, otherwise in the one of
+    the process), i.e., of the PLC's Mininet host.
+    """
 
-        self.conn_watcher = []
-        self.build_finished = False
+    def __init__(self, name, st_path, mb_map_path, netns_path=None, build_profile=None):
+        # TODO: Error handling
+        self.name = name
+        self.netns_path = netns_path
+        self.terminated = False
+        # Held by the requests of the listener, which start or stop the PLC or access it via the lib (so that the PLC
+        # is not stopped meanwhile), but never while waiting for scan cycles or sending a response
+        self.lock = Lock()
+        # Serializes steps, so that the changes of a step are not mixed up with the ones of another
+        self.step_lock = Lock()
+        # PLC initially not running
+        self.running = False
+        self.time_mode = 'realtime'
+        self.plc_thread = None
+
+        # { var idx: (MonitorSubscriber, ...) }, replaced as a whole on change, so that it is read without locking
+        self.watchers = {}
+        # { connection: MonitorSubscriber }
+        self.subscribers = {}
+        # Subscribers, which receive a batch of changes per scan cycle
+        self.batch_subscribers = ()
+        # Scan cycle of the changes processed last
+        self.tick = 0
+        # Number of changes drained from the runtime (modulo 2**32, as the runtime counts recorded changes)
+        self.drained_var_changes = 0
+        self.drained_cond = Condition()
+        # (tick, idx, value) of the changes drained while stepping, cf. step
+        self.step_changes = None
+        self.watchers_lock = Lock()
+        # Set as soon as the PLC has been initialized (or its initialization failed)
+        self.initialized = Event()
         # Get value of DSTDIR key in Makefile
         self.tmp_path = utils.get_dstdir_path_from_mkfile(self.name)
         # Path of the VARIABLES.csv file, generated by MatIEC
@@ -70,9 +186,13 @@ class PlcSupervisor(object):
             # self.listener_thread.daemon = True
             self.listener_thread.start()
 
-            # Build lib
-            self.__run_make(st_path)
-            self.build_finished = True
+            # Build lib (or restore it from the build cache)
+            build_start = time()
+            build_result = build_plc(self.name, st_path, profile=build_profile)
+            build_time = time() - build_start
+            if not build_result.success:
+                raise RuntimeError("Building PLC '{}' failed.".format(self.name))
+            load_start = time()
 
             # Parse variables from CSV file and set them
             self.__set_vars()
@@ -80,8 +200,9 @@ class PlcSupervisor(object):
             # Initialize Modbus map
             self.__init_modbus_map(mb_map_path)
 
-            # Load lib
-            self.lib = cdll.LoadLibrary("{}/lib{}.so".format(utils.get_dstdir_path_from_mkfile(self.name), self.name))
+            # Load lib, its symbols are not made available to the libs of other PLCs loaded into the same process
+            # (each PLC has its own copy of the lib, as dlopen would return the handle of an already loaded file)
+            self.lib = CDLL("{}/lib{}.so".format(self.tmp_path, self.name), mode=RTLD_LOCAL)
 
             # Private lib methods:
             self.__start_plc = self.lib.start_plc
@@ -94,45 +215,85 @@ class PlcSupervisor(object):
             self.__get_ref_by_idx_t = self.lib.get_ref_by_idx_t
             self.__get_ref_by_idx_t.restype = c_int
             self.__get_ref_by_idx_t.argtypes = [c_int, POINTER(c_void_p)]
-            self.__set_int_val_by_idx_p = self.lib.set_int_val_by_idx_p
-            self.__set_int_val_by_idx_p.restype = c_int
-            self.__set_int_val_by_idx_p.argtypes = [c_int, c_void_p]
-            self.__set_int_val_by_idx_t = self.lib.set_int_val_by_idx_t
-            self.__set_int_val_by_idx_t.restype = c_int
-            self.__set_int_val_by_idx_t.argtypes = [c_int, c_void_p]
-
-            # First arg is return type (= void), after that: method args
-            self.callback_type = CFUNCTYPE(None, c_int)
-            # Prevent GC, otherwise program will fail with:
-            # Traceback (most recent call last):
-            #   File "_ctypes/callbacks.c", line 314, in 'calling callback function'
-            # TypeError: <genexpr>() takes exactly 1 argument (2 given)
-            self.callback_func = self.get_callback_function()
-
-            self.__register_var_change_callback = self.lib.register_var_change_callback
-            self.__register_var_change_callback.restype = None
-            self.__register_var_change_callback.argtypes = [self.callback_type]
-            self.__register_var_change_callback(self.callback_func)
-
-            # PLC initially not running
-            self.running = False
+            self.__set_var_value_by_idx = self.lib.set_var_value_by_idx
+            self.__set_var_value_by_idx.restype = c_int
+            self.__set_var_value_by_idx.argtypes = [c_int, c_int64]
+
+            self.get_var_changes = self.lib.get_var_changes
+            self.get_var_changes.restype = c_int
+            self.get_var_changes.argtypes = [POINTER(VarChange), c_int, c_int]
+            self.get_dropped_var_changes = self.lib.get_dropped_var_changes
+            self.get_dropped_var_changes.restype = c_ulong
+            self.__get_recorded_var_changes = self.lib.get_recorded_var_changes
+            self.__get_recorded_var_changes.restype = c_uint
+            self.__set_var_watched = self.lib.set_var_watched
+            self.__set_var_watched.restype = c_int
+            self.__set_var_watched.argtypes = [c_int, c_int]
+            self.__open_process_image = self.lib.open_process_image
+            self.__open_process_image.restype = c_int
+            self.__open_process_image.argtypes = [c_char_p]
+            self.__close_process_image = self.lib.close_process_image
+            self.__close_process_image.restype = c_int
+            self.__get_all_values = self.lib.get_all_values
+            self.__get_all_values.restype = c_int
+            self.__get_all_values.argtypes = [POINTER(c_int64), c_int]
+            self.__set_time_mode = self.lib.set_time_mode
+            self.__set_time_mode.restype = c_int
+            self.__set_time_mode.argtypes = [c_int, c_double]
+            self.__step_plc = self.lib.step_plc
+            self.__step_plc.restype = c_int
+            self.__step_plc.argtypes = [c_int]
+            self.__get_plc_time = self.lib.get_plc_time
+            self.__get_plc_time.restype = c_int64
+            self.__get_tick_time = self.lib.get_tick_time
+            self.__get_tick_time.restype = c_int64
+            self.__get_scan_stats = self.lib.get_scan_stats
+            self.__get_scan_stats.restype = c_int
+            self.__get_scan_stats.argtypes = [POINTER(ScanStats)]
+            self.__reset_scan_stats = self.lib.reset_scan_stats
+            self.__reset_scan_stats.restype = None
+
+            # Resolve the typed accessors of all vars once
+            self.__bind_accessors()
+
+            # The runtime only records changes of watched vars, vars mapped to Modbus are watched throughout
+            for idx in self.mb_reverse_map:
+                self.__set_var_watched(idx, 1)
+
+            # Publish process image, which is updated at the end of each scan cycle
+            self.process_image_path = get_process_image_path(self.tmp_path)
+            if self.__open_process_image(self.process_image_path) != 0:
+                logger.error("Could not open process image '%s'.", self.process_image_path)
+
             # Start PLC
             self.start()
 
-        except Exception:
+            # Pass readiness barrier of the twinning process
+            signal_ready(self.tmp_path, self.running, build_time=build_time, load_time=time() - load_start,
+                         cached=build_result.cached)
+        except Exception as e:
             logger.exception("ERROR")
+            signal_ready(self.tmp_path, False, error=str(e))
+        finally:
+            self.initialized.set()
 
     def __init_modbus_map(self, mb_map_path):
+        # { idx: [(table name, address), ...] }
+        # A var may be mapped into several tables (e.g., a coil and a discrete input)
+        self.mb_reverse_map = {}
         if mb_map_path:
             with open(mb_map_path, 'rb') as handle:
                 tmp_mb_map = pickle.loads(handle.read())
                 # Replace the name of the PLC var with its respective index in the vars list
                 for ktbl, vtbl in tmp_mb_map.iteritems():
-                    for k, v in vtbl.iteritems():
-                        nm = filter(lambda n: n.get('name').lower() == v.lower(), self.vars)
-                        if len(nm) > 0:
-                            vtbl[k] = self.vars.index(nm[0])
+                    for k, v in vtbl.items():
+                        idx = self.var_idx.get(v.upper())
+                        if idx is not None:
+                            vtbl[k] = idx
+                            self.mb_reverse_map.setdefault(idx, []).append((ktbl, k))
                         else:
+                            # Drop the entry, so that the address is not backed by a var
+                            del vtbl[k]
                             logger.warn(
                                 'Could not successfully initialize Modbus map, because PLC var [name=%s]' +
                                 ' could not be found.', v)
@@ -141,158 +302,126 @@ class PlcSupervisor(object):
             # idx: index of vars array
             self.mb_map = tmp_mb_map
 
-    def __notify_watcher(self, idx, new_value):
-        var_value = self.vars[idx]['value']
-        var_name = self.vars[idx]['name']
-        # Only notify monitoring threads if variable value has really changed
-        if var_value is None or var_value != new_value:
-            for conn_el in self.conn_watcher:
-                if var_name in conn_el['var_names']:
-                    try:
-                        conn_el['conn'].send(MonitorResponseMessage(var_name, new_value))
-                    except (EOFError, IOError):
-                        # Socket is no longer alive
-                        del self.conn_watcher[self.conn_watcher.index(conn_el)]
-            # Update variable's value
-            self.vars[idx]['value'] = new_value
+    def __notify_watcher(self, idx, new_value, tick):
+        # The value has really changed, the PLC runtime only records assignments of different values
+        var = self.vars[idx]
+        subscribers = self.watchers.get(idx)
+        if subscribers:
+            msg = MonitorResponseMessage(var.name, new_value)
+            for subscriber in subscribers:
+                # Never blocks, the subscriber's thread sends the change
+                subscriber.put(idx, msg, tick)
+        # Update variable's value
+        var.value = new_value
+
+    def __end_scan_cycle(self):
+        for subscriber in self.batch_subscribers:
+            subscriber.end_cycle()
+
+    def monitor(self, conn, var_names, policy, batch=False, min_interval=0.0, deadband=0.0):
+        """Sends changes of the given vars via conn, vars monitored via the same connection extend its watcher."""
+        with self.watchers_lock:
+            subscriber = self.subscribers.get(conn)
+            if subscriber is None:
+                subscriber = MonitorSubscriber(conn, policy, batch, self.stop_monitoring)
+                subscriber.start()
+                self.subscribers[conn] = subscriber
+                if batch:
+                    self.batch_subscribers = self.batch_subscribers + (subscriber,)
+            watchers = dict(self.watchers)
+            for name in var_names:
+                idx = self.var_idx[name]
+                subscriber.set_filter(idx, min_interval, deadband)
+                if idx not in subscriber.var_idxs:
+                    subscriber.var_idxs.add(idx)
+                    if idx not in watchers:
+                        self.__set_var_watched(idx, 1)
+                    watchers[idx] = watchers.get(idx, ()) + (subscriber,)
+            self.watchers = watchers
+
+    def stop_monitoring(self, conn, final_msg=None):
+        """Stops sending changes via conn, after having sent the queued changes and final_msg (if any)."""
+        with self.watchers_lock:
+            subscriber = self.subscribers.pop(conn, None)
+            if subscriber is None:
+                return None
+            watchers = {}
+            for idx, subscribers in self.watchers.iteritems():
+                remaining = tuple(s for s in subscribers if s is not subscriber)
+                if remaining:
+                    watchers[idx] = remaining
+                elif idx not in self.mb_reverse_map and self.time_mode != 'step':
+                    self.__set_var_watched(idx, 0)
+            self.watchers = watchers
+            self.batch_subscribers = tuple(s for s in self.batch_subscribers if s is not subscriber)
+        subscriber.close(final_msg)
+        return subscriber
 
     def __sync_mb_blocks(self, idx, new_value):
-        def get_mb_addr_to_set_tpl():
-            for tbl, v in self.mb_map.iteritems():
-                for addr, jdx in v.iteritems():
-                    if idx == jdx:
-                        # Contains (table name, modbus address)
-                        # table name = di, co, hr or ir
-                        return tbl, addr
-
-        def set_blk_val(block, addr, new_value):
-            block.setValues(addr, [new_value], clbk=False)
-
-        mb_addr_to_set = get_mb_addr_to_set_tpl()
-        if mb_addr_to_set:
-            tbl, addr = mb_addr_to_set
-            blk = self.mb_blocks[tbl]
-            set_blk_val(blk, addr, new_value)
-
-    # Workaround using closures to make ctypes function callback work with class methods
-    # See: https://stackoverflow.com/a/7261524/8516723
-    def get_callback_function(self):
-
-        def my_callback(idx):
-            try:
-                # Unfortunately, we currently cannot pass the new value from the do_notify method to
-                # the callback, because we don't know the type of the variable set statement
-                # per compile-time. Therefore, we have to retrieve the new value now.
-                new_value = self.get_var_value(self.vars[idx]['name'])
-                self.__sync_mb_blocks(idx, new_value)
-                self.__notify_watcher(idx, new_value)
-            except (NotSupportedPlcTagClassException, NotSupportedPlcTagTypeException):
+        # Contains [(table name, modbus address), ...]
+        # table name = di, co, hr or ir
+        for tbl, addr in self.mb_reverse_map.get(idx, ()):
+            self.mb_blocks[tbl].setValues(addr, [new_value], clbk=False)
+
+    def process_var_changes(self, changes, count):
+        """Processes variable changes that have been drained from the PLC runtime's ring buffer."""
+        step_changes = self.step_changes
+        for i in xrange(count):
+            change = changes[i]
+            if change.tick != self.tick:
+                # Changes of a scan cycle are consecutive
+                self.__end_scan_cycle()
+                self.tick = change.tick
+            idx = change.idx
+            new_value = self.vars[idx].convert(change.value)
+            if new_value is None:
                 # Ignore tags of types that we currently do not support
-                pass
-
-        return self.callback_type(my_callback)
+                continue
+            if step_changes is not None:
+                step_changes.append((change.tick, idx, new_value))
+            self.__sync_mb_blocks(idx, new_value)
+            self.__notify_watcher(idx, new_value, change.tick)
+        # The drained changes end with the scan cycle, unless the PLC is already executing the next one (the batch
+        # is split then)
+        self.__end_scan_cycle()
+
+    def var_changes_drained(self, count):
+        """Called by the drain thread after it has processed count changes."""
+        with self.drained_cond:
+            self.drained_var_changes = (self.drained_var_changes + count) & 0xFFFFFFFF
+            self.drained_cond.notify_all()
 
     def terminate(self):
-        self.stop()
-        self.plc_thread.join()
-
-    def __run_make(self, path_to_st):
-
-        def set_conf_res_env():
-            # Open csv file
-            with open(self.loc_vars_csv_path, 'r') as f:
-                # Parse programs section
-                progs_reader = csv.reader(utils.filter_vars_csv_section(utils.programs_pattern_obj, f), delimiter=';')
-                for row in progs_reader:
-                    # Example row:
-                    # 0;STD_CONF.STD_RESSOURCE.INST0;MY_PROGRAM;
-                    # num;symbols;program_name
-                    # symbols: configuration_name.ressource_name.instance_name
-                    symbols = row[1].split('.')
-                    configuration_name = symbols[0]
-                    resource_name = symbols[1]
-                    # Currently, we only support one program - so stop
-                    break
-
-                if configuration_name and resource_name:
-                    # MatIEC generates the file names of the configuration and resource according to their
-                    # name specified in ST code. Unfortunately, in VARIABLES.CSV, all elements are in upper-case.
-                    try:
-                        files = os.listdir(self.tmp_path)
-                    except OSError:
-                        return
-
-                    configuration_file_name = ''
-                    resource_file_name = ''
-
-                    for f in files:
-                        f_name = os.path.splitext(f)[0]
-                        if f_name.lower() == configuration_name.lower():
-                            configuration_file_name = f_name
-                        elif f_name.lower() == resource_name.lower():
-                            resource_file_name = f_name
-                        if configuration_file_name and resource_file_name:
-                            break
-
-                    if configuration_file_name and resource_file_name:
-                        os.environ["ST_CONFIGURATION_NAME"] = configuration_file_name
-                        os.environ["ST_RESOURCE_NAME"] = resource_file_name
-                    else:
-                        raise RuntimeError('Could not find matching configuration and resource name.')
-                else:
-                    raise RuntimeError(
-                        'Could not find configuration name and resource name in {}.'.format(self.loc_vars_csv_path))
-
-        # Validate path
-        if not os.path.isfile(path_to_st):
-            logger.error("The ST file path '%s' is not valid!", path_to_st)
-            return
-
-        # Check if MatIEC env variables are set
-        matiec_inc_path = "MATIEC_INCLUDE_PATH"
-        matiec_c_inc_path = "MATIEC_C_INCLUDE_PATH"
-
-        if matiec_inc_path not in os.environ:
-            logger.error("The environment variable '%s' is not set.", matiec_inc_path)
-            return
-        if matiec_c_inc_path not in os.environ:
-            logger.error("The environment variable '%s' is not set.", matiec_c_inc_path)
+        """Stops the PLC and its listener, must be called holding lock."""
+        if self.terminated:
             return
-
-        # Set env variables
-        os.environ["ST_FILE_PATH"] = path_to_st
-        os.environ["PLC_NAME"] = self.name
-
-        # Run make targets
-        cwd = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'plcruntime')
-        # Run make init
-        mkinit = Popen(['make', 'init'], shell=False, cwd=cwd).wait()
-        if mkinit is not 0:
-            logger.error("Executing make target 'init' failed.")
-            return
-        logger.debug('Return value of target init: {}.'.format(mkinit))
-
-        # Run make iec2c
-        mkiec2c = Popen(['make', 'iec2c'], shell=False, cwd=cwd).wait()
-        if mkiec2c is not 0:
-            logger.error("Executing make target 'iec2c' failed.")
-            return
-
-        logger.debug('Return value of target iec2c: %s.', mkiec2c)
-
-        set_conf_res_env()
-
-        # Run make build
-        mkbuild = Popen(['make', 'build'], shell=False, cwd=cwd).wait()
-        if mkbuild is not 0:
-            logger.error("Executing make target 'build' failed.")
-            return
-
-        logger.debug('Return value of target build: %s.', mkbuild)
+        self.terminated = True
+        # Notify all clients that monitor that PLC is terminating.
+        logger.debug("PLC is terminating...")
+        subscribers = [self.stop_monitoring(c, TerminateMessage()) for c in self.subscribers.keys()]
+        for subscriber in subscribers:
+            if subscriber is not None:
+                subscriber.join(MONITOR_CLOSE_TIMEOUT)
+        self.stop()
+        if self.plc_thread is not None:
+            self.plc_thread.join()
+            logger.debug("PLC thread joined.")
+            self.release_process_image()
+        self.listener_thread.server.shutdown()
+
+    def release_process_image(self):
+        # Must only be called once the PLC thread has been stopped
+        self.__close_process_image()
+        try:
+            os.unlink(self.process_image_path)
+        except OSError:
+            logger.exception("Could not remove process image '%s'.", self.process_image_path)
 
     def __set_vars(self):
-        # Init vars
+        # Init vars, the position of a var in the list equals its index in the PLC runtime
         self.vars = []
+        # { upper-cased name: idx }
+        self.var_idx = {}
         # Open csv file
         with open(self.loc_vars_csv_path, 'r') as f:
             # First parse programs section
@@ -320,7 +449,33 @@ class PlcSupervisor(object):
                 clazz = self.__get_internal_plc_class(parsed_clazz)
                 parsed_type = row[-2]
                 type = self.__get_internal_plc_type(parsed_type)
-                self.vars.append({'class': clazz, 'name': var_name, 'type': type, 'value': None})
+                idx = len(self.vars)
+                self.vars.append(PlcVar(idx, var_name, clazz, type))
+                self.var_idx[var_name.upper()] = idx
+
+    def __bind_accessors(self):
+        for var in self.vars:
+            ctype = PLC_TYPES_CTYPES.get(var.type)
+            if ctype is None:
+                # Not supported types (e.g., time) are only accessible via the raw int64 snapshot
+                continue
+            if var.clazz in PLC_LOCATED_CLASSES:
+                ptr = POINTER(c_void_p)()
+                res = self.__get_ref_by_idx_p(var.idx, byref(ptr))
+                accessor = cast(ptr, POINTER(POINTER(ctype)))
+            else:
+                ptr = c_void_p()
+                res = self.__get_ref_by_idx_t(var.idx, byref(ptr))
+                accessor = cast(ptr, POINTER(ctype))
+            if res != 0:
+                raise RuntimeError("Error! Lib call 'get_ref_by_idx' returned error.")
+            var.accessor = accessor
+
+    def __get_var(self, name):
+        idx = self.var_idx.get(name.upper())
+        if idx is None:
+            raise UnknownPlcTagException("Variable name '{}' does not exist in PLC.\n".format(name))
+        return self.vars[idx]
 
     def __get_internal_plc_type(self, type):
         if type == "INT":
@@ -379,7 +534,9 @@ class PlcSupervisor(object):
             # self.block = ThreadSafeDataBlock(PlcSupervisorDataBlock(0, [0] * 1000, self.modbus_callback))
             self.mb_blocks = get_blocks()
             logger.debug("Starting Modbus Server Thread.")
-            self.modbus_server_thread = ModbusServerThread(('', 502), self.mb_blocks)
+            # The server's socket is bound on creation, i.e., in the network namespace of the PLC's host
+            with utils.netns(self.netns_path):
+                self.modbus_server_thread = ModbusServerThread(('', 502), self.mb_blocks)
             self.modbus_server_thread.daemon = True
             self.modbus_server_thread.start()
             logger.debug("Started Modbus Server Thread.")
@@ -390,10 +547,15 @@ class PlcSupervisor(object):
             self.plc_thread.daemon = True
             self.plc_thread.start()
             logger.debug("Started PLC Thread.")
+            # The runtime starts counting recorded changes anew
+            self.drained_var_changes = 0
             # Make lib call
             res = self.__start_plc()
             if res == 0:
                 self.running = True
+                self.drain_thread = VarChangeDrainThread(self)
+                self.drain_thread.daemon = True
+                self.drain_thread.start()
             else:
                 self.stop_event.set()
                 logger.error("Error when starting PLC.")
@@ -412,7 +574,7 @@ class PlcSupervisor(object):
 
     def __mb_callback(self, block, address, values):
         idx = block[address]
-        self.set_var_value(self.vars[idx]['name'], str(values[0]))
+        self.set_var_value(self.vars[idx].name, str(values[0]))
         # TODO: Implement Write Multi-Functions (FC15, FC16)
 
     def stop(self):
@@ -421,6 +583,9 @@ class PlcSupervisor(object):
             # Stopping Modbus server
             self.modbus_server_thread.stop()
             self.modbus_server_thread.join()
+            # Stop draining variable changes before the PLC runtime releases its resources
+            self.drain_thread.stop()
+            self.drain_thread.join()
             # Stopping PLC
             res = self.__stop_plc()
             if res == 0:
@@ -432,91 +597,301 @@ class PlcSupervisor(object):
         else:
             return "PLC not running. Nothing to stop..."
 
-    def get_var_value(self, name):
-        for d in self.vars:
-            # Check if variable exists in PLC code
-            if d['name'] == name:
-                # Prepare args for lib call
-                idx = c_int(self.vars.index(d))
-                clazz = d['class']
-                plc_clazzes = PlcClasses()
-                if clazz == plc_clazzes.IN or clazz == plc_clazzes.OUT or clazz == plc_clazzes.MEM:
-                    ptr = POINTER(c_void_p)()
-                    res = self.__get_ref_by_idx_p(idx, byref(ptr))
-                elif clazz == plc_clazzes.VAR:
-                    ptr = c_void_p()
-                    res = self.__get_ref_by_idx_t(idx, byref(ptr))
-                else:
-                    raise NotSupportedPlcTagClassException("Class '{}' currently not supported.\n".format(clazz))
-                if res == 0:
-                    var_type = None
-                    types = PlcTypes()
-                    if d['type'] == types.INT or d['type'] == types.DINT or d['type'] == types.SINT:
-                        var_type = POINTER(c_int)
-                    elif d['type'] == types.BOOL:
-                        var_type = POINTER(c_bool)
-                    if var_type is None:
-                        raise NotSupportedPlcTagTypeException(
-                            "Type: '{}' is currently not supported.".format(d['type']))
-                    var_res = cast(self.__get_ptr_accessor(clazz, ptr), var_type)
-                    return var_res[0]
-                else:
-                    raise RuntimeError("Error! Lib call 'get_ref_by_idx' returned error.")
-
-        raise UnknownPlcTagException("Variable name '{}' does not exist in PLC.\n".format(name))
+    def set_time_mode(self, mode, factor=1.0):
+        """Sets the time mode of the PLC, i.e., 'realtime', 'dilated' (by factor), 'asap' or 'step'."""
+        if mode not in PLC_TIME_MODES:
+            return "Unknown time mode '{}'.".format(mode)
+        try:
+            factor = float(factor)
+        except ValueError:
+            return "Invalid time dilation factor '{}'.".format(factor)
+        if mode == 'step' and self.time_mode != 'step':
+            # Steps report the changes of all vars
+            self.__set_all_vars_watched(True)
+        if self.__set_time_mode(PLC_TIME_MODES[mode], factor) != 0:
+            if self.time_mode != 'step':
+                self.__set_all_vars_watched(False)
+            return "Error when setting time mode '{}' (factor={}).".format(mode, factor)
+        if mode != 'step' and self.time_mode == 'step':
+            self.__set_all_vars_watched(False)
+        self.time_mode = mode
+        logger.info("Time mode of PLC '%s' set to '%s' (factor=%s).", self.name, mode, factor)
+        return ""
+
+    def __set_all_vars_watched(self, watched):
+        """Makes the runtime record the changes of all vars, or again only of the monitored or mapped ones."""
+        with self.watchers_lock:
+            for var in self.vars:
+                self.__set_var_watched(var.idx, int(watched and var.is_supported() or var.idx in self.watchers or
+                                                    var.idx in self.mb_reverse_map))
+
+    def step(self, n=1):
+        """Pauses the PLC (if not yet stepping) and executes exactly n scan cycles.
+
+        The response holds every change of a supported var in the executed cycles (in order and with the tick of
+        its cycle), as recorded by the runtime, i.e., also changes that a later cycle has reverted.
+
+        Unlike the other methods, it must be called without holding lock, which is released while the scan cycles
+        are executed, so that other requests are served meanwhile.
+        """
+        with self.step_lock:
+            with self.lock:
+                if not self.running:
+                    return "PLC not running. Nothing to step..."
+                if n < 0:
+                    return "Invalid number of steps '{}'.".format(n)
+                if self.time_mode != 'step':
+                    res = self.set_time_mode('step')
+                    if res:
+                        return res
+            with self.drained_cond:
+                self.step_changes = []
+            tick = self.__step_plc(n)
+            with self.drained_cond:
+                if tick >= 0:
+                    # Wait until the drain thread has processed the changes recorded in the stepped cycles
+                    recorded = self.__get_recorded_var_changes()
+                    while (recorded - self.drained_var_changes) & 0xFFFFFFFF and self.drain_thread.is_alive():
+                        self.drained_cond.wait(VAR_CHANGES_TIMEOUT_MS / 1000.0)
+                changes = self.step_changes
+                self.step_changes = None
+            with self.lock:
+                if tick < 0:
+                    return "Error when stepping PLC."
+                # Changes drained meanwhile may stem from cycles before the step
+                tags = [{'name': self.vars[idx].name, 'value': value, 'tick': change_tick}
+                        for change_tick, idx, value in changes if change_tick > tick - n]
+                return StepResponseMessage(tick, self.__get_plc_time(), tags)
+
+    def get_scan_stats(self, reset=False):
+        """Returns the timing statistics of the scan cycles as dict, durations are in ns."""
+        stats = ScanStats()
+        self.__get_scan_stats(byref(stats))
+        if reset:
+            self.__reset_scan_stats()
+        res = stats.to_dict()
+        res['time_mode'] = self.time_mode
+        res['tick_time'] = self.__get_tick_time()
+        return res
 
-    def __get_ptr_accessor(self, clazz, ptr):
-        plc_clazzes = PlcClasses()
-        if clazz == plc_clazzes.IN or clazz == plc_clazzes.OUT or clazz == plc_clazzes.MEM:
-            return ptr[0]
-        elif clazz == plc_clazzes.VAR:
-            return ptr
-        else:
-            raise RuntimeError("Class '{}' currently not supported.\n".format(clazz))
+    def get_var_value(self, name):
+        var = self.__get_var(name)
+        if not var.is_supported():
+            raise NotSupportedPlcTagTypeException("Type: '{}' is currently not supported.".format(var.type))
+        return var.read()
+
+    def get_all_values(self):
+        """Returns the raw int64 values of all vars, taken as one consistent snapshot in a single lib call."""
+        buf = (c_int64 * len(self.vars))()
+        res = self.__get_all_values(buf, len(buf))
+        if res < 0:
+            raise RuntimeError("Error! Lib call 'get_all_values' returned error.")
+        return buf
+
+    def show_tags(self):
+        """Returns class, name, type and current value of all tags."""
+        values = self.get_all_values()
+        tags = []
+        for var in self.vars:
+            tag = var.to_dict()
+            tag['value'] = var.convert(values[var.idx])
+            tags.append(tag)
+        return tags
+
+    def get_tags(self):
+        """Returns name and value of all tags of supported types."""
+        values = self.get_all_values()
+        return [{'name': var.name, 'value': var.convert(values[var.idx])} for var in self.vars if var.is_supported()]
 
     def set_var_value(self, name, value):
-        for d in self.vars:
-            # Check if variable exists in PLC code
-            if d['name'] == name:
-                new_value = None
-                old_value = self.get_var_value(name)
-                val_to_sync = None
-                types = PlcTypes()
-                clazz = d['class']
-                plc_clazzes = PlcClasses()
-                var_type = d['type']
-                # Prepare args for lib call
-                idx = self.vars.index(d)
-                c_idx = c_int(idx)
-                if var_type == types.INT or var_type == types.DINT or var_type == types.SINT:
-                    val_to_sync = int(value)
-                    new_value = c_int(val_to_sync)
-                elif var_type == types.BOOL:
-                    # Value sent via Modbus may be 0/1
-                    val_to_sync = value.lower() == "true" or value == "1"
-                    new_value = c_bool(val_to_sync)
-
-                if new_value is None:
-                    raise NotSupportedPlcTagTypeException("Type: '{}' is currently not supported.".format(var_type))
-
-                if clazz == plc_clazzes.IN or clazz == plc_clazzes.OUT or clazz == plc_clazzes.MEM:
-                    # TODO: Error handling
-                    res = self.__set_int_val_by_idx_p(c_idx, byref(new_value))
-                elif clazz == plc_clazzes.VAR:
-                    # TODO: Error handling
-                    res = self.__set_int_val_by_idx_t(c_idx, byref(new_value))
-                else:
-                    raise NotSupportedPlcTagClassException("Class '{}' currently not supported.\n".format(clazz))
-                if res != 0:
-                    raise RuntimeError("Error! Lib call 'set_val_by_idx' returned error.")
-                else:
-                    logger.info(
-                        "'{}' value changed {} -> {} in device '{}'.".format(name, old_value, val_to_sync, self.name))
-                    self.__sync_mb_blocks(idx, val_to_sync)
-                    self.__notify_watcher(idx, val_to_sync)
+        var = self.__get_var(name)
+        if var.type == PlcTypes.INT or var.type == PlcTypes.DINT or var.type == PlcTypes.SINT:
+            val_to_sync = int(value)
+        elif var.type == PlcTypes.BOOL:
+            # Value sent via Modbus may be 0/1
+            val_to_sync = value.lower() == "true" or value == "1"
+        else:
+            raise NotSupportedPlcTagTypeException("Type: '{}' is currently not supported.".format(var.type))
+        # Only used if the PLC is not running, as the PLC thread may change the var meanwhile otherwise
+        old_value = var.read()
+        # The PLC runtime writes the value according to the type and class of the var
+        res = self.__set_var_value_by_idx(var.idx, int(val_to_sync))
+        if res < 0:
+            raise RuntimeError("Error! Lib call 'set_var_value_by_idx' returned error.")
+        logger.info("'{}' value set to {} in device '{}'.".format(name, val_to_sync, self.name))
+        # While the PLC is running, the runtime records the change for the drain thread (res == 1). Otherwise, there
+        # is no drain thread, which could process changes concurrently.
+        if res == 0 and val_to_sync != old_value:
+            self.__sync_mb_blocks(var.idx, val_to_sync)
+            self.__notify_watcher(var.idx, val_to_sync, self.tick)
+            self.__end_scan_cycle()
+
+
+class MonitorSubscriber(Thread):
+    """Sends the changes of the vars monitored via a connection, so that neither the PLC nor other monitoring
+    connections have to wait for a slow connection.
+
+    Changes are queued up to MONITOR_QUEUE_SIZE, beyond which the connection's policy applies (cf. MonitorPolicies).
+    A change of a var with a minimum interval is delayed until the interval since its last reported change has
+    elapsed, a change within the deadband of its last reported value is discarded. A batching subscriber receives
+    one MonitorBatchResponseMessage per scan cycle, which holds the last value of each var changed in the cycle.
+    """
+
+    def __init__(self, conn, policy, batch, on_failure):
+        Thread.__init__(self)
+        self.daemon = True
+        self.conn = conn
+        self.policy = policy
+        self.batch = batch
+        # Called with the connection, once sending via it failed
+        self.on_failure = on_failure
+        self.var_idxs = set()
+        # { var idx: (min interval, deadband) } of vars, whose changes are filtered
+        self.filters = {}
+        # { var idx: (time, value) } of the change of a filtered var reported last
+        self.reported = {}
+        # { var idx: (deadline, message) } of changes delayed by the minimum interval of their var
+        self.delayed = {}
+        # { var idx: message } of the current scan cycle, if batching
+        self.cycle = OrderedDict()
+        self.tick = 0
+        # Coalescing keeps the queued change of each var idx at the position of its first change
+        self.queue = OrderedDict() if policy == MonitorPolicies.COALESCE else deque()
+        self.dropped = 0
+        self.closed = False
+        self.final_msg = None
+        self.cond = Condition(Lock())
+
+    def set_filter(self, idx, min_interval, deadband):
+        with self.cond:
+            if min_interval > 0 or deadband > 0:
+                self.filters[idx] = (min_interval, deadband)
+            else:
+                self.filters.pop(idx, None)
+
+    def put(self, idx, msg, tick):
+        with self.cond:
+            if self.closed:
+                return
+            flt = self.filters.get(idx)
+            if flt is not None and not self.__filter(idx, msg, flt):
+                return
+            if self.batch:
+                # Queued at the end of the scan cycle
+                self.cycle[idx] = msg
+                self.tick = tick
+            else:
+                self.__enqueue(idx, msg)
+                self.cond.notify()
+
+    def end_cycle(self):
+        with self.cond:
+            if not self.cycle:
+                return
+            if self.policy == MonitorPolicies.COALESCE:
+                # Coalesced changes are batched when being sent
+                for idx, msg in self.cycle.iteritems():
+                    self.__enqueue(idx, msg)
+            else:
+                self.__enqueue(None, self.__get_batch(self.cycle.itervalues()))
+            self.cycle.clear()
+            self.cond.notify()
+
+    def __filter(self, idx, msg, flt):
+        # Must hold lock, returns True if the change passes the filter of its var
+        min_interval, deadband = flt
+        now = time()
+        reported = self.reported.get(idx)
+        if reported is not None:
+            reported_time, reported_value = reported
+            if deadband > 0 and type(msg.value) is not bool and abs(msg.value - reported_value) < deadband:
+                # A delayed change is superseded, as the var is back within the deadband
+                self.delayed.pop(idx, None)
+                return False
+            if now - reported_time < min_interval:
+                self.delayed[idx] = (reported_time + min_interval, msg)
+                self.cond.notify()
+                return False
+        self.reported[idx] = (now, msg.value)
+        self.delayed.pop(idx, None)
+        return True
+
+    def __enqueue(self, idx, item):
+        # Must hold lock
+        if self.policy == MonitorPolicies.COALESCE:
+            if idx not in self.queue and len(self.queue) >= MONITOR_QUEUE_SIZE:
+                self.dropped += 1
+                return
+            self.queue[idx] = item
+        else:
+            if len(self.queue) >= MONITOR_QUEUE_SIZE:
+                self.dropped += 1
+                if self.policy == MonitorPolicies.DROP_NEWEST:
                     return
+                self.queue.popleft()
+            self.queue.append(item)
+
+    def __get_batch(self, msgs):
+        msgs = list(msgs)
+        return MonitorBatchResponseMessage(self.tick, [msg.name for msg in msgs], [msg.value for msg in msgs])
+
+    def __get_due(self):
+        # Must hold lock, returns the delayed changes, whose minimum interval has elapsed
+        if not self.delayed:
+            return []
+        now = time()
+        due = [(idx, msg) for idx, (deadline, msg) in self.delayed.iteritems() if deadline <= now]
+        for idx, msg in due:
+            del self.delayed[idx]
+            self.reported[idx] = (now, msg.value)
+        return [msg for _, msg in due]
+
+    def __get_timeout(self):
+        # Must hold lock, returns the time until the next delayed change is due
+        if not self.delayed:
+            return None
+        return max(0.0, min(deadline for deadline, _ in self.delayed.itervalues()) - time())
+
+    def close(self, final_msg=None):
+        """Sends the queued changes and final_msg before exiting, if final_msg is set; otherwise discards them."""
+        with self.cond:
+            self.closed = True
+            self.final_msg = final_msg
+            if final_msg is None:
+                self.queue.clear()
+            self.cond.notify()
 
-        raise UnknownPlcTagException("Variable name '{}' does not exist in PLC.\n".format(name))
+    def run(self):
+        while True:
+            with self.cond:
+                due = self.__get_due()
+                while not self.queue and not due and not self.closed:
+                    self.cond.wait(self.__get_timeout())
+                    due = self.__get_due()
+                msgs = self.queue.values() if self.policy == MonitorPolicies.COALESCE else list(self.queue)
+                self.queue.clear()
+                if self.batch:
+                    if msgs and self.policy == MonitorPolicies.COALESCE:
+                        msgs = [self.__get_batch(msgs)]
+                    if due:
+                        msgs.append(self.__get_batch(due))
+                else:
+                    msgs.extend(due)
+                dropped, self.dropped = self.dropped, 0
+                closed = self.closed
+            if dropped:
+                logger.warn("Monitoring connection dropped %d variable changes.", dropped)
+            if closed and self.final_msg is not None:
+                msgs.append(self.final_msg)
+            try:
+                for msg in msgs:
+                    self.conn.send(msg)
+            except (EOFError, IOError):
+                # Socket is no longer alive
+                self.on_failure(self.conn)
+                break
+            if closed:
+                break
 
 
 class PlcStartThread(Thread):
@@ -532,11 +907,43 @@ class PlcStartThread(Thread):
         logger.debug("Exiting PLC '{}' start-thread...\n".format(self.plc.name))
 
 
+class VarChangeDrainThread(Thread):
+
+    def __init__(self, plc):
+        Thread.__init__(self)
+        self.plc = plc
+        self.stop_event = Event()
+
+    def run(self):
+        logger.debug("Starting PLC '{}' drain-thread...\n".format(self.plc.name))
+        changes = (VarChange * VAR_CHANGES_BATCH_SIZE)()
+        dropped = 0
+        while not self.stop_event.is_set():
+            # Blocks in the PLC runtime (without holding the GIL) until changes are available
+            count = self.plc.get_var_changes(changes, VAR_CHANGES_BATCH_SIZE, VAR_CHANGES_TIMEOUT_MS)
+            if count > 0:
+                try:
+                    self.plc.process_var_changes(changes, count)
+                except Exception:
+                    logger.exception("Could not process variable changes.")
+                self.plc.var_changes_drained(count)
+            total_dropped = self.plc.get_dropped_var_changes()
+            if total_dropped != dropped:
+                logger.warn("PLC '%s' dropped %d variable changes.", self.plc.name, total_dropped - dropped)
+                dropped = total_dropped
+        logger.debug("Exiting PLC '{}' drain-thread...\n".format(self.plc.name))
+
+    def stop(self):
+        self.stop_event.set()
+
+
 class ListenerThread(Thread):
 
     def __init__(self, plc):
         Thread.__init__(self)
         self.plc = plc
+        # Serves many long-lived client connections concurrently
+        self.server = Server(os.path.join(self.plc.tmp_path, PLC_SOCKET_NAME), self.__handle_message)
 
     def run(self):
         logger.debug("Starting Listener...")
@@ -545,79 +952,86 @@ class ListenerThread(Thread):
         except Exception:
             logger.exception("ERROR")
 
+    def terminate(self):
+        """Terminates the PLC as on receiving a TerminateMessage (e.g., if its supervisor host terminates)."""
+        self.plc.initialized.wait()
+        with self.plc.lock:
+            self.plc.terminate()
+
     def __init_listener(self):
-        address = os.path.join(self.plc.tmp_path, 'plc_socket')
-        # Ensure that socket does not exist
+        # Listener may be started before the build has created the tmp dir
         try:
-            os.unlink(address)
+            os.makedirs(self.plc.tmp_path)
         except OSError:
-            if os.path.exists(address):
-                logger.exception('Could not remove socket file.')
-        # Create listener
-        listener = Listener(address)
-        logger.debug('Listener ready.')
-        while True:
-            conn = listener.accept()
-            msg = conn.recv()
-            if isinstance(msg, StartMessage):
-                conn.send(self.plc.start())
-            elif isinstance(msg, StopMessage):
-                conn.send(self.plc.stop())
-            elif isinstance(msg, ShowTagsMessage):
-                conn.send(ShowTagsResponseMessage(self.plc.vars))
-            elif isinstance(msg, GetTagMessage):
-                try:
-                    res = GetTagResponseMessage(self.plc.get_var_value(msg.name))
-                except (UnknownPlcTagException, NotSupportedPlcTagTypeException, NotSupportedPlcTagClassException) as e:
-                    res = e
-                conn.send(res)
-            elif isinstance(msg, SetTagMessage):
-                try:
-                    self.plc.set_var_value(msg.name, msg.value)
-                    res = SetTagResponseMessage()
-                except (UnknownPlcTagException, NotSupportedPlcTagTypeException, NotSupportedPlcTagClassException) as e:
-                    res = e
-                conn.send(res)
-            elif isinstance(msg, GetTagsMessage):
-                # Filtered out not supported tag types (e.g., time)
-                tags = map(lambda tag: {'name': tag['name'], 'value': self.plc.get_var_value(tag['name'])},
-                           list(filter(lambda x: x['type'] != 'time', self.plc.vars)))
-                conn.send(GetTagsResponseMessage(tags))
-            elif isinstance(msg, MonitorMessage):
-                # Wait until build is finished
-                while not self.plc.build_finished:
-                    sleep(1)
-                var_names = []
-                for x in msg.tag_names:
-                    if any(d['name'].upper() == x.upper() for d in self.plc.vars):
-                        var_names.append(x.upper())
-                    else:
-                        logger.error('Found invalid var %s when trying to monitor PLC variable.', x)
-                self.plc.conn_watcher.append({'conn': conn, 'var_names': var_names})
-            elif isinstance(msg, GetAllTagNamesMessage):
-                tag_names = map(lambda t: t['name'], self.plc.vars)
-                conn.send(GetAllTagNamesResponseMessage(tag_names))
-            elif isinstance(msg, StopMonitoringMessage):
-                logger.info(len(self.plc.conn_watcher))
-                logger.info(self.plc.conn_watcher.index(conn))
-                del self.plc.conn_watcher[self.plc.conn_watcher.index(conn)]
-                logger.info(self.plc.conn_watcher.index(conn))
-            elif isinstance(msg, TerminateMessage):
-                # Notify all clients that monitor that PLC is terminating.
-                logger.debug("PLC is terminating...")
-                for i in self.plc.conn_watcher:
-                    i['conn'].send(TerminateMessage())
-                self.plc.stop()
-                self.plc.plc_thread.join()
-                logger.debug("PLC thread joined.")
-                conn.close()
-                break
-            elif isinstance(msg, CloseMessage):
-                conn.close()
-                break
-        listener.close()
+            if not os.path.isdir(self.plc.tmp_path):
+                raise
+        self.server.serve_forever()
         logger.debug("Listener closed.")
 
+    def __handle_message(self, conn, msg):
+        """Handles a message received via conn, returns None if conn should be closed (cf. Server)."""
+        # Wait until PLC is initialized
+        self.plc.initialized.wait()
+        if isinstance(msg, TerminateMessage):
+            self.terminate()
+            return None
+        elif isinstance(msg, CloseMessage):
+            self.server.shutdown()
+            return None
+        elif isinstance(msg, MonitorMessage):
+            var_names = []
+            for x in msg.tag_names:
+                if x.upper() in self.plc.var_idx:
+                    var_names.append(x.upper())
+                else:
+                    logger.error('Found invalid var %s when trying to monitor PLC variable.', x)
+            self.plc.monitor(conn, var_names, msg.policy, msg.batch, msg.min_interval, msg.deadband)
+            return True
+        elif isinstance(msg, StopMonitoringMessage):
+            self.plc.stop_monitoring(conn)
+            return True
+        elif isinstance(msg, StepMessage):
+            # Takes the lock on its own, as it must not be held while the scan cycles are executed
+            res = self.plc.step(msg.n)
+        else:
+            with self.plc.lock:
+                res = self.__get_response(msg)
+        # Sent without holding the lock, so that a slow client does not hold up the requests of other clients
+        conn.send(res)
+        return True
+
+    def __get_response(self, msg):
+        """Returns the response to a request, must be called holding the PLC's lock."""
+        if isinstance(msg, StartMessage):
+            return self.plc.start()
+        elif isinstance(msg, StopMessage):
+            return self.plc.stop()
+        elif isinstance(msg, ShowTagsMessage):
+            return ShowTagsResponseMessage(self.plc.show_tags())
+        elif isinstance(msg, GetTagMessage):
+            try:
+                return GetTagResponseMessage(self.plc.get_var_value(msg.name))
+            except (UnknownPlcTagException, NotSupportedPlcTagTypeException, NotSupportedPlcTagClassException) as e:
+                return e
+        elif isinstance(msg, SetTagMessage):
+            try:
+                self.plc.set_var_value(msg.name, msg.value)
+                return SetTagResponseMessage()
+            except (UnknownPlcTagException, NotSupportedPlcTagTypeException, NotSupportedPlcTagClassException) as e:
+                return e
+        elif isinstance(msg, GetTagsMessage):
+            # Filtered out not supported tag types (e.g., time)
+            return GetTagsResponseMessage(self.plc.get_tags())
+        elif isinstance(msg, SetTimeModeMessage):
+            return self.plc.set_time_mode(msg.mode, msg.factor)
+        elif isinstance(msg, GetScanStatsMessage):
+            return ScanStatsResponseMessage(self.plc.get_scan_stats(msg.reset))
+        elif isinstance(msg, GetAllValuesMessage):
+            return GetAllValuesResponseMessage(buffer(self.plc.get_all_values())[:])
+        elif isinstance(msg, GetAllTagNamesMessage):
+            return GetAllTagNamesResponseMessage(map(lambda t: t.name, self.plc.vars))
+        return FailedPlcMessage()
+
 
 class PlcSupervisorDataBlock(ModbusSparseDataBlock):
 
@@ -656,8 +1070,74 @@ class ModbusServerThread(Thread):
         self.server.shutdown()
 
 
+class PlcSupervisorHost(object):
+    """Runs the supervisors of several PLCs in one process, so that they share the Python infrastructure (e.g., the
+    interpreter, pymodbus and ctypes) instead of each PLC running a process of its own.
+
+    PLCs are added via HostPlcMessage and are then reached via their own listeners as usual. A TerminateMessage
+    terminates the PLCs that are still running and the host.
+    """
+
+    def __init__(self):
+        self.address = get_supervisor_host_socket_path()
+        self.server = Server(self.address, self.__handle_message)
+        # { PLC name: HostedPlcThread }
+        self.threads = {}
+        self.lock = Lock()
+
+    def serve_forever(self):
+        try:
+            os.makedirs(os.path.dirname(self.address))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(self.address)):
+                raise
+        self.server.serve_forever()
+
+    def __handle_message(self, conn, msg):
+        if isinstance(msg, HostPlcMessage):
+            with self.lock:
+                if msg.name in self.threads:
+                    logger.error("PLC '%s' is already hosted.", msg.name)
+                    conn.send(FailedPlcMessage())
+                    return True
+                thread = HostedPlcThread(msg)
+                thread.start()
+                self.threads[msg.name] = thread
+            conn.send(SuccessPlcMessage())
+        elif isinstance(msg, TerminateMessage):
+            with self.lock:
+                threads = self.threads.values()
+            for thread in threads:
+                thread.terminate()
+            self.server.shutdown()
+            return None
+        return True
+
+
+class HostedPlcThread(Thread):
+    """Builds and starts a PLC hosted by the supervisor host, so that the build does not hold up other PLCs."""
+
+    def __init__(self, msg):
+        Thread.__init__(self)
+        self.msg = msg
+        self.supervisor = None
+
+    def run(self):
+        logger.debug("Hosting PLC '%s'.", self.msg.name)
+        self.supervisor = PlcSupervisor(self.msg.name, self.msg.st_path, self.msg.mb_map_path,
+                                        self.msg.netns_path or None, self.msg.build_profile or None)
+
+    def terminate(self):
+        self.join()
+        if self.supervisor is not None:
+            self.supervisor.listener_thread.terminate()
+
+
 def main():
-    PlcSupervisor()
+    if len(sys.argv) > 1 and sys.argv[1] == SUPERVISOR_HOST_ARG:
+        PlcSupervisorHost().serve_forever()
+    else:
+        PlcSupervisor(sys.argv[1], sys.argv[2], sys.argv[3])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+
+from subprocess import Popen, PIPE
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from time import time
+from cpstwinning.ipc import wait_for_path, get_remaining
+
+import os
+import csv
+import glob
+import json
+import shutil
+import hashlib
+import tempfile
+import logging
+import utils
+
+logger = logging.getLogger(__name__)
+
+# Build profiles, cf. PROFILE in plcruntime/Makefile
+BUILD_PROFILE_DEBUG = 'debug'
+BUILD_PROFILE_RELEASE = 'release'
+BUILD_PROFILES = (BUILD_PROFILE_DEBUG, BUILD_PROFILE_RELEASE)
+# Environment variable that selects the build profile
+BUILD_PROFILE_ENV = 'PLC_BUILD_PROFILE'
+# Name of the cache directory in the tmp base directory (cf. TMPBASE in plcruntime/Makefile)
+BUILD_CACHE_DIRNAME = 'cache'
+# Extensions of the build artifacts, which are kept in the cache
+BUILD_ARTIFACT_EXTS = ('.c', '.h', '.csv', '.so')
+# Name of the shared library in the cache, it is renamed to lib<PLC name>.so when restored
+CACHED_LIB_NAME = 'lib.so'
+# Name of the file, which a PLC supervisor writes once its PLC is up (or has failed)
+READY_FILENAME = 'ready'
+# Time in s to wait for all PLCs to become ready
+READY_TIMEOUT = 600
+
+# Versions of iec2c and gcc (cf. get_tool_versions)
+tool_versions = None
+
+
+def get_build_profile():
+    profile = os.environ.get(BUILD_PROFILE_ENV, BUILD_PROFILE_DEBUG)
+    if profile not in BUILD_PROFILES:
+        logger.warn("Unknown build profile '%s', using '%s'.", profile, BUILD_PROFILE_DEBUG)
+        return BUILD_PROFILE_DEBUG
+    return profile
+
+
+def get_tool_version(args):
+    """Returns the output of a version command or an empty string, if the tool is not available."""
+    try:
+        proc = Popen(args, shell=False, stdout=PIPE, stderr=PIPE)
+        out, err = proc.communicate()
+        return out + err
+    except OSError:
+        return ''
+
+
+def get_tool_versions():
+    """Returns the versions of iec2c and gcc, which are only determined once per process."""
+    global tool_versions
+    if tool_versions is None:
+        tool_versions = (get_tool_version(['iec2c', '-v']), get_tool_version(['gcc', '--version']))
+    return tool_versions
+
+
+def get_build_inputs():
+    """Returns the paths of all files of the PLC runtime that affect the build."""
+    plcruntime_path = os.path.join(utils.get_pkg_path(), 'plcruntime')
+    paths = [os.path.join(plcruntime_path, 'Makefile')]
+    # The prepreprocessor and the modules it imports
+    paths.extend(os.path.join(utils.get_pkg_path(), name)
+                 for name in ('prepreprocessor.py', 'utils.py', 'constants.py'))
+    paths.extend(glob.glob(os.path.join(plcruntime_path, 'src', '*.c')))
+    paths.extend(glob.glob(os.path.join(plcruntime_path, 'inc', '*.h')))
+    return sorted(paths)
+
+
+def get_build_key(st_path, profile):
+    """Returns the cache key of a PLC, i.e., the hash of all inputs of its build."""
+    h = hashlib.sha256()
+
+    def update(name, data):
+        # Length-prefixed, so that different inputs cannot yield the same byte stream
+        h.update('{}:{}:'.format(name, len(data)))
+        h.update(data)
+
+    for path in [st_path] + get_build_inputs():
+        with open(path, 'rb') as f:
+            update(os.path.basename(path), f.read())
+    update('profile', profile)
+    update('iec2c', get_tool_versions()[0])
+    update('cc', get_tool_versions()[1])
+    for env in ('MATIEC_INCLUDE_PATH', 'MATIEC_C_INCLUDE_PATH'):
+        update(env, os.environ.get(env, ''))
+    return h.hexdigest()
+
+
+class PlcBuildCache(object):
+    """Content-addressed cache of the generated sources and shared libraries of PLCs."""
+
+    def __init__(self, cache_path=None):
+        if cache_path is None:
+            cache_path = os.path.join(utils.get_tmp_base_path_from_mkfile(), BUILD_CACHE_DIRNAME)
+        self.cache_path = cache_path
+
+    def __get_entry_path(self, key):
+        return os.path.join(self.cache_path, key)
+
+    def restore(self, key, dst_path, plc_name):
+        """Copies the cached build artifacts into dst_path, returns False if there is no cache entry."""
+        entry_path = self.__get_entry_path(key)
+        if not os.path.isdir(entry_path):
+            return False
+        if not os.path.exists(dst_path):
+            os.makedirs(dst_path)
+        for name in os.listdir(entry_path):
+            dst_name = 'lib{}.so'.format(plc_name) if name == CACHED_LIB_NAME else name
+            shutil.copy2(os.path.join(entry_path, name), os.path.join(dst_path, dst_name))
+        return True
+
+    def store(self, key, dst_path, plc_name):
+        """Adds the build artifacts in dst_path to the cache."""
+        entry_path = self.__get_entry_path(key)
+        if os.path.isdir(entry_path):
+            return
+        if not os.path.exists(self.cache_path):
+            try:
+                os.makedirs(self.cache_path)
+            except OSError:
+                # Created by a concurrent build
+                if not os.path.isdir(self.cache_path):
+                    raise
+        lib_name = 'lib{}.so'.format(plc_name)
+        # Populate a temporary directory first, so that other builds never see partial entries
+        tmp_entry_path = tempfile.mkdtemp(prefix='.{}-'.format(key), dir=self.cache_path)
+        try:
+            for name in os.listdir(dst_path):
+                if os.path.splitext(name)[1] not in BUILD_ARTIFACT_EXTS:
+                    continue
+                if name.endswith('.so') and name != lib_name:
+                    continue
+                entry_name = CACHED_LIB_NAME if name == lib_name else name
+                shutil.copy2(os.path.join(dst_path, name), os.path.join(tmp_entry_path, entry_name))
+            os.rename(tmp_entry_path, entry_path)
+        except OSError:
+            # Entry has been stored by a concurrent build in the meantime
+            if not os.path.isdir(entry_path):
+                raise
+        finally:
+            if os.path.isdir(tmp_entry_path):
+                shutil.rmtree(tmp_entry_path)
+
+
+class PlcBuildResult(object):
+
+    def __init__(self, name, success, cached=False, duration=0.0):
+        self.name = name
+        self.success = success
+        # Whether the lib has been restored from the build cache
+        self.cached = cached
+        # Duration of the build in s
+        self.duration = duration
+
+
+def get_conf_res_file_names(loc_vars_csv_path, tmp_path):
+    """Returns the file names (without extension) of the configuration and resource generated by MatIEC."""
+    configuration_name = None
+    resource_name = None
+    # Open csv file
+    with open(loc_vars_csv_path, 'r') as f:
+        # Parse programs section
+        progs_reader = csv.reader(utils.filter_vars_csv_section(utils.programs_pattern_obj, f), delimiter=';')
+        for row in progs_reader:
+            # Example row:
+            # 0;STD_CONF.STD_RESSOURCE.INST0;MY_PROGRAM;
+            # num;symbols;program_name
+            # symbols: configuration_name.ressource_name.instance_name
+            symbols = row[1].split('.')
+            configuration_name = symbols[0]
+            resource_name = symbols[1]
+            # Currently, we only support one program - so stop
+            break
+
+    if not configuration_name or not resource_name:
+        raise RuntimeError('Could not find configuration name and resource name in {}.'.format(loc_vars_csv_path))
+
+    # MatIEC generates the file names of the configuration and resource according to their
+    # name specified in ST code. Unfortunately, in VARIABLES.CSV, all elements are in upper-case.
+    configuration_file_name = ''
+    resource_file_name = ''
+    for f in os.listdir(tmp_path):
+        f_name = os.path.splitext(f)[0]
+        if f_name.lower() == configuration_name.lower():
+            configuration_file_name = f_name
+        elif f_name.lower() == resource_name.lower():
+            resource_file_name = f_name
+        if configuration_file_name and resource_file_name:
+            return configuration_file_name, resource_file_name
+    raise RuntimeError('Could not find matching configuration and resource name.')
+
+
+def run_make(target, env):
+    cwd = os.path.join(utils.get_pkg_path(), 'plcruntime')
+    res = Popen(['make', target], shell=False, cwd=cwd, env=env).wait()
+    logger.debug('Return value of target %s: %s.', target, res)
+    if res != 0:
+        logger.error("Executing make target '%s' failed.", target)
+        return False
+    return True
+
+
+def build_plc(plc_name, path_to_st, build_cache=None, profile=None):
+    """Builds the lib of a PLC via make or restores it from the build cache.
+
+    The environment of make is passed per build, so that several PLCs can be built concurrently (also by the same
+    supervisor process, which is why the build profile may be passed instead of being taken from the environment).
+    """
+    start = time()
+    # Validate path
+    if not os.path.isfile(path_to_st):
+        logger.error("The ST file path '%s' is not valid!", path_to_st)
+        return PlcBuildResult(plc_name, False)
+
+    # Check if MatIEC env variables are set
+    for env_name in ('MATIEC_INCLUDE_PATH', 'MATIEC_C_INCLUDE_PATH'):
+        if env_name not in os.environ:
+            logger.error("The environment variable '%s' is not set.", env_name)
+            return PlcBuildResult(plc_name, False)
+
+    tmp_path = utils.get_dstdir_path_from_mkfile(plc_name)
+    if profile is None:
+        profile = get_build_profile()
+    if build_cache is None:
+        build_cache = PlcBuildCache()
+    # Reuse the sources and lib of a previous build with the same inputs
+    key = get_build_key(path_to_st, profile)
+    if build_cache.restore(key, tmp_path, plc_name):
+        logger.info("Restored PLC '%s' from build cache [key=%s].", plc_name, key)
+        return PlcBuildResult(plc_name, True, True, time() - start)
+
+    env = dict(os.environ)
+    env['ST_FILE_PATH'] = path_to_st
+    env['PLC_NAME'] = plc_name
+    env[BUILD_PROFILE_ENV] = profile
+
+    if not run_make('init', env) or not run_make('iec2c', env):
+        return PlcBuildResult(plc_name, False, duration=time() - start)
+
+    try:
+        conf_file_name, res_file_name = get_conf_res_file_names('{}/VARIABLES.csv'.format(tmp_path), tmp_path)
+    except (EnvironmentError, RuntimeError):
+        logger.exception("Could not determine configuration and resource of PLC '%s'.", plc_name)
+        return PlcBuildResult(plc_name, False, duration=time() - start)
+    env['ST_CONFIGURATION_NAME'] = conf_file_name
+    env['ST_RESOURCE_NAME'] = res_file_name
+
+    if not run_make('build', env):
+        return PlcBuildResult(plc_name, False, duration=time() - start)
+
+    try:
+        build_cache.store(key, tmp_path, plc_name)
+    except (OSError, IOError):
+        logger.exception("Could not add PLC '%s' to build cache.", plc_name)
+    return PlcBuildResult(plc_name, True, False, time() - start)
+
+
+def build_plcs(plcs, workers=None):
+    """Builds the libs of several PLCs concurrently, plcs is a list of (PLC name, path to ST file) tuples.
+
+    Returns the list of PlcBuildResult in the order of plcs.
+    """
+    if not plcs:
+        return []
+    if workers is None:
+        workers = cpu_count()
+    pool = ThreadPool(min(workers, len(plcs)))
+    try:
+        return pool.map(lambda (name, st_path): build_plc(name, st_path), plcs)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_ready_path(tmp_path):
+    return os.path.join(tmp_path, READY_FILENAME)
+
+
+def clear_ready(plc_name):
+    try:
+        os.unlink(get_ready_path(utils.get_dstdir_path_from_mkfile(plc_name)))
+    except OSError:
+        pass
+
+
+def signal_ready(tmp_path, ready, **info):
+    """Passes the readiness barrier of a PLC, info is reported to the twinning process (e.g., timings)."""
+    info['ready'] = ready
+    path = get_ready_path(tmp_path)
+    tmp_ready_path = path + '.tmp'
+    try:
+        with open(tmp_ready_path, 'w') as f:
+            json.dump(info, f)
+        # Readers must never see a partially written file
+        os.rename(tmp_ready_path, path)
+    except (OSError, IOError):
+        logger.exception("Could not signal readiness in '%s'.", path)
+
+
+def wait_until_ready(plc_names, timeout=READY_TIMEOUT):
+    """Waits until all PLCs have passed the readiness barrier.
+
+    Returns { PLC name: info } with the info signaled by each supervisor, PLCs that have not become
+    ready within timeout are missing.
+    """
+    paths = dict((name, get_ready_path(utils.get_dstdir_path_from_mkfile(name))) for name in plc_names)
+    infos = {}
+    deadline = time() + timeout
+    for name, path in paths.iteritems():
+        # Blocks until the supervisor has (atomically) written its ready file
+        if not wait_for_path(path, get_remaining(deadline)):
+            continue
+        try:
+            with open(path, 'r') as f:
+                infos[name] = json.load(f)
+        except (IOError, ValueError):
+            logger.exception("Could not read readiness of PLC '%s'.", name)
+            infos[name] = {'ready': False}
+    return infos
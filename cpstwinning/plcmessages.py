@@ -2,6 +2,8 @@
 
 from datetime import datetime
 
+import struct
+
 
 class PlcMessage(object):
 
@@ -47,6 +49,23 @@ class GetTagsResponseMessage(PlcMessage):
         self.tags = tags
 
 
+class GetAllValuesMessage(PlcMessage):
+
+    def __init__(self):
+        super(GetAllValuesMessage, self).__init__()
+
+
+class GetAllValuesResponseMessage(PlcMessage):
+
+    def __init__(self, values):
+        super(GetAllValuesResponseMessage, self).__init__()
+        # Raw int64 values (native byte order) of all PLC vars, in the order of GetAllTagNamesResponseMessage
+        self.values = values
+
+    def get_values(self):
+        return struct.unpack('={}q'.format(len(self.values) // 8), self.values)
+
+
 class GetTagMessage(PlcMessage):
 
     def __init__(self, name):
@@ -75,11 +94,76 @@ class SetTagResponseMessage(PlcMessage):
         super(SetTagResponseMessage, self).__init__()
 
 
+class SetTimeModeMessage(PlcMessage):
+
+    def __init__(self, mode, factor=1.0):
+        super(SetTimeModeMessage, self).__init__()
+        # One of 'realtime', 'dilated', 'asap' or 'step'
+        self.mode = mode
+        # Time dilation, only used in mode 'dilated'
+        self.factor = factor
+
+
+class StepMessage(PlcMessage):
+
+    def __init__(self, n=1):
+        super(StepMessage, self).__init__()
+        # Number of scan cycles to execute
+        self.n = n
+
+
+class StepResponseMessage(PlcMessage):
+
+    def __init__(self, tick, current_time, tags):
+        super(StepResponseMessage, self).__init__()
+        # Tick of the last executed scan cycle
+        self.tick = tick
+        # __CURRENT_TIME of the PLC in ns after stepping
+        self.current_time = current_time
+        # Name, value and tick of each change of a tag in the executed scan cycles, in order
+        self.tags = tags
+
+
+class GetScanStatsMessage(PlcMessage):
+
+    def __init__(self, reset=False):
+        super(GetScanStatsMessage, self).__init__()
+        # Reset the statistics after they have been retrieved
+        self.reset = reset
+
+
+class ScanStatsResponseMessage(PlcMessage):
+
+    def __init__(self, stats):
+        super(ScanStatsResponseMessage, self).__init__()
+        # Cf. PlcSupervisor.get_scan_stats
+        self.stats = stats
+
+
+class MonitorPolicies(object):
+    """What happens to a change, if the changes queued for a monitoring connection exceed its capacity."""
+    DROP_OLDEST = 0x00
+    DROP_NEWEST = 0x01
+    # A change replaces the queued change of the same tag (i.e., only the latest value of a tag is sent)
+    COALESCE = 0x02
+
+    def __setattr__(self, *_):
+        pass
+
+
 class MonitorMessage(PlcMessage):
 
-    def __init__(self, tag_names):
+    def __init__(self, tag_names, policy=MonitorPolicies.DROP_OLDEST, batch=False, min_interval=0.0, deadband=0.0):
         super(MonitorMessage, self).__init__()
         self.tag_names = tag_names
+        # Policy and batching are set by the first MonitorMessage of a connection
+        self.policy = policy
+        # Receive one MonitorBatchResponseMessage per scan cycle instead of a MonitorResponseMessage per change
+        self.batch = batch
+        # Minimum time in s between two changes of a tag, a change within it is delayed until it has elapsed
+        self.min_interval = min_interval
+        # Changes of a tag by less than the deadband are not reported
+        self.deadband = deadband
 
 
 class StopMonitoringMessage(PlcMessage):
@@ -110,6 +194,18 @@ class MonitorResponseMessage(PlcMessage):
         self.value = value
 
 
+class MonitorBatchResponseMessage(PlcMessage):
+
+    def __init__(self, tick, names, values):
+        super(MonitorBatchResponseMessage, self).__init__()
+        self.timestamp = datetime.utcnow()
+        # Scan cycle of the changes
+        self.tick = tick
+        # Tag names[i] changed to values[i], its last value in the scan cycle
+        self.names = names
+        self.values = values
+
+
 class CloseMessage(PlcMessage):
 
     def __init__(self):
@@ -132,3 +228,17 @@ class FailedPlcMessage(PlcMessage):
 
     def __init__(self):
         super(FailedPlcMessage, self).__init__()
+
+
+class HostPlcMessage(PlcMessage):
+
+    def __init__(self, name, st_path, mb_map_path='', netns_path='', build_profile=''):
+        super(HostPlcMessage, self).__init__()
+        # Arguments of a PLC supervisor, which the supervisor host runs (cf. PlcSupervisorHost)
+        self.name = name
+        self.st_path = st_path
+        self.mb_map_path = mb_map_path
+        # Network namespace of the PLC's host, in which its Modbus server listens ('' for the one of the process)
+        self.netns_path = netns_path
+        # '' for the build profile of the supervisor host's environment
+        self.build_profile = build_profile
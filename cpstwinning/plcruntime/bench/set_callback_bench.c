@@ -0,0 +1,97 @@
+/*
+ * Benchmarks the variable change notification path of the PLC runtime.
+ *
+ * Simulates scan cycles in which every PLC variable is written once and
+ * reports the mean scan-cycle time for a growing number of variables, both for
+ * the linear scan over the vars array and for the sorted address lookup table.
+ */
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+
+#include <plc_vars_lookup.h>
+
+#define CYCLES 200
+
+typedef struct
+{
+	int value;
+	unsigned char flags;
+} bench_var_t;
+
+static void **vars;
+static struct var_lookup_entry *vars_lookup;
+static int vars_len;
+static volatile long notified;
+
+static void notify(int idx)
+{
+	notified += idx;
+}
+
+static void set_callback_linear(void *addr)
+{
+	int i = 0;
+	for (i; i < vars_len; i++)
+	{
+		if (addr == vars[i])
+			notify(i);
+	}
+}
+
+static void set_callback_lookup(void *addr)
+{
+	int idx = find_var_idx(vars_lookup, vars_len, addr);
+	if (idx >= 0)
+		notify(idx);
+}
+
+static double run_cycles(bench_var_t *prog, void (*clbk)(void *))
+{
+	struct timespec start, end;
+	int c, i;
+	clock_gettime(CLOCK_MONOTONIC, &start);
+	for (c = 0; c < CYCLES; c++)
+	{
+		for (i = 0; i < vars_len; i++)
+		{
+			prog[i].value = c;
+			clbk(&prog[i]);
+		}
+	}
+	clock_gettime(CLOCK_MONOTONIC, &end);
+	return ((end.tv_sec - start.tv_sec) * 1e9 + (end.tv_nsec - start.tv_nsec))
+			/ CYCLES / 1000.0;
+}
+
+int main(void)
+{
+	int sizes[] =
+	{ 16, 64, 256, 1024, 4096 };
+	int s, i;
+
+	printf("%10s %20s %20s\n", "vars", "linear [us/scan]", "lookup [us/scan]");
+	for (s = 0; s < (int) (sizeof(sizes) / sizeof(sizes[0])); s++)
+	{
+		vars_len = sizes[s];
+		bench_var_t *prog = calloc(vars_len, sizeof(bench_var_t));
+		vars = calloc(vars_len, sizeof(void *));
+		vars_lookup = calloc(vars_len, sizeof(struct var_lookup_entry));
+		for (i = 0; i < vars_len; i++)
+		{
+			vars[i] = &prog[i];
+			vars_lookup[i].addr = &prog[i];
+			vars_lookup[i].idx = i;
+		}
+		init_vars_lookup(vars_lookup, vars_len);
+
+		double linear = run_cycles(prog, set_callback_linear);
+		double lookup = run_cycles(prog, set_callback_lookup);
+		printf("%10d %20.2f %20.2f\n", vars_len, linear, lookup);
+
+		free(vars_lookup);
+		free(vars);
+		free(prog);
+	}
+	return 0;
+}
@@ -0,0 +1,47 @@
+#ifndef INC_PLC_PROCESS_IMAGE_H_
+#define INC_PLC_PROCESS_IMAGE_H_
+
+#include <stdint.h>
+
+/*
+ * Memory-mapped process image of a PLC, updated at the end of each scan cycle
+ * and on each write of a var by the supervisor.
+ * Keep in sync with processimage.py.
+ *
+ * Layout:
+ *   struct process_image_header
+ *   uint8_t types[vars_len]                          (padded to 8 bytes)
+ *   char names[vars_len][PROCESS_IMAGE_NAME_LEN]     (NUL-terminated)
+ *   int64_t values[vars_len]
+ *
+ * The sequence counter works as a seqlock: it is odd while the values are
+ * being written. Readers retry if the counter is odd or changed while reading.
+ *
+ * Each run of the runtime creates a new file, whose magic is set once the
+ * image is ready and cleared once it is closed, so that readers notice when
+ * they have to open the image anew.
+ */
+#define PROCESS_IMAGE_MAGIC 0x49535043 /* "CPSI" */
+#define PROCESS_IMAGE_VERSION 1
+#define PROCESS_IMAGE_NAME_LEN 64
+
+struct process_image_header
+{
+	uint32_t magic;
+	uint16_t version;
+	uint16_t name_len;
+	uint32_t vars_len;
+	// Time mode of the PLC (cf. plc_time_mode.h)
+	uint32_t time_mode;
+	uint64_t seq;
+	uint64_t tick;
+	// __CURRENT_TIME of the last scan cycle in ns
+	int64_t current_time;
+};
+
+#define PROCESS_IMAGE_TYPES_SIZE(len) ((((len) + 7) / 8) * 8)
+#define PROCESS_IMAGE_SIZE(len) (sizeof(struct process_image_header) \
+		+ PROCESS_IMAGE_TYPES_SIZE(len) + (len) * PROCESS_IMAGE_NAME_LEN \
+		+ (len) * sizeof(int64_t))
+
+#endif /* INC_PLC_PROCESS_IMAGE_H_ */
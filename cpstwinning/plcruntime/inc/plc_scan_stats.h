@@ -0,0 +1,44 @@
+#ifndef INC_PLC_SCAN_STATS_H_
+#define INC_PLC_SCAN_STATS_H_
+
+#include <stdint.h>
+
+/*
+ * Timing statistics of the scan cycles. Keep in sync with ScanStats in
+ * plc_supervisor.py.
+ *
+ * Durations are recorded in ns into log2 histograms: bucket i counts the
+ * durations d with 2^i <= d < 2^(i+1), bucket 0 also counts d < 1 and the
+ * last bucket all durations beyond. Lateness is the delay between the
+ * expiry of the timer and the start of the scan cycle, thus only recorded
+ * if the scan cycle has been triggered by the timer.
+ */
+#define SCAN_STATS_BUCKETS 32
+
+struct scan_stats
+{
+	uint64_t cycles;
+	// Cycles whose execution took longer than the interval of the timer
+	uint64_t overruns;
+	// Timer expirations, which have not been consumed before the next one
+	uint64_t missed_ticks;
+	// Cycles triggered by the timer, i.e., number of lateness samples
+	uint64_t timed_cycles;
+	int64_t lateness_sum;
+	int64_t lateness_max;
+	int64_t exec_sum;
+	int64_t exec_max;
+	uint64_t lateness_hist[SCAN_STATS_BUCKETS];
+	uint64_t exec_hist[SCAN_STATS_BUCKETS];
+};
+
+static inline int get_scan_stats_bucket(int64_t ns)
+{
+	int bucket = 0;
+	if (ns <= 1)
+		return 0;
+	bucket = 63 - __builtin_clzll((uint64_t) ns);
+	return bucket < SCAN_STATS_BUCKETS ? bucket : SCAN_STATS_BUCKETS - 1;
+}
+
+#endif /* INC_PLC_SCAN_STATS_H_ */
@@ -0,0 +1,24 @@
+#ifndef INC_PLC_TIME_MODE_H_
+#define INC_PLC_TIME_MODE_H_
+
+/*
+ * Modes of advancing __CURRENT_TIME. Keep in sync with processimage.py.
+ *
+ * REALTIME: scan cycles are triggered every common_ticktime__ and
+ *           __CURRENT_TIME follows the wall clock.
+ * DILATED:  scan cycles are triggered every common_ticktime__ / factor and
+ *           __CURRENT_TIME is advanced by common_ticktime__ per cycle.
+ * ASAP:     scan cycles are executed back-to-back and __CURRENT_TIME is
+ *           advanced by common_ticktime__ per cycle.
+ * STEP:     scan cycles are only executed on request (cf. step_plc) and
+ *           __CURRENT_TIME is advanced by common_ticktime__ per cycle.
+ */
+enum plc_time_mode
+{
+	PLC_TIME_MODE_REALTIME = 0,
+	PLC_TIME_MODE_DILATED,
+	PLC_TIME_MODE_ASAP,
+	PLC_TIME_MODE_STEP
+};
+
+#endif /* INC_PLC_TIME_MODE_H_ */
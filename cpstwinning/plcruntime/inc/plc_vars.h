@@ -0,0 +1,52 @@
+#ifndef INC_PLC_VARS_H_
+#define INC_PLC_VARS_H_
+
+#include <stdint.h>
+
+/*
+ * Type and class information of the PLC variables, generated by the
+ * pre-preprocessor next to the vars array. Keep in sync with the type
+ * and class mapping in prepreprocessor.py.
+ */
+enum plc_var_type
+{
+	PLC_VAR_TYPE_UNSUPPORTED = 0,
+	PLC_VAR_TYPE_BOOL,
+	PLC_VAR_TYPE_SINT,
+	PLC_VAR_TYPE_INT,
+	PLC_VAR_TYPE_DINT,
+	PLC_VAR_TYPE_TIME
+};
+
+enum plc_var_class
+{
+	// Value is stored in the variable struct (__IEC_<type>_t)
+	PLC_VAR_CLASS_VAR = 0,
+	// Variable struct holds a pointer to the value (__IEC_<type>_p)
+	PLC_VAR_CLASS_LOCATED
+};
+
+struct plc_var_info
+{
+	uint8_t type;
+	uint8_t clazz;
+};
+
+/*
+ * A variable change recorded during a scan cycle or written by the supervisor
+ * in between (with the tick of the last cycle). All changes of a scan cycle
+ * have the same tick. TIME values are stored in nanoseconds, timestamp is
+ * taken from CLOCK_MONOTONIC in nanoseconds.
+ */
+struct var_change
+{
+	int32_t idx;
+	int32_t tick;
+	int64_t value;
+	int64_t timestamp;
+};
+
+// Must be a power of two
+#define VAR_CHANGES_CAPACITY 4096
+
+#endif /* INC_PLC_VARS_H_ */
@@ -0,0 +1,53 @@
+#ifndef INC_PLC_VARS_LOOKUP_H_
+#define INC_PLC_VARS_LOOKUP_H_
+
+#include <stdlib.h>
+
+/*
+ * Maps the address of a PLC variable to its index in the vars array.
+ * The table is generated by the pre-preprocessor next to the vars array and
+ * sorted by address once before the PLC starts, so that the index of a
+ * written variable can be resolved via binary search.
+ */
+struct var_lookup_entry
+{
+	void *addr;
+	int idx;
+};
+
+static int cmp_var_lookup_entries(const void *a, const void *b)
+{
+	const struct var_lookup_entry *ea = (const struct var_lookup_entry *) a;
+	const struct var_lookup_entry *eb = (const struct var_lookup_entry *) b;
+	if (ea->addr < eb->addr)
+		return -1;
+	if (ea->addr > eb->addr)
+		return 1;
+	return 0;
+}
+
+static inline void init_vars_lookup(struct var_lookup_entry *tbl, int len)
+{
+	qsort(tbl, len, sizeof(struct var_lookup_entry), cmp_var_lookup_entries);
+}
+
+// Returns the index of the variable located at addr or -1, if addr is no PLC variable.
+static inline int find_var_idx(const struct var_lookup_entry *tbl, int len,
+		const void *addr)
+{
+	int lo = 0;
+	int hi = len - 1;
+	while (lo <= hi)
+	{
+		int mid = lo + ((hi - lo) >> 1);
+		if (tbl[mid].addr == addr)
+			return tbl[mid].idx;
+		if (tbl[mid].addr < addr)
+			lo = mid + 1;
+		else
+			hi = mid - 1;
+	}
+	return -1;
+}
+
+#endif /* INC_PLC_VARS_LOOKUP_H_ */
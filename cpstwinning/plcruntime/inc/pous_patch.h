@@ -1,16 +1,37 @@
 #ifndef INC_POUS_PATCH_H_
 #define INC_POUS_PATCH_H_
 
-void set_callback(void *addr);
+#include <string.h>
 
+void set_callback(void *addr);
 
+/*
+ * The new value is only stored (and the runtime notified) if it differs from
+ * the current value. Values are compared bytewise, so that the macros work for
+ * all types (e.g., TIME structs). As in MatIEC's macros, new_value is not
+ * evaluated for forced vars.
+ */
 #undef __SET_LOCATED
 #define __SET_LOCATED(prefix, name, suffix, new_value)\
-if (!(prefix name.flags & __IEC_FORCE_FLAG)) *(prefix name.value) suffix = new_value;\
-	set_callback(&(prefix name))
+do {\
+	if (!(prefix name.flags & __IEC_FORCE_FLAG)) {\
+		__typeof__(*(prefix name.value) suffix) __new_value = (new_value);\
+		if (memcmp(&(*(prefix name.value) suffix), &__new_value, sizeof(__new_value)) != 0) {\
+			*(prefix name.value) suffix = __new_value;\
+			set_callback(&(prefix name));\
+		}\
+	}\
+} while (0)
 #undef __SET_VAR
 #define __SET_VAR(prefix, name, suffix, new_value)\
-if (!(prefix name.flags & __IEC_FORCE_FLAG)) prefix name.value suffix = new_value;\
-	set_callback(&(prefix name))
+do {\
+	if (!(prefix name.flags & __IEC_FORCE_FLAG)) {\
+		__typeof__(prefix name.value suffix) __new_value = (new_value);\
+		if (memcmp(&(prefix name.value suffix), &__new_value, sizeof(__new_value)) != 0) {\
+			prefix name.value suffix = __new_value;\
+			set_callback(&(prefix name));\
+		}\
+	}\
+} while (0)
 
 #endif /* INC_POUS_PATCH_H_ */
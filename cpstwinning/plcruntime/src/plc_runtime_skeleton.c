@@ -5,12 +5,20 @@
 #include <unistd.h>
 #include <pthread.h>
 #include <semaphore.h>
+#include <sched.h>
+#include <fcntl.h>
+#include <sys/mman.h>
 
 #include "iec_types.h"
 #include "iec_std_lib.h"
 
 #include <POUS.h>
 #include <plc_runtime.h>
+#include <plc_vars.h>
+#include <plc_process_image.h>
+#include <plc_vars_lookup.h>
+#include <plc_time_mode.h>
+#include <plc_scan_stats.h>
 
 void config_run__(int tick);
 void config_init__(void);
@@ -23,9 +31,20 @@ void run(long int tv_sec, long int tv_nsec);
 void init_timer(struct itimerspec *timer_values, sigevent_t *sigev);
 int get_ref_by_idx(int idx, void ***ptr);
 int get_len_of_vars_arr(void);
-int set_int_val_by_idx(int idx, void *ptr);
-int do_notify(int idx);
-void register_var_change_callback(void (*clbk)(int));
+int set_var_value_by_idx(int idx, int64_t value);
+int get_var_changes(struct var_change *buf, int len, int timeout_ms);
+int set_var_watched(int idx, int watched);
+unsigned long get_dropped_var_changes(void);
+unsigned int get_recorded_var_changes(void);
+int open_process_image(const char *path);
+int get_all_values(int64_t *buf, int len);
+int close_process_image(void);
+int set_time_mode(int mode, double factor);
+int step_plc(int n);
+long long get_plc_time(void);
+long long get_tick_time(void);
+int get_scan_stats(struct scan_stats *stats);
+void reset_scan_stats(void);
 void set_callback(void *addr);
 
 TIME __CURRENT_TIME;
@@ -35,11 +54,29 @@ static int tick = 0;
 
 extern int common_ticktime__;
 
-int is_plc_running = 0;
-pthread_t plc_thread;
-sem_t sem_plc_timer;
-sem_t sem_plc_vars;
-timer_t timer;
+/*
+ * The state of the runtime is private to the lib of a PLC (and the lib is
+ * linked with -Bsymbolic), so that one supervisor process can load the libs of
+ * several PLCs, each of which keeps its own state.
+ */
+static int is_plc_running = 0;
+static pthread_t plc_thread;
+static sem_t sem_plc_timer;
+static sem_t sem_plc_vars;
+static sem_t sem_var_changes;
+static sem_t sem_var_changes_space;
+static sem_t sem_plc_step;
+static sem_t sem_plc_step_done;
+// Number of callers of step_plc, which stop_plc wakes up and waits for before destroying the semaphores
+static int steppers = 0;
+static timer_t timer;
+
+static int time_mode = PLC_TIME_MODE_REALTIME;
+static double time_dilation = 1.0;
+
+static struct scan_stats scan_stats;
+// CLOCK_MONOTONIC time in ns of the last expiry of the timer
+static int64_t last_release = 0;
 
 // PROGRAM
 
@@ -50,45 +87,296 @@ static void *vars[] =
 
 static int vars_len = sizeof(vars) / sizeof(vars[0]);
 
-void (*notify_var_change_callback)(int) = NULL;
+// Sorted by address in start_plc()
+static struct var_lookup_entry vars_lookup[] =
+{
+// PLC_VARS_LOOKUP
+		};
 
-void set_callback(void *addr)
+static const struct plc_var_info vars_info[] =
+{
+// PLC_VARS_INFO
+		};
+
+static const char *vars_names[] =
 {
+// PLC_VARS_NAMES
+		};
 
+/*
+ * Bit per var, set if the supervisor processes changes of the var (i.e., if
+ * it is monitored or mapped to Modbus). Changes of other vars are not recorded.
+ */
+static unsigned char vars_watched[(sizeof(vars) / sizeof(vars[0]) + 7) / 8];
+
+static struct process_image_header *process_image = NULL;
+static int64_t *process_image_values = NULL;
+
+/*
+ * Single-producer/single-consumer ring buffer of variable changes. The PLC
+ * thread (via set_callback) and the supervisor's writes (via
+ * set_var_value_by_idx) produce changes only while holding sem_plc_vars, so
+ * that they act as a single producer. The supervisor's drain thread is the
+ * only consumer (via get_var_changes). In PLC_TIME_MODE_STEP, the producer
+ * waits for sem_var_changes_space if the buffer is full, which the consumer
+ * posts once it has freed space (if var_changes_space_wanted is set).
+ */
+static struct var_change var_changes[VAR_CHANGES_CAPACITY];
+static unsigned int var_changes_head = 0;
+static unsigned int var_changes_tail = 0;
+static unsigned long var_changes_dropped = 0;
+static int var_changes_pending = 0;
+static int var_changes_space_wanted = 0;
+
+/*
+ * sem_plc_vars is used as a lock: the PLC thread holds it while executing a
+ * scan cycle, accessors hold it while reading or writing vars.
+ */
+static void lock_plc_vars(void)
+{
+	if (is_plc_running)
+		sem_wait(&sem_plc_vars);
+}
+
+static void unlock_plc_vars(void)
+{
+	if (is_plc_running)
+		sem_post(&sem_plc_vars);
+}
+
+static int64_t get_monotonic_time(void)
+{
+	struct timespec now;
+	clock_gettime(CLOCK_MONOTONIC, &now);
+	return now.tv_sec * 1000000000LL + now.tv_nsec;
+}
+
+static int64_t get_var_value_by_idx(int idx)
+{
+	void *ptr = vars[idx];
+	if (vars_info[idx].clazz == PLC_VAR_CLASS_LOCATED)
+		ptr = *((void **) ptr);
+	// Pointers of located vars are not set before config_init__()
+	if (!ptr)
+		return 0;
+	switch (vars_info[idx].type)
+	{
+	case PLC_VAR_TYPE_BOOL:
+		return *((BOOL *) ptr);
+	case PLC_VAR_TYPE_SINT:
+		return *((SINT *) ptr);
+	case PLC_VAR_TYPE_INT:
+		return *((INT *) ptr);
+	case PLC_VAR_TYPE_DINT:
+		return *((DINT *) ptr);
+	case PLC_VAR_TYPE_TIME:
+		return ((TIME *) ptr)->tv_sec * 1000000000LL + ((TIME *) ptr)->tv_nsec;
+	default:
+		return 0;
+	}
+}
+
+// Wakes up the consumer once per scan cycle, if changes have been recorded.
+static void flush_var_changes(void)
+{
+	int waiting = 0;
+	if (!var_changes_pending)
+		return;
+	var_changes_pending = 0;
+	sem_getvalue(&sem_var_changes, &waiting);
+	if (waiting <= 0)
+		sem_post(&sem_var_changes);
+}
+
+static void push_var_change(int idx)
+{
+	unsigned int head = __atomic_load_n(&var_changes_head, __ATOMIC_RELAXED);
+	unsigned int tail = __atomic_load_n(&var_changes_tail, __ATOMIC_ACQUIRE);
+	// A step reports all changes of its cycles, so wait for the consumer rather than dropping changes
+	while (head - tail >= VAR_CHANGES_CAPACITY && time_mode == PLC_TIME_MODE_STEP && is_plc_running)
+	{
+		var_changes_pending = 1;
+		flush_var_changes();
+		__atomic_store_n(&var_changes_space_wanted, 1, __ATOMIC_SEQ_CST);
+		// Consumer may have freed space before it could see var_changes_space_wanted
+		tail = __atomic_load_n(&var_changes_tail, __ATOMIC_SEQ_CST);
+		if (head - tail >= VAR_CHANGES_CAPACITY && is_plc_running)
+			sem_wait(&sem_var_changes_space);
+		tail = __atomic_load_n(&var_changes_tail, __ATOMIC_ACQUIRE);
+	}
+	__atomic_store_n(&var_changes_space_wanted, 0, __ATOMIC_RELAXED);
+	if (head - tail >= VAR_CHANGES_CAPACITY)
+	{
+		// Consumer does not keep up, never block the scan cycle
+		__atomic_add_fetch(&var_changes_dropped, 1, __ATOMIC_RELAXED);
+		return;
+	}
+	struct var_change *change = &var_changes[head & (VAR_CHANGES_CAPACITY - 1)];
+	change->idx = idx;
+	change->tick = tick;
+	change->value = get_var_value_by_idx(idx);
+	change->timestamp = get_monotonic_time();
+	__atomic_store_n(&var_changes_head, head + 1, __ATOMIC_RELEASE);
+	var_changes_pending = 1;
+}
+
+// Copies the values of all vars into the process image (if opened) at the end of a scan cycle.
+static void update_process_image(void)
+{
 	int i = 0;
+	if (!process_image)
+		return;
+	__atomic_add_fetch(&process_image->seq, 1, __ATOMIC_ACQ_REL);
 	for (i; i < vars_len; i++)
+		process_image_values[i] = get_var_value_by_idx(i);
+	process_image->tick = tick;
+	process_image->time_mode = time_mode;
+	process_image->current_time = __CURRENT_TIME.tv_sec * 1000000000LL
+			+ __CURRENT_TIME.tv_nsec;
+	__atomic_add_fetch(&process_image->seq, 1, __ATOMIC_RELEASE);
+}
+
+// Copies the value of a var written outside of a scan cycle into the process image (if opened).
+static void update_process_image_value(int idx)
+{
+	if (!process_image)
+		return;
+	__atomic_add_fetch(&process_image->seq, 1, __ATOMIC_ACQ_REL);
+	process_image_values[idx] = get_var_value_by_idx(idx);
+	__atomic_add_fetch(&process_image->seq, 1, __ATOMIC_RELEASE);
+}
+
+int open_process_image(const char *path)
+{
+	int i = 0;
+	size_t size = PROCESS_IMAGE_SIZE(vars_len);
+	if (process_image)
+		return 0;
+	// Create a new file rather than truncating the image of a previous run, which readers may still have mapped
+	unlink(path);
+	int fd = open(path, O_RDWR | O_CREAT | O_EXCL, 0644);
+	if (fd < 0)
 	{
-		if (addr == vars[i])
-		{
-			// Notify var change via Python ctypes callback function
-			int err = do_notify(i);
-			if (err)
-				printf(
-						"Error: Could not notify change of variable: %d (idx).\n",
-						i);
-		}
+		printf("Failed to open process image '%s'.\n", path);
+		return -1;
+	}
+	if (ftruncate(fd, size) < 0)
+	{
+		printf("Failed to resize process image '%s'.\n", path);
+		close(fd);
+		return -1;
+	}
+	void *mem = mmap(NULL, size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+	close(fd);
+	if (mem == MAP_FAILED)
+	{
+		printf("Failed to map process image '%s'.\n", path);
+		return -1;
+	}
+	struct process_image_header *header = (struct process_image_header *) mem;
+	uint8_t *types = (uint8_t *) mem + sizeof(struct process_image_header);
+	char *names = (char *) types + PROCESS_IMAGE_TYPES_SIZE(vars_len);
+	for (i; i < vars_len; i++)
+	{
+		types[i] = vars_info[i].type;
+		strncpy(names + i * PROCESS_IMAGE_NAME_LEN, vars_names[i],
+		PROCESS_IMAGE_NAME_LEN - 1);
 	}
+	process_image_values = (int64_t *) (names + vars_len * PROCESS_IMAGE_NAME_LEN);
+	header->version = PROCESS_IMAGE_VERSION;
+	header->name_len = PROCESS_IMAGE_NAME_LEN;
+	header->vars_len = vars_len;
+	header->seq = 0;
+	process_image = header;
+	update_process_image();
+	// Publish magic last, readers must not use the image before
+	__atomic_store_n(&header->magic, PROCESS_IMAGE_MAGIC, __ATOMIC_RELEASE);
+	return 0;
 }
 
-void register_var_change_callback(void (*clbk)(int))
+int close_process_image(void)
 {
-	notify_var_change_callback = clbk;
-#ifdef DEBUG
-	printf("Callback set!\n");
-#endif
+	if (!process_image)
+		return 0;
+	struct process_image_header *header = process_image;
+	process_image = NULL;
+	process_image_values = NULL;
+	// Tell readers, which still have the image mapped, that it is no longer updated
+	__atomic_store_n(&header->magic, 0, __ATOMIC_RELEASE);
+	return munmap(header, PROCESS_IMAGE_SIZE(vars_len));
 }
 
-int do_notify(int idx)
+static int is_var_watched(int idx)
 {
-	if (notify_var_change_callback)
+	return __atomic_load_n(&vars_watched[idx >> 3], __ATOMIC_RELAXED) & (1 << (idx & 7));
+}
+
+// Called by the patched POUs, if the value of the var at addr has changed.
+void set_callback(void *addr)
+{
+	int idx = find_var_idx(vars_lookup, vars_len, addr);
+	if (idx < 0)
+		return;
+	if (!is_var_watched(idx))
+		return;
+	push_var_change(idx);
+}
+
+// Enables (watched != 0) or disables recording the changes of the var with the given index.
+int set_var_watched(int idx, int watched)
+{
+	if (idx < 0 || idx >= vars_len)
+		return -1;
+	if (watched)
+		__atomic_or_fetch(&vars_watched[idx >> 3], (unsigned char) (1 << (idx & 7)), __ATOMIC_RELAXED);
+	else
+		__atomic_and_fetch(&vars_watched[idx >> 3], (unsigned char) ~(1 << (idx & 7)), __ATOMIC_RELAXED);
+	return 0;
+}
+
+// Copies up to len recorded changes into buf, waiting up to timeout_ms if none are available.
+int get_var_changes(struct var_change *buf, int len, int timeout_ms)
+{
+	unsigned int tail = __atomic_load_n(&var_changes_tail, __ATOMIC_RELAXED);
+	unsigned int head = __atomic_load_n(&var_changes_head, __ATOMIC_ACQUIRE);
+	int n = 0;
+	if (head == tail)
 	{
-#ifdef DEBUG
-		printf("Notify now!\n");
-#endif
-		notify_var_change_callback(idx);
-		return 0;
+		if (!is_plc_running)
+			return 0;
+		struct timespec deadline;
+		clock_gettime(CLOCK_REALTIME, &deadline);
+		deadline.tv_sec += timeout_ms / 1000;
+		deadline.tv_nsec += (timeout_ms % 1000) * 1000000L;
+		if (deadline.tv_nsec >= 1000000000L)
+		{
+			deadline.tv_sec++;
+			deadline.tv_nsec -= 1000000000L;
+		}
+		sem_timedwait(&sem_var_changes, &deadline);
+		head = __atomic_load_n(&var_changes_head, __ATOMIC_ACQUIRE);
 	}
-	return -1;
+	while (tail != head && n < len)
+	{
+		buf[n++] = var_changes[tail & (VAR_CHANGES_CAPACITY - 1)];
+		tail++;
+	}
+	__atomic_store_n(&var_changes_tail, tail, __ATOMIC_SEQ_CST);
+	// Wake up the producer, if it waits for space
+	if (n > 0 && __atomic_exchange_n(&var_changes_space_wanted, 0, __ATOMIC_SEQ_CST))
+		sem_post(&sem_var_changes_space);
+	return n;
+}
+
+unsigned long get_dropped_var_changes(void)
+{
+	return __atomic_load_n(&var_changes_dropped, __ATOMIC_RELAXED);
+}
+
+// Returns the number of changes recorded since the PLC has been started (modulo 2^32).
+unsigned int get_recorded_var_changes(void)
+{
+	return __atomic_load_n(&var_changes_head, __ATOMIC_ACQUIRE);
 }
 
 int get_len_of_vars_arr(void)
@@ -100,38 +388,77 @@ int get_len_of_vars_arr(void)
 	return len;
 }
 
-int set_int_val_by_idx_p(int idx, void *ptr)
+/*
+ * Writes value (TIME values in ns) into the var with the given index according
+ * to its type. While the PLC is running, a change of a watched var is recorded
+ * like the changes of a scan cycle (with the tick of the last cycle), so that
+ * the drain thread processes it. Returns 1 if so, 0 if the PLC is not running
+ * (the change is not recorded then) and -1 on error.
+ */
+int set_var_value_by_idx(int idx, int64_t value)
 {
-	if (get_len_of_vars_arr() < idx)
+	int recorded = 0;
+	int64_t old_value = 0;
+	if (idx < 0 || idx >= vars_len)
 		return -1;
-	void **var_ptr = vars[idx];
-	int **var = ((int **) var_ptr);
-#ifdef DEBUG
-	printf("Value of idx: %d before change is: %d.\n", idx, **var);
-#endif
-	sem_wait(&sem_plc_vars);
-	**var = *((int *) ptr);
+	void *ptr = vars[idx];
+	if (vars_info[idx].clazz == PLC_VAR_CLASS_LOCATED)
+		ptr = *((void **) ptr);
+	if (!ptr)
+		return -1;
+	lock_plc_vars();
+	old_value = get_var_value_by_idx(idx);
+	switch (vars_info[idx].type)
+	{
+	case PLC_VAR_TYPE_BOOL:
+		*((BOOL *) ptr) = value != 0;
+		break;
+	case PLC_VAR_TYPE_SINT:
+		*((SINT *) ptr) = (SINT) value;
+		break;
+	case PLC_VAR_TYPE_INT:
+		*((INT *) ptr) = (INT) value;
+		break;
+	case PLC_VAR_TYPE_DINT:
+		*((DINT *) ptr) = (DINT) value;
+		break;
+	case PLC_VAR_TYPE_TIME:
+		((TIME *) ptr)->tv_sec = value / 1000000000LL;
+		((TIME *) ptr)->tv_nsec = value % 1000000000LL;
+		break;
+	default:
+		unlock_plc_vars();
+		return -1;
+	}
 #ifdef DEBUG
-	printf("Value of idx: %d after change is: %d.\n", idx, **var);
+	printf("Value of idx: %d changed to: %lld.\n", idx, (long long) value);
 #endif
-	return 0;
+	// Readers of the process image see the write right away, not only after the next scan cycle
+	update_process_image_value(idx);
+	if (is_plc_running)
+	{
+		recorded = 1;
+		if (get_var_value_by_idx(idx) != old_value && is_var_watched(idx))
+		{
+			push_var_change(idx);
+			flush_var_changes();
+		}
+	}
+	unlock_plc_vars();
+	return recorded;
 }
 
-int set_int_val_by_idx_t(int idx, void *ptr)
+// Copies the values of all vars into buf (TIME values in ns) as one consistent snapshot.
+int get_all_values(int64_t *buf, int len)
 {
-	if (get_len_of_vars_arr() < idx)
+	int i = 0;
+	if (len < vars_len)
 		return -1;
-	void *var_ptr = vars[idx];
-	int *var = ((int *) var_ptr);
-#ifdef DEBUG
-	printf("Value of idx: %d before change is: %d.\n", idx, *var);
-#endif
-	sem_wait(&sem_plc_vars);
-	*var = *((int *) ptr);
-#ifdef DEBUG
-	printf("Value of idx: %d after change is: %d.\n", idx, *var);
-#endif
-	return 0;
+	lock_plc_vars();
+	for (i; i < vars_len; i++)
+		buf[i] = get_var_value_by_idx(i);
+	unlock_plc_vars();
+	return vars_len;
 }
 
 int get_ref_by_idx_t(int idx, void **ptr)
@@ -168,25 +495,80 @@ void get_time(IEC_TIME *CURRENT_TIME)
     CURRENT_TIME->tv_nsec = tmp_time.tv_nsec;
 }
 
-void timer_notify(sigval_t val)
+// Advances __CURRENT_TIME by one tick, used if the PLC does not run in real-time.
+static void advance_time(void)
 {
-	get_time(&__CURRENT_TIME);
-	sem_post(&sem_plc_timer);
+	__CURRENT_TIME.tv_sec += common_ticktime__ / 1000000000;
+	__CURRENT_TIME.tv_nsec += common_ticktime__ % 1000000000;
+	if (__CURRENT_TIME.tv_nsec >= 1000000000)
+	{
+		__CURRENT_TIME.tv_sec++;
+		__CURRENT_TIME.tv_nsec -= 1000000000;
+	}
 }
 
-void catch_signal(int sig)
+// Returns the interval of the timer in ns according to the time mode, 0 disarms the timer.
+static long long get_timer_interval(void)
 {
-#ifdef DEBUG
-	printf("Got signal %d.\n", sig);
-#endif
-	if (is_plc_running)
-		stop_plc();
+	long long interval = common_ticktime__;
+	switch (time_mode)
+	{
+	case PLC_TIME_MODE_DILATED:
+		interval = (long long) (common_ticktime__ / time_dilation);
+		return interval > 0 ? interval : 1;
+	case PLC_TIME_MODE_ASAP:
+	case PLC_TIME_MODE_STEP:
+		return 0;
+	default:
+		return interval;
+	}
+}
+
+/*
+ * Records the timing of a scan cycle, must be called while holding the lock.
+ * lateness is negative, if the scan cycle has not been triggered by the timer.
+ */
+static void record_scan_stats(int64_t lateness, int64_t exec)
+{
+	long long interval = get_timer_interval();
+	scan_stats.cycles++;
+	scan_stats.exec_sum += exec;
+	if (exec > scan_stats.exec_max)
+		scan_stats.exec_max = exec;
+	scan_stats.exec_hist[get_scan_stats_bucket(exec)]++;
+	if (lateness < 0)
+		return;
+	if (interval > 0 && exec > interval)
+		scan_stats.overruns++;
+	scan_stats.timed_cycles++;
+	scan_stats.lateness_sum += lateness;
+	if (lateness > scan_stats.lateness_max)
+		scan_stats.lateness_max = lateness;
+	scan_stats.lateness_hist[get_scan_stats_bucket(lateness)]++;
+}
+
+static void timer_notify(sigval_t val)
+{
+	int pending = 0;
+	int overrun = 0;
+	if (time_mode == PLC_TIME_MODE_REALTIME)
+		get_time(&__CURRENT_TIME);
+	// The previous expiry has not been consumed by the PLC thread yet
+	sem_getvalue(&sem_plc_timer, &pending);
+	if (pending > 0)
+		__atomic_add_fetch(&scan_stats.missed_ticks, 1, __ATOMIC_RELAXED);
+	overrun = timer_getoverrun(timer);
+	if (overrun > 0)
+		__atomic_add_fetch(&scan_stats.missed_ticks, overrun, __ATOMIC_RELAXED);
+	__atomic_store_n(&last_release, get_monotonic_time(), __ATOMIC_RELEASE);
+	sem_post(&sem_plc_timer);
 }
 
 void init_timer(struct itimerspec *timer_values, sigevent_t *sigev)
 {
-	long tv_nsec = common_ticktime__ % 1000000000;
-	time_t tv_sec = common_ticktime__ / 1000000000;
+	long long interval = get_timer_interval();
+	long tv_nsec = interval % 1000000000;
+	time_t tv_sec = interval / 1000000000;
 
 	memset(sigev, 0, sizeof(struct sigevent));
 	memset(timer_values, 0, sizeof(struct itimerspec));
@@ -203,11 +585,42 @@ void init_timer(struct itimerspec *timer_values, sigevent_t *sigev)
 void plc_thread_routine_c(void *arg)
 {
 
+	int64_t start = 0;
+	int64_t lateness = 0;
 	while (is_plc_running)
 	{
-		sem_post(&sem_plc_vars);
-		sem_wait(&sem_plc_timer);
+		int mode = __atomic_load_n(&time_mode, __ATOMIC_RELAXED);
+		int timed = 0;
+		if (mode == PLC_TIME_MODE_STEP)
+		{
+			sem_wait(&sem_plc_step);
+			// Woken up, because the PLC is stopping or the time mode has been switched
+			if (!is_plc_running || time_mode != PLC_TIME_MODE_STEP)
+				continue;
+		}
+		else if (mode != PLC_TIME_MODE_ASAP)
+		{
+			sem_wait(&sem_plc_timer);
+			// Woken up, because the time mode has been switched to stepping
+			if (time_mode == PLC_TIME_MODE_STEP)
+				continue;
+			timed = 1;
+		}
+		sem_wait(&sem_plc_vars);
+		start = get_monotonic_time();
+		lateness = timed ? start - __atomic_load_n(&last_release, __ATOMIC_ACQUIRE) : -1;
+		if (time_mode != PLC_TIME_MODE_REALTIME)
+			advance_time();
 		run(__CURRENT_TIME.tv_sec, __CURRENT_TIME.tv_nsec);
+		record_scan_stats(lateness, get_monotonic_time() - start);
+		update_process_image();
+		sem_post(&sem_plc_vars);
+		flush_var_changes();
+		// Give accessors a chance to acquire the lock between back-to-back scan cycles
+		if (mode == PLC_TIME_MODE_ASAP)
+			sched_yield();
+		else if (mode == PLC_TIME_MODE_STEP)
+			sem_post(&sem_plc_step_done);
 	}
 #ifdef DEBUG
 	printf("Exit PLC thread.\n");
@@ -232,6 +645,13 @@ int start_plc(void)
 	int err = 0;
 	is_plc_running = 1;
 
+	init_vars_lookup(vars_lookup, vars_len);
+	var_changes_head = 0;
+	var_changes_tail = 0;
+	var_changes_pending = 0;
+	var_changes_space_wanted = 0;
+	memset(&scan_stats, 0, sizeof(struct scan_stats));
+
 	err = sem_init(&sem_plc_timer, 0, 0);
 	if (err < 0)
 	{
@@ -239,13 +659,51 @@ int start_plc(void)
 		return err;
 	}
 
-	err = sem_init(&sem_plc_vars, 0, 0);
+	err = sem_init(&sem_plc_vars, 0, 1);
 	if (err < 0)
 	{
 		printf("Failed to initialize semaphore for PLC vars.\n");
 		return err;
 	}
 
+	err = sem_init(&sem_var_changes, 0, 0);
+	if (err < 0)
+	{
+		printf("Failed to initialize semaphore for var changes.\n");
+		return err;
+	}
+
+	err = sem_init(&sem_var_changes_space, 0, 0);
+	if (err < 0)
+	{
+		printf("Failed to initialize semaphore for var changes space.\n");
+		return err;
+	}
+
+	err = sem_init(&sem_plc_step, 0, 0);
+	if (err < 0)
+	{
+		printf("Failed to initialize semaphore for steps.\n");
+		return err;
+	}
+
+	err = sem_init(&sem_plc_step_done, 0, 0);
+	if (err < 0)
+	{
+		printf("Failed to initialize semaphore for finished steps.\n");
+		return err;
+	}
+
+	/*
+	 * Must precede the creation of the PLC thread, which may execute a scan
+	 * cycle right away (e.g., if the PLC is restarted in PLC_TIME_MODE_ASAP),
+	 * before the pointers of located vars would be bound otherwise.
+	 */
+	config_init__();
+
+	// Virtual time starts at the wall clock time
+	get_time(&__CURRENT_TIME);
+
 	err = pthread_create(&plc_thread, NULL, (void*) &plc_thread_routine_c,
 			NULL);
 	if (err)
@@ -263,8 +721,6 @@ int start_plc(void)
 	printf("Tick-time is: %d ns.\nTimer values: sec = %ld, nsec = %ld.\n", common_ticktime__, timer_values.it_interval.tv_sec, timer_values.it_interval.tv_nsec);
 #endif
 
-	config_init__();
-
 	err = timer_create(CLOCK_REALTIME, &sigev, &timer);
 	if (err < 0)
 	{
@@ -278,20 +734,155 @@ int start_plc(void)
 		printf("Failed to arm or disarm the timer.\n");
 		return err;
 	}
-	/* Install signal handler for manual break. */
-	signal(SIGTERM, catch_signal);
-	signal(SIGINT, catch_signal);
+	// No signal handlers are installed, signals are handled by the (possibly shared) supervisor process
+	return 0;
+}
+
+// Returns whether the scan cycles of the time mode are triggered by the timer.
+static int is_timed_mode(int mode)
+{
+	return mode == PLC_TIME_MODE_REALTIME || mode == PLC_TIME_MODE_DILATED;
+}
+
+// Wakes up the callers of step_plc, which then return as the PLC stopped or left PLC_TIME_MODE_STEP.
+static void wake_steppers(void)
+{
+	int i = __atomic_load_n(&steppers, __ATOMIC_SEQ_CST);
+	for (i; i > 0; i--)
+		sem_post(&sem_plc_step_done);
+}
+
+/*
+ * Switches the time mode (cf. plc_time_mode.h), factor is the time dilation
+ * used in PLC_TIME_MODE_DILATED. Switching back to PLC_TIME_MODE_REALTIME
+ * resets __CURRENT_TIME to the wall clock time.
+ */
+int set_time_mode(int mode, double factor)
+{
+	struct itimerspec timer_values;
+	long long interval = 0;
+	int prev_mode = time_mode;
+	if (mode < PLC_TIME_MODE_REALTIME || mode > PLC_TIME_MODE_STEP)
+		return -1;
+	if (mode == PLC_TIME_MODE_DILATED && factor <= 0)
+		return -1;
+	lock_plc_vars();
+	__atomic_store_n(&time_mode, mode, __ATOMIC_RELAXED);
+	time_dilation = mode == PLC_TIME_MODE_DILATED ? factor : 1.0;
+	if (mode == PLC_TIME_MODE_REALTIME)
+		get_time(&__CURRENT_TIME);
+	// Published right away, as no scan cycle may follow (e.g., in PLC_TIME_MODE_STEP)
+	if (process_image)
+		process_image->time_mode = mode;
+	unlock_plc_vars();
+	if (!is_plc_running)
+		return 0;
+	if (mode == PLC_TIME_MODE_STEP && prev_mode != PLC_TIME_MODE_STEP)
+	{
+		// Discard steps left over from a previous stepping session
+		while (sem_trywait(&sem_plc_step) == 0)
+			;
+		while (sem_trywait(&sem_plc_step_done) == 0)
+			;
+	}
+	interval = get_timer_interval();
+	memset(&timer_values, 0, sizeof(struct itimerspec));
+	timer_values.it_value.tv_sec = interval / 1000000000;
+	timer_values.it_value.tv_nsec = interval % 1000000000;
+	timer_values.it_interval = timer_values.it_value;
+	if (timer_settime(timer, 0, &timer_values, NULL) < 0)
+	{
+		printf("Failed to arm or disarm the timer.\n");
+		return -1;
+	}
+	// Discard expiries of the previous timer and wake-ups left over from previous switches, which would trigger untimed scan cycles
+	while (sem_trywait(&sem_plc_timer) == 0)
+		;
+	// Wake up the PLC thread, which may still wait for the (now disarmed) timer
+	if (is_timed_mode(prev_mode) && !is_timed_mode(mode))
+		sem_post(&sem_plc_timer);
+	// Wake up the PLC thread, which may still wait for a step, and abort pending steps
+	if (prev_mode == PLC_TIME_MODE_STEP && mode != PLC_TIME_MODE_STEP)
+	{
+		sem_post(&sem_plc_step);
+		wake_steppers();
+	}
+	return 0;
+}
+
+/*
+ * Executes exactly n scan cycles and returns once they have finished. The
+ * PLC must run in PLC_TIME_MODE_STEP. Returns the tick of the last cycle, or
+ * -1 if the PLC stopped or left PLC_TIME_MODE_STEP before the cycles finished.
+ */
+int step_plc(int n)
+{
+	int i = 0;
+	int ret = -1;
+	__atomic_add_fetch(&steppers, 1, __ATOMIC_SEQ_CST);
+	if (__atomic_load_n(&is_plc_running, __ATOMIC_SEQ_CST) && time_mode == PLC_TIME_MODE_STEP && n >= 0)
+	{
+		for (i; i < n; i++)
+			sem_post(&sem_plc_step);
+		for (i = 0; i < n; i++)
+		{
+			sem_wait(&sem_plc_step_done);
+			if (!is_plc_running || time_mode != PLC_TIME_MODE_STEP)
+				break;
+		}
+		if (i == n)
+			ret = tick;
+	}
+	__atomic_sub_fetch(&steppers, 1, __ATOMIC_SEQ_CST);
+	return ret;
+}
 
+// Returns __CURRENT_TIME in ns.
+long long get_plc_time(void)
+{
+	long long now = 0;
+	lock_plc_vars();
+	now = __CURRENT_TIME.tv_sec * 1000000000LL + __CURRENT_TIME.tv_nsec;
+	unlock_plc_vars();
+	return now;
+}
+
+// Returns the interval of the scan cycles in ns (of the PLC's virtual time).
+long long get_tick_time(void)
+{
+	return common_ticktime__;
+}
+
+// Copies the timing statistics of the scan cycles into stats.
+int get_scan_stats(struct scan_stats *stats)
+{
+	lock_plc_vars();
+	memcpy(stats, &scan_stats, sizeof(struct scan_stats));
+	stats->missed_ticks = __atomic_load_n(&scan_stats.missed_ticks, __ATOMIC_RELAXED);
+	unlock_plc_vars();
 	return 0;
 }
 
+void reset_scan_stats(void)
+{
+	lock_plc_vars();
+	memset(&scan_stats, 0, sizeof(struct scan_stats));
+	unlock_plc_vars();
+}
+
 int stop_plc(void)
 {
 	if (!is_plc_running)
 		return 0;
 
 	int err = 0;
-	is_plc_running = 0;
+	__atomic_store_n(&is_plc_running, 0, __ATOMIC_SEQ_CST);
+	// Wake up the PLC thread, if it waits for a step or for space for var changes
+	if (time_mode == PLC_TIME_MODE_STEP)
+	{
+		sem_post(&sem_plc_step);
+		sem_post(&sem_var_changes_space);
+	}
 	err = pthread_join(plc_thread, NULL);
 	if (err)
 	{
@@ -302,6 +893,12 @@ int stop_plc(void)
 	else
 	printf("Joined PLC thread.\n");
 #endif
+	// Abort pending steps, whose callers must return before the semaphores are destroyed
+	while (__atomic_load_n(&steppers, __ATOMIC_SEQ_CST) > 0)
+	{
+		wake_steppers();
+		sched_yield();
+	}
 	err = sem_destroy(&sem_plc_timer);
 	if (err < 0)
 	{
@@ -314,6 +911,30 @@ int stop_plc(void)
 		printf("Failed to destroy semaphore for PLC vars.\n");
 		return err;
 	}
+	err = sem_destroy(&sem_var_changes);
+	if (err < 0)
+	{
+		printf("Failed to destroy semaphore for var changes.\n");
+		return err;
+	}
+	err = sem_destroy(&sem_var_changes_space);
+	if (err < 0)
+	{
+		printf("Failed to destroy semaphore for var changes space.\n");
+		return err;
+	}
+	err = sem_destroy(&sem_plc_step);
+	if (err < 0)
+	{
+		printf("Failed to destroy semaphore for steps.\n");
+		return err;
+	}
+	err = sem_destroy(&sem_plc_step_done);
+	if (err < 0)
+	{
+		printf("Failed to destroy semaphore for finished steps.\n");
+		return err;
+	}
 	err = timer_delete(timer);
 	if (err < 0)
 	{
@@ -11,6 +11,17 @@ import logging
 logging.basicConfig(filename=LOG_FILE_LOC, level=LOG_LEVEL)
 logger = logging.getLogger('prepreprocessor')
 
+# Mapping of MatIEC data types to the types of the PLC runtime (cf. plcruntime/inc/plc_vars.h)
+plc_var_types = {
+    'BOOL': 'PLC_VAR_TYPE_BOOL',
+    'SINT': 'PLC_VAR_TYPE_SINT',
+    'INT': 'PLC_VAR_TYPE_INT',
+    'DINT': 'PLC_VAR_TYPE_DINT',
+    'TIME': 'PLC_VAR_TYPE_TIME'
+}
+# Classes of variables whose struct holds a pointer to the value (cf. plcruntime/inc/plc_vars.h)
+plc_located_var_classes = ['IN', 'OUT', 'MEM']
+
 
 def patch_pous_h(tmp_path):
     pous_h_path = '{}/POUS.h'.format(tmp_path)
@@ -40,6 +51,8 @@ def patch_plc_runtime(pkg_filepath, tmp_path):
 
     # List to store located variable names
     vars = []
+    # List to store { type, class } initializers of located variables
+    vars_info = []
     program_name = None
     prog_variable = None
     # Open csv file
@@ -71,6 +84,9 @@ def patch_plc_runtime(pkg_filepath, tmp_path):
             symbols = row[3]
             var_name = "".join(symbols.rsplit(symbols_prog + '.'))
             vars.append(var_name)
+            var_type = plc_var_types.get(row[-2], 'PLC_VAR_TYPE_UNSUPPORTED')
+            var_class = 'PLC_VAR_CLASS_LOCATED' if clazz in plc_located_var_classes else 'PLC_VAR_CLASS_VAR'
+            vars_info.append('{{ {}, {} }}'.format(var_type, var_class))
 
     if program_name is not None and prog_variable is not None and vars:
         # List of lines to write in PLC runtime C source file
@@ -89,6 +105,21 @@ def patch_plc_runtime(pkg_filepath, tmp_path):
                     addr_var_l = map(lambda i: '&({}.{})'.format(prog_variable, i), vars)
                     # Join them together to be used in array
                     lines.append('{}\n'.format(', '.join(addr_var_l)))
+                    continue
+                match = utils.vars_lookup_placeholder_pattern_obj.match(line)
+                if match:
+                    # Build up list of { addr, idx } entries, which will be sorted by address at runtime
+                    lookup_l = map(lambda (idx, i): '{{ &({}.{}), {} }}'.format(prog_variable, i, idx),
+                                   enumerate(vars))
+                    lines.append('{}\n'.format(', '.join(lookup_l)))
+                    continue
+                match = utils.vars_info_placeholder_pattern_obj.match(line)
+                if match:
+                    lines.append('{}\n'.format(', '.join(vars_info)))
+                    continue
+                match = utils.vars_names_placeholder_pattern_obj.match(line)
+                if match:
+                    lines.append('{}\n'.format(', '.join(map(lambda i: '"{}"'.format(i), vars))))
                 else:
                     lines.append(line + '\n')
 
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+from cpstwinning.utils import UnknownPlcTagException, NotSupportedPlcTagTypeException
+
+from time import sleep
+
+import os
+import mmap
+import struct
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cf. plcruntime/inc/plc_process_image.h
+PROCESS_IMAGE_FILENAME = 'process_image'
+PROCESS_IMAGE_MAGIC = 0x49535043
+PROCESS_IMAGE_VERSION = 1
+# magic, version, name_len, vars_len, time_mode, seq, tick, current_time
+PROCESS_IMAGE_HEADER = struct.Struct('=IHHIIQQq')
+PROCESS_IMAGE_MAGIC_FIELD = struct.Struct('=I')
+PROCESS_IMAGE_SEQ = struct.Struct('=Q')
+PROCESS_IMAGE_SEQ_OFFSET = 16
+# Maximum number of attempts to read a consistent snapshot
+MAX_READ_ATTEMPTS = 1000
+# Time in s to wait after a failed attempt, so that a writer, which has been preempted while writing, can go on
+READ_RETRY_DELAY = 0.00001
+
+# Cf. enum plc_var_type in plcruntime/inc/plc_vars.h
+PLC_VAR_TYPE_BOOL = 1
+PLC_VAR_TYPE_SINT = 2
+PLC_VAR_TYPE_INT = 3
+PLC_VAR_TYPE_DINT = 4
+PLC_VAR_TYPE_TIME = 5
+
+# Cf. enum plc_time_mode in plcruntime/inc/plc_time_mode.h
+PLC_TIME_MODE_REALTIME = 0
+PLC_TIME_MODE_DILATED = 1
+PLC_TIME_MODE_ASAP = 2
+PLC_TIME_MODE_STEP = 3
+PLC_TIME_MODES = {
+    'realtime': PLC_TIME_MODE_REALTIME,
+    'dilated': PLC_TIME_MODE_DILATED,
+    'asap': PLC_TIME_MODE_ASAP,
+    'step': PLC_TIME_MODE_STEP
+}
+
+
+def get_process_image_path(tmp_path):
+    return os.path.join(tmp_path, PROCESS_IMAGE_FILENAME)
+
+
+class ProcessImage(object):
+    """Read-only view on the memory-mapped process image published by a PLC runtime."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.inode = os.fstat(f.fileno()).st_ino
+        self.path = path
+        magic, version, name_len, vars_len, _, _, _, _ = PROCESS_IMAGE_HEADER.unpack_from(self._mm, 0)
+        if magic != PROCESS_IMAGE_MAGIC or version != PROCESS_IMAGE_VERSION:
+            self._mm.close()
+            raise IOError("Process image '{}' is not ready or has an unsupported version.".format(path))
+        types_offset = PROCESS_IMAGE_HEADER.size
+        names_offset = types_offset + ((vars_len + 7) // 8) * 8
+        self.vars_len = vars_len
+        self.types = struct.unpack_from('={}B'.format(vars_len), self._mm, types_offset)
+        self.names = [self._mm[names_offset + i * name_len:names_offset + (i + 1) * name_len].split('\0', 1)[0]
+                      for i in xrange(vars_len)]
+        # Case-insensitive, as in VARIABLES.csv all names are in upper-case
+        self.idx = dict((name.upper(), i) for i, name in enumerate(self.names))
+        self._values = struct.Struct('={}q'.format(vars_len))
+        self._values_offset = names_offset + vars_len * name_len
+
+    def __read(self):
+        """Returns (tick, current_time, raw values) of a consistent snapshot, guarded by the seqlock."""
+        for _ in xrange(MAX_READ_ATTEMPTS):
+            seq, = PROCESS_IMAGE_SEQ.unpack_from(self._mm, PROCESS_IMAGE_SEQ_OFFSET)
+            if not seq & 1:
+                _, _, _, _, _, _, tick, current_time = PROCESS_IMAGE_HEADER.unpack_from(self._mm, 0)
+                values = self._values.unpack_from(self._mm, self._values_offset)
+                if PROCESS_IMAGE_SEQ.unpack_from(self._mm, PROCESS_IMAGE_SEQ_OFFSET)[0] == seq:
+                    return tick, current_time, values
+            sleep(READ_RETRY_DELAY)
+        raise IOError('Could not read a consistent snapshot of the process image.')
+
+    def __convert(self, idx, raw):
+        var_type = self.types[idx]
+        if var_type == PLC_VAR_TYPE_BOOL:
+            return bool(raw)
+        elif var_type == PLC_VAR_TYPE_SINT or var_type == PLC_VAR_TYPE_INT or var_type == PLC_VAR_TYPE_DINT:
+            return int(raw)
+        return None
+
+    def is_supported(self, idx):
+        return self.types[idx] in (PLC_VAR_TYPE_BOOL, PLC_VAR_TYPE_SINT, PLC_VAR_TYPE_INT, PLC_VAR_TYPE_DINT)
+
+    def get_value(self, name):
+        idx = self.idx.get(name.upper())
+        if idx is None:
+            raise UnknownPlcTagException("Variable name '{}' does not exist in PLC.\n".format(name))
+        if not self.is_supported(idx):
+            raise NotSupportedPlcTagTypeException("Type of variable '{}' is currently not supported.".format(name))
+        _, _, values = self.__read()
+        return self.__convert(idx, values[idx])
+
+    def snapshot(self):
+        """Returns a consistent list of {'name': ..., 'value': ...} of all tags of supported types."""
+        _, _, values = self.__read()
+        return [{'name': self.names[i], 'value': self.__convert(i, values[i])}
+                for i in xrange(self.vars_len) if self.is_supported(i)]
+
+    def get_current_time(self):
+        """Returns the PLC's __CURRENT_TIME of the last scan cycle in ns."""
+        _, current_time, _ = self.__read()
+        return current_time
+
+    def get_tick(self):
+        tick, _, _ = self.__read()
+        return tick
+
+    def is_stale(self):
+        """Returns whether the runtime has closed the image or replaced it by a new one (e.g., after a restart)."""
+        magic, = PROCESS_IMAGE_MAGIC_FIELD.unpack_from(self._mm, 0)
+        if magic != PROCESS_IMAGE_MAGIC:
+            return True
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return True
+
+    def get_time_mode(self):
+        _, _, _, _, time_mode, _, _, _ = PROCESS_IMAGE_HEADER.unpack_from(self._mm, 0)
+        return time_mode
+
+    def close(self):
+        self._mm.close()
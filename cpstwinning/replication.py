@@ -69,21 +69,46 @@ class StimulusIssuer(Thread):
         def get_formatted_timestamp():
             return datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 
+        # {(twin name, tag name): (stimulus, future)} of issued stimuli, whose responses are still pending, so that
+        # the next stimulus does not have to wait for the response of the previous one
+        pending = {}
+
+        def complete_stimulus(stim, future):
+            try:
+                future.result()
+                logger.info("[%s] Issued stimulus: [twin=%s,%s=%s,t=%d].", get_formatted_timestamp(),
+                            stim.twin_name, stim.tag_name, stim.value, long(stim.timestamp))
+            except Exception:
+                logger.exception("Issuing stimulus [twin=%s,%s=%s,t=%d] failed.", stim.twin_name, stim.tag_name,
+                                 stim.value, long(stim.timestamp))
+
+        def complete_stimuli(wait=False):
+            for key in [key for key, (_, future) in pending.items() if wait or future.done()]:
+                complete_stimulus(*pending.pop(key))
+
         def issue_stimulus(stim):
             """Issues a stimulus on the respective digital twin."""
             if stim.twin_name in self.cpstw:
                 twin = self.cpstw[stim.twin_name]
                 if isinstance(twin, Plc) or isinstance(twin, Hmi):
+                    key = (stim.twin_name, stim.tag_name)
+                    # Stimuli of the same tag must take effect in order
+                    if key in pending:
+                        complete_stimulus(*pending.pop(key))
                     logger.info("[%s] Issuing stimulus: [twin=%s,%s=%s,t=%d].", get_formatted_timestamp(),
                                 stim.twin_name, stim.tag_name, stim.value, long(stim.timestamp))
                     # Check if stimulus represents a get call
                     if stim.value is None:
-                        twin.get_var_value(stim.tag_name)
+                        if isinstance(twin, Plc):
+                            future = twin.read_var_value_async(stim.tag_name)
+                        else:
+                            future = twin.get_var_value_async(stim.tag_name)
                     # Must be set call
+                    elif isinstance(twin, Plc):
+                        future = twin.write_var_value_async(stim.tag_name, stim.value)
                     else:
-                        twin.set_var_value(stim.tag_name, stim.value)
-                    logger.info("[%s] Issued stimulus: [twin=%s,%s=%s,t=%d].", get_formatted_timestamp(),
-                                stim.twin_name, stim.tag_name, stim.value, long(stim.timestamp))
+                        future = twin.set_var_value_async(stim.tag_name, stim.value)
+                    pending[key] = (stim, future)
                 elif isinstance(twin, RfidReaderMqttWiFi):
                     logger.info("[%s] Issuing stimulus: [twin=%s,value=%s,t=%d].", get_formatted_timestamp(),
                                 stim.twin_name, stim.value, long(stim.timestamp))
@@ -113,8 +138,12 @@ class StimulusIssuer(Thread):
                 # Track issue time
                 issue_time = current_ms()
                 issue_stimulus(first_issued_stimulus)
+                complete_stimuli()
                 last_issued_stimulus = first_issued_stimulus
             else:
+                if self._pq.empty():
+                    # Idle until the next stimulus arrives
+                    complete_stimuli(wait=True)
                 _, st = self._pq.get()
                 delta = long(st.timestamp) - long(first_issued_stimulus.timestamp)
                 logger.info("Stimulus_0: %d, Stimulus_i: %d. Time difference: %d.",
@@ -128,6 +157,10 @@ class StimulusIssuer(Thread):
                         break
 
                 time_to_sleep = (issue_time + delta) - current_ms()
+                if time_to_sleep > 0 and pending:
+                    # Idle until the next stimulus is due
+                    complete_stimuli(wait=True)
+                    time_to_sleep = (issue_time + delta) - current_ms()
                 logger.info("Issuing next stimulus in %d ms.", time_to_sleep)
                 if time_to_sleep > 0:
                     logger.info("Sleeping for %d ms.", time_to_sleep)
@@ -145,8 +178,10 @@ class StimulusIssuer(Thread):
                     logger.info("State replication delay of %d ms.", time_to_sleep * -1)
 
                 issue_stimulus(st)
+                complete_stimuli()
                 last_issued_stimulus = st
 
+        complete_stimuli(wait=True)
         logger.info("Stimulus issuer terminated.")
 
     def stop(self):
@@ -3,17 +3,9 @@
 from mininet.node import Host
 from mininet.log import error
 from threading import Thread
-from multiprocessing.connection import Client
-from cpstwinning.plcmessages import TerminateMessage, MonitorMessage, MonitorResponseMessage, GetTagMessage, \
-    GetTagResponseMessage
-from cpstwinning.utils import UnknownPlcTagException
-from time import sleep
-from errno import ENOENT
-
-import os
-import utils
+from cpstwinning.utils import UnknownPlcTagException, NotSupportedPlcTagTypeException
+
 import logging
-import socket
 
 logger = logging.getLogger(__name__)
 
@@ -41,12 +33,10 @@ class SecurityManager(object):
         for rule_type, rules in security_rules.iteritems():
             if rule_type == RuleTypes().VARCONSTRAINT:
                 for rule in rules:
-                    var_monitoring_thread = VariableMonitoringThread(rule)
-                    var_monitoring_thread.start()
+                    rule['plc'].subscribe([rule['var_name']], VariableMonitor(rule).on_change)
             elif rule_type == RuleTypes().VARLINKCONSTRAINT:
                 for rule in rules:
-                    var_link_plc_monitoring_thread = VariableLinkPlcMonitoringThread(rule)
-                    var_link_plc_monitoring_thread.start()
+                    rule['plc'].subscribe([rule['plc_var']], VariableLinkPlcMonitor(rule).on_change)
                     rule['hmi'].set_var_link_clbk(self.check_var_link_get_set_hmi_var)
 
     def check_var_link_get_set_hmi_var(self, var):
@@ -58,120 +48,38 @@ class SecurityManager(object):
                         var_link_hmi_monitoring_thread.start()
 
 
-class VariableMonitoringThread(Thread):
+class VariableMonitor(object):
 
     def __init__(self, rule):
-        Thread.__init__(self)
         self.rule = rule
-        self.listener_ready = False
-
-    def __create_connection(self):
-        tmp_base = utils.get_tmp_base_path_from_mkfile()
-        plc_base_path = os.path.join(tmp_base, self.rule['plc'].name)
-        address = os.path.join(plc_base_path, 'plc_socket')
-        # Wait until listener is ready
-        # TODO: Refactoring needed (anti-pattern)
-        while not self.listener_ready:
-            try:
-                self.conn = Client(address)
-                self.listener_ready = True
-            except socket.error as e:
-                # Check if listener is not yet ready
-                if e.errno == ENOENT:  # socket.error: [Errno 2] No such file or directory
-                    sleep(1)
-                else:
-                    logger.exception("Unknown socket error occurred.")
 
-    def run(self):
-        self.__create_connection()
-        tag_names = [self.rule['var_name']]
-        self.conn.send(MonitorMessage(tag_names))
-        while True:
-            try:
-                if self.conn.poll():
-                    result = self.conn.recv()
-                    if isinstance(result, UnknownPlcTagException):
-                        raise UnknownPlcTagException(result)
-                    elif isinstance(result, TerminateMessage):
-                        logger.info("Terminating monitoring of '{}'.".format(self.rule['var_name']))
-                        break
-                    elif isinstance(result, MonitorResponseMessage):
-                        if self.rule['predicate'] == Predicates.MAXVAL:
-                            if int(result.value) > self.rule['value']:
-                                logger.warning("ALERT! '{}' tag [{}={}] exceeds max value of {}."
-                                               .format(self.rule['plc'].name, self.rule['var_name'], result.value,
-                                                       self.rule['value']))
-                    else:
-                        logger.error("Received unexpected message type '%s'.", type(result))
-            except EOFError:
-                logger.exception("Received EOF.")
-                break
-            except UnknownPlcTagException:
-                logger.exception("Unknown PLC Tag.")
-
-        self.conn.close()
-
-
-class VariableLinkPlcMonitoringThread(Thread):
+    def on_change(self, plc, name, value, timestamp):
+        if self.rule['predicate'] == Predicates.MAXVAL:
+            if int(value) > self.rule['value']:
+                logger.warning("ALERT! '{}' tag [{}={}] exceeds max value of {}."
+                               .format(self.rule['plc'].name, self.rule['var_name'], value, self.rule['value']))
+
+
+class VariableLinkPlcMonitor(object):
 
     def __init__(self, rule):
-        Thread.__init__(self)
         self.rule = rule
-        self.listener_ready = False
-
-    def __create_connection(self):
-        tmp_base = utils.get_tmp_base_path_from_mkfile()
-        plc_base_path = os.path.join(tmp_base, self.rule['plc'].name)
-        address = os.path.join(plc_base_path, 'plc_socket')
-        # Wait until listener is ready
-        # TODO: Refactoring needed (anti-pattern)
-        while not self.listener_ready:
-            try:
-                self.conn = Client(address)
-                self.listener_ready = True
-            except socket.error as e:
-                # Check if listener is not yet ready
-                if e.errno == ENOENT:  # socket.error: [Errno 2] No such file or directory
-                    sleep(1)
-                else:
-                    logger.exception("Unknown socket error occurred.")
 
-    def run(self):
-        self.__create_connection()
-        tag_names = [self.rule['plc_var']]
-        self.conn.send(MonitorMessage(tag_names))
-        while True:
-            try:
-                result = self.conn.recv()
-                if isinstance(result, UnknownPlcTagException):
-                    raise UnknownPlcTagException(result)
-                elif isinstance(result, TerminateMessage):
-                    logger.info("Terminating monitoring of '{}'.".format(self.rule['plc_var']))
-                    break
-                elif isinstance(result, MonitorResponseMessage):
-                    if self.rule['predicate'] == Predicates.EQUALS:
-                        for var in self.rule['hmi'].vars:
-                            warn = False
-                            if var['name'] == self.rule['hmi_var']:
-                                if type(var['value']) is int:
-                                    if var['value'] != int(result.value):
-                                        warn = True
-                                elif type(var['value']) is bool:
-                                    if var['value'] != (result.value == 'True'):
-                                        warn = True
-                                if warn:
-                                    logger.warning("ALERT! '{}' tag [{}={}] does not equal '{}' tag [{}={}]."
-                                                   .format(self.rule['hmi'].name, var['name'], var['value'],
-                                                           self.rule['plc'].name, self.rule['plc_var'], result.value))
-                else:
-                    logger.error("Received unexpected message type '%s'.", type(result))
-            except EOFError:
-                logger.exception("Received EOF.")
-                break
-            except UnknownPlcTagException:
-                logger.exception("Unknown PLC Tag.")
-
-        self.conn.close()
+    def on_change(self, plc, name, value, timestamp):
+        if self.rule['predicate'] == Predicates.EQUALS:
+            for var in self.rule['hmi'].vars:
+                warn = False
+                if var['name'] == self.rule['hmi_var']:
+                    if type(var['value']) is int:
+                        if var['value'] != int(value):
+                            warn = True
+                    elif type(var['value']) is bool:
+                        if var['value'] != (value == 'True'):
+                            warn = True
+                    if warn:
+                        logger.warning("ALERT! '{}' tag [{}={}] does not equal '{}' tag [{}={}]."
+                                       .format(self.rule['hmi'].name, var['name'], var['value'],
+                                               self.rule['plc'].name, self.rule['plc_var'], value))
 
 
 class VariableLinkHmiMonitoringThread(Thread):
@@ -179,53 +87,29 @@ class VariableLinkHmiMonitoringThread(Thread):
     def __init__(self, rule):
         Thread.__init__(self)
         self.rule = rule
-        self.listener_ready = False
-
-    def __create_connection(self):
-        tmp_base = utils.get_tmp_base_path_from_mkfile()
-        plc_base_path = os.path.join(tmp_base, self.rule['plc'].name)
-        address = os.path.join(plc_base_path, 'plc_socket')
-        # Wait until listener is ready
-        # TODO: Refactoring needed (anti-pattern)
-        while not self.listener_ready:
-            try:
-                self.conn = Client(address)
-                self.listener_ready = True
-            except socket.error as e:
-                # Check if listener is not yet ready
-                if e.errno == ENOENT:  # socket.error: [Errno 2] No such file or directory
-                    sleep(1)
-                else:
-                    logger.exception("Unknown socket error occurred.")
 
     def run(self):
-        self.__create_connection()
-        # TODO: FIX UPPER
-        self.conn.send(GetTagMessage(self.rule['plc_var'].upper()))
         try:
-            result = self.conn.recv()
-            if isinstance(result, UnknownPlcTagException):
-                raise UnknownPlcTagException(result)
-            elif isinstance(result, GetTagResponseMessage):
-                if self.rule['predicate'] == Predicates.EQUALS:
-                    for var in self.rule['hmi'].vars:
-                        warn = False
-                        if var['name'] == self.rule['hmi_var']:
-                            if type(var['value']) is int:
-                                if var['value'] != int(result.value):
-                                    warn = True
-                            elif type(var['value']) is bool:
-                                if var['value'] != (result.value == 'True'):
-                                    warn = True
-                            if warn:
-                                logger.warning("ALERT! '{}' tag [{}={}] does not equal '{}' tag [{}={}]."
-                                               .format(self.rule['hmi'].name, var['name'], var['value'],
-                                                       self.rule['plc'].name, self.rule['plc_var'], result.value))
-            else:
-                logger.error("Received unexpected message type '%s'.", type(result))
+            # Read from the PLC's process image (falls back to IPC if not yet available)
+            # TODO: FIX UPPER
+            value = self.rule['plc'].read_var_value(self.rule['plc_var'].upper())
+            if self.rule['predicate'] == Predicates.EQUALS:
+                for var in self.rule['hmi'].vars:
+                    warn = False
+                    if var['name'] == self.rule['hmi_var']:
+                        if type(var['value']) is int:
+                            if var['value'] != int(value):
+                                warn = True
+                        elif type(var['value']) is bool:
+                            if var['value'] != (str(value) == 'True'):
+                                warn = True
+                        if warn:
+                            logger.warning("ALERT! '{}' tag [{}={}] does not equal '{}' tag [{}={}]."
+                                           .format(self.rule['hmi'].name, var['name'], var['value'],
+                                                   self.rule['plc'].name, self.rule['plc_var'], value))
         except EOFError:
             logger.exception("Received EOF.")
         except UnknownPlcTagException:
             logger.exception("Unknown PLC Tag.")
-
-        self.conn.close()
+        except NotSupportedPlcTagTypeException:
+            logger.exception("Type of PLC Tag not supported.")
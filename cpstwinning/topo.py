@@ -9,6 +9,8 @@ class CpsTwinningTopo(Topo_WiFi):
 
     def __init__(self, *args, **params):
         self.aml_topo = params.pop('aml_topo', None)
+        # Whether the PLCs are run by the supervisor host (cf. PlcSupervisorHost)
+        self.shared_supervisor = params.pop('shared_supervisor', False)
         super(CpsTwinningTopo, self).__init__(*args, **params)
 
     def build(self, **_opts):
@@ -38,7 +40,8 @@ class CpsTwinningTopo(Topo_WiFi):
                     ip=get_ip(network_config),
                     mac=network_config['mac'],
                     st_path=aml_plc['st_path'],
-                    mb_map=aml_plc['mb_map']
+                    mb_map=aml_plc['mb_map'],
+                    supervisor_host=self.shared_supervisor
                 )
 
             attacker = self.addHost(name='attacker', ip='192.168.0.100', mac='a2:67:f2:13:1c:06')
@@ -2,30 +2,82 @@
 
 from mininet.node import Host
 from mininet.wifi.node import Station
-from threading import Thread, Event, Lock
-from multiprocessing.connection import Client
+from threading import Thread, Event, Lock, Condition
 from cpstwinning.hmimessages import ReadMessage, ReadMessageResult, WriteMessage, SuccessHmiMessage
 from cpstwinning.plcmessages import StartMessage, StopMessage, ShowTagsMessage, ShowTagsResponseMessage, \
     TerminateMessage, GetTagMessage, GetTagResponseMessage, SetTagMessage, SetTagResponseMessage, MonitorMessage, \
-    MonitorResponseMessage, GetTagsMessage, GetTagsResponseMessage
+    MonitorResponseMessage, GetTagsMessage, GetTagsResponseMessage, SetTimeModeMessage, \
+    StepMessage, GetScanStatsMessage, ScanStatsResponseMessage, GetAllTagNamesMessage, StopMonitoringMessage, \
+    MonitorBatchResponseMessage, HostPlcMessage, SuccessPlcMessage
 from cpstwinning.utils import UnknownPlcTagException, NotSupportedPlcTagTypeException, NotSupportedPlcTagClassException
 from cpstwinning.mqttmessages import ConnectMessage, PublishMessage, CloseMessage
-from time import sleep
-from kafka import KafkaProducer
-from constants import KAFKA_BOOTSTRAP_SERVERS, KAFKA_V_LOGS_TOPIC
+from cpstwinning.processimage import ProcessImage, get_process_image_path, PLC_TIME_MODE_REALTIME, PLC_TIME_MODE_STEP
+from cpstwinning.plcbuild import BUILD_PROFILE_ENV
+from cpstwinning.ipc import ConnectionPool, PipelinedClient, Future, connect, connect_to_plc, get_plc_socket_path, \
+    get_socket_path, get_supervisor_host_socket_path, MB_SOCKET_NAME, MQTT_SOCKET_NAME, SUPERVISOR_HOST_ARG
+from subprocess import Popen
+from constants import KAFKA_V_LOGS_TOPIC
 
 import sys
 import os
+import socket
 import utils
 import pickle
 import logging
-import socket
-import errno
 import json
 import time
 
 logger = logging.getLogger(__name__)
 
+# Time in s to wait for the supervisor host to become ready
+SUPERVISOR_HOST_TIMEOUT = 10
+# Time in s to wait for the time of a PLC, which advances on its own but not in real time, before its rate is known
+PLC_TIME_SAMPLE_INTERVAL = 0.01
+# Maximum time in s to wait for the time of such a PLC, which bounds the error of the rate predicted
+MAX_PLC_TIME_WAIT = 1.0
+
+
+def get_tag_value(result):
+    if isinstance(result, GetTagResponseMessage):
+        return result.value
+    raise RuntimeError("Unexpected message type: {}.".format(type(result)))
+
+
+def check_set_tag_response(result):
+    if not isinstance(result, SetTagResponseMessage):
+        raise RuntimeError("Unexpected message type: {}.".format(type(result)))
+
+
+def get_resolved_future(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class PlcSupervisorHostProcess(object):
+    """Process of the supervisor host, which runs the supervisors of the PLCs created with supervisor_host=True.
+
+    It runs in the network namespace of the twinning process, each PLC's Modbus server listens in the one of its host.
+    """
+
+    def __init__(self):
+        plc_supervisor_path = os.path.join(utils.get_pkg_path(), 'plc_supervisor.py')
+        self.process = Popen([sys.executable, plc_supervisor_path, SUPERVISOR_HOST_ARG])
+
+    def terminate(self):
+        """Terminates the host (and its PLCs that are still running), must be called after terminating the PLCs."""
+        if self.process.poll() is None:
+            try:
+                conn = connect(get_supervisor_host_socket_path(), SUPERVISOR_HOST_TIMEOUT)
+                try:
+                    conn.send(TerminateMessage())
+                finally:
+                    conn.close()
+            except socket.error:
+                logger.exception("Could not terminate supervisor host.")
+                self.process.terminate()
+        self.process.wait()
+
 
 class Plc(Host):
     """A PLC host."""
@@ -35,10 +87,37 @@ class Plc(Host):
         # TODO: Error handling
         st_path = params.pop('st_path', None)
         mb_map = params.pop('mb_map', None)
+        # Build profile of the PLC lib, i.e., 'debug' (default) or 'release'
+        build_profile = params.pop('build_profile', None)
+        # Whether the PLC is run by the supervisor host (cf. PlcSupervisorHost) instead of a supervisor process of its
+        # own, which must have been started before
+        supervisor_host = params.pop('supervisor_host', False)
         mb_map_path = self.__persist_mb_map(mb_map) if mb_map is not None else ''
-        plc_supervisor_path = os.path.join(utils.get_pkg_path(), 'plc_supervisor.py')
-        cmd = '{} {} {} {} {} &'.format(sys.executable, plc_supervisor_path, self.name, st_path, mb_map_path)
-        self.cmd(cmd)
+        if supervisor_host:
+            self.__host(HostPlcMessage(self.name, st_path, mb_map_path, utils.get_netns_path(self.pid),
+                                       build_profile or ''))
+        else:
+            plc_supervisor_path = os.path.join(utils.get_pkg_path(), 'plc_supervisor.py')
+            cmd = '{} {} {} {} {} &'.format(sys.executable, plc_supervisor_path, self.name, st_path, mb_map_path)
+            if build_profile is not None:
+                cmd = '{}={} {}'.format(BUILD_PROFILE_ENV, build_profile, cmd)
+            self.cmd(cmd)
+        self.process_image = None
+        # Long-lived connections to the PLC supervisor
+        self.pool = ConnectionPool(get_plc_socket_path(self.name))
+        # Connection for requests, which are in flight concurrently (cf. *_async)
+        self.client = PipelinedClient(get_plc_socket_path(self.name))
+        # Single change stream of the PLC for all local subscribers, started on first subscription
+        self.hub = None
+        self.hub_lock = Lock()
+        # Called with the PLC, once its time has been advanced by a step or the time mode has changed
+        self.time_clbks = set()
+        self.time_clbks_lock = Lock()
+        # (time.time(), PLC time in ns) as read by get_wait_time last
+        self.time_sample = None
+        # Notified, once the PLC's time has been advanced by a step or the time mode has changed, or on terminate
+        self.time_cond = Condition()
+        self.terminated = False
 
     def __persist_mb_map(self, mb_map):
         dir_path = utils.get_dstdir_path_from_mkfile(self.name)
@@ -49,20 +128,35 @@ class Plc(Host):
             pickle.dump(mb_map, handle)
         return path
 
-    def __create_connection(self):
-        tmp_base = utils.get_tmp_base_path_from_mkfile()
-        plc_base_path = os.path.join(tmp_base, self.name)
-        address = os.path.join(plc_base_path, 'plc_socket')
-        self.conn = Client(address)
-
-    def __send(self, msg):
-        self.__create_connection()
-        self.conn.send(msg)
+    def __host(self, msg):
+        conn = connect(get_supervisor_host_socket_path(), SUPERVISOR_HOST_TIMEOUT)
+        try:
+            conn.send(msg)
+            result = conn.recv()
+        finally:
+            conn.close()
+        if not isinstance(result, SuccessPlcMessage):
+            logger.error("Supervisor host could not host PLC '%s'.", self.name)
 
     def __send_message(self, msg):
-        self.__send(msg)
-        result = self.conn.recv()
-        self.__close()
+        return self.__check_result(self.pool.request(msg))
+
+    def __send_message_async(self, msg):
+        return self.client.request_async(msg).then(self.__check_result)
+
+    def __time_advanced(self, result):
+        """Calls the time callbacks, returns result."""
+        # The rate of the PLC's time changes with the time mode
+        self.time_sample = None
+        with self.time_cond:
+            self.time_cond.notify_all()
+        with self.time_clbks_lock:
+            clbks = list(self.time_clbks)
+        for clbk in clbks:
+            clbk(self)
+        return result
+
+    def __check_result(self, result):
         if isinstance(result, UnknownPlcTagException):
             raise UnknownPlcTagException(result)
         elif isinstance(result, NotSupportedPlcTagTypeException):
@@ -72,13 +166,35 @@ class Plc(Host):
         else:
             return result
 
-    def __close(self):
-        self.conn.close()
+    def __get_process_image(self):
+        """Returns the process image published by the PLC supervisor or None, if not (yet) available."""
+        process_image = self.process_image
+        if process_image is None or process_image.is_stale():
+            # A stale image is not closed, as other threads may still read it (it is unmapped once unreferenced)
+            path = get_process_image_path(utils.get_dstdir_path_from_mkfile(self.name))
+            try:
+                process_image = ProcessImage(path)
+            except (EnvironmentError, ValueError):
+                process_image = None
+            self.process_image = process_image
+        return process_image
 
     def terminate(self):
+        with self.time_cond:
+            self.terminated = True
+            self.time_cond.notify_all()
+        with self.hub_lock:
+            if self.hub is not None:
+                # Stops monitoring, before the supervisor goes away
+                self.hub.stop()
+                self.hub = None
         logger.debug("Sending Terminate Message to PLC.")
-        self.__send(TerminateMessage())
-        self.__close()
+        self.pool.send(TerminateMessage())
+        self.pool.close()
+        self.client.close()
+        if self.process_image is not None:
+            self.process_image.close()
+            self.process_image = None
         super(Plc, self).terminate()
 
     def start(self):
@@ -87,13 +203,165 @@ class Plc(Host):
     def stop(self):
         return self.__send_message(StopMessage())
 
+    def set_time_mode(self, mode, factor=1.0):
+        return self.__time_advanced(self.__send_message(SetTimeModeMessage(mode, factor)))
+
+    def step(self, n=1):
+        """Pauses the PLC and executes exactly n scan cycles, returns a StepResponseMessage or an error text."""
+        return self.__time_advanced(self.__send_message(StepMessage(n)))
+
+    def step_async(self, n=1):
+        """Returns a future of step(n), which the PLC executes after the requests made asynchronously before."""
+        return self.client.request_async(StepMessage(n)).then(
+            lambda result: self.__time_advanced(self.__check_result(result)))
+
+    def add_time_clbk(self, clbk):
+        """Calls clbk(plc), once the PLC's time has been advanced by a step or the time mode has changed."""
+        with self.time_clbks_lock:
+            self.time_clbks.add(clbk)
+
+    def remove_time_clbk(self, clbk):
+        with self.time_clbks_lock:
+            self.time_clbks.discard(clbk)
+
+    def get_tick_time(self):
+        """Returns the interval of the PLC's scan cycles in ns."""
+        result = self.__send_message(GetScanStatsMessage(False))
+        if isinstance(result, ScanStatsResponseMessage):
+            return result.stats['tick_time']
+        raise RuntimeError("Unexpected message type: {}.".format(type(result)))
+
+    def show_scan_stats(self, reset=False):
+        result = self.__send_message(GetScanStatsMessage(reset))
+        if isinstance(result, ScanStatsResponseMessage):
+            stats = result.stats
+
+            def avg_us(total, count):
+                return total / 1000.0 / count if count else 0.0
+
+            out = 'Time mode: {}, tick time [ms]: {:g}\n'.format(stats['time_mode'], stats['tick_time'] / 1e6)
+            out = out + 'Cycles: {} (timer-triggered: {})\n'.format(stats['cycles'], stats['timed_cycles'])
+            out = out + 'Overruns: {}, missed ticks: {}\n'.format(stats['overruns'], stats['missed_ticks'])
+            out = out + 'Execution [us]: avg {:.1f}, max {:.1f}\n'.format(
+                avg_us(stats['exec_sum'], stats['cycles']), stats['exec_max'] / 1000.0)
+            out = out + 'Lateness [us]: avg {:.1f}, max {:.1f}\n'.format(
+                avg_us(stats['lateness_sum'], stats['timed_cycles']), stats['lateness_max'] / 1000.0)
+            titles = ["Bucket [us]", "Execution", "Lateness"]
+            data = [titles]
+            for i, (exec_count, lateness_count) in enumerate(zip(stats['exec_hist'], stats['lateness_hist'])):
+                if exec_count or lateness_count:
+                    bucket = '{:g} - {:g}'.format((1 << i) / 1000.0, (1 << (i + 1)) / 1000.0)
+                    data.append([bucket, exec_count, lateness_count])
+            table = ""
+            for i, d in enumerate(data):
+                table = table + '|'.join(str(x).ljust(30) for x in d) + '\n'
+                if i == 0:
+                    table = table + '-' * len(table) + '\n'
+            return out + table
+        else:
+            logger.error("Unexpected message type: %s.", type(result))
+
+    def subscribe(self, tag_names, clbk):
+        """Subscribes clbk(plc, name, value, timestamp) to changes of the given tags (all tags, if None)."""
+        with self.hub_lock:
+            if self.hub is None:
+                self.hub = PlcSubscriptionHub(self)
+                self.hub.start()
+        self.hub.subscribe(tag_names, clbk)
+
+    def unsubscribe(self, clbk):
+        with self.hub_lock:
+            if self.hub is not None:
+                self.hub.unsubscribe(clbk)
+
+    def get_current_time(self):
+        """Returns the (virtual) time of the PLC in ns, i.e., __CURRENT_TIME of the last scan cycle."""
+        process_image = self.__get_process_image()
+        if process_image is not None:
+            return process_image.get_current_time()
+        return int(time.time() * 1e9)
+
+    def is_realtime(self):
+        """Returns whether the PLC's (virtual) time elapses in real time."""
+        process_image = self.__get_process_image()
+        return process_image is None or process_image.get_time_mode() == PLC_TIME_MODE_REALTIME
+
+    def get_wait_time(self, plc_time):
+        """Returns the time in s until the PLC's time may have reached plc_time in ns (0, if it has), or None if the
+        PLC is stepped, so that its time only advances on a step (cf. add_time_clbk)."""
+        process_image = self.__get_process_image()
+        if process_image is None:
+            return max(plc_time - int(time.time() * 1e9), 0) / 1e9
+        current_time = process_image.get_current_time()
+        time_mode = process_image.get_time_mode()
+        if current_time >= plc_time:
+            return 0
+        if time_mode == PLC_TIME_MODE_STEP:
+            return None
+        if time_mode == PLC_TIME_MODE_REALTIME:
+            return (plc_time - current_time) / 1e9
+        # The rate of a dilated (or as fast as possible) time is predicted from its advance since the last sample
+        now = time.time()
+        sample = self.time_sample
+        if sample is not None and current_time == sample[1]:
+            # Back off, while the time does not advance (e.g., as the PLC has been stopped)
+            return min(max(now - sample[0], PLC_TIME_SAMPLE_INTERVAL), MAX_PLC_TIME_WAIT)
+        self.time_sample = (now, current_time)
+        if sample is None or now <= sample[0] or current_time < sample[1]:
+            return PLC_TIME_SAMPLE_INTERVAL
+        rate = (current_time - sample[1]) / (now - sample[0])
+        return min((plc_time - current_time) / rate, MAX_PLC_TIME_WAIT)
+
+    def sleep(self, seconds):
+        """Sleeps for seconds of the PLC's (virtual) time, so that device models keep pace with the PLC. Returns
+        False, if the sleep has been cut short by terminating the PLC."""
+        deadline = time.time() + seconds
+        plc_deadline = self.get_current_time() + int(seconds * 1e9)
+        with self.time_cond:
+            while not self.terminated:
+                if self.is_realtime():
+                    wait_time = max(deadline - time.time(), 0)
+                else:
+                    # None while the PLC is stepped, i.e., until the next step advances its time
+                    wait_time = self.get_wait_time(plc_deadline)
+                if wait_time == 0:
+                    return True
+                self.time_cond.wait(wait_time)
+        return False
+
+    def read_var_value(self, name):
+        """Returns the value of a tag, preferably read from the process image without IPC."""
+        process_image = self.__get_process_image()
+        if process_image is not None:
+            return process_image.get_value(name)
+        return get_tag_value(self.__send_message(GetTagMessage(name)))
+
+    def read_var_value_async(self, name):
+        """Returns a future of the value of a tag, so that several tags can be read without waiting for each."""
+        process_image = self.__get_process_image()
+        if process_image is None:
+            return self.__send_message_async(GetTagMessage(name)).then(get_tag_value)
+        future = Future()
+        try:
+            future.set_result(process_image.get_value(name))
+        except (UnknownPlcTagException, NotSupportedPlcTagTypeException) as e:
+            future.set_exception(e)
+        return future
+
+    def read_var_values(self, names):
+        """Returns {name: value} of the given tags, which are read concurrently."""
+        futures = [(name, self.read_var_value_async(name)) for name in names]
+        return dict((name, future.result()) for name, future in futures)
+
+    def write_var_value_async(self, name, value):
+        """Returns a future, which is resolved once the PLC has set the tag."""
+        return self.__send_message_async(SetTagMessage(name, value)).then(check_set_tag_response)
+
     def get_var_value(self, name):
         try:
-            result = self.__send_message(GetTagMessage(name))
-            if isinstance(result, GetTagResponseMessage):
-                return str(result.value) + "\n"
-            else:
-                logger.error("Unexpected message type: %s.", type(result))
+            return str(self.read_var_value(name)) + "\n"
+        except RuntimeError:
+            logger.exception("Could not get value of tag '%s'.", name)
         except UnknownPlcTagException:
             return "ERROR: Variable name '{}' does not exist in PLC.\n".format(name)
         except NotSupportedPlcTagTypeException:
@@ -135,6 +403,9 @@ class Plc(Host):
             logger.error("Unexpected message type: %s.", type(result))
 
     def get_vars(self):
+        process_image = self.__get_process_image()
+        if process_image is not None:
+            return process_image.snapshot()
         result = self.__send_message(GetTagsMessage())
         if isinstance(result, GetTagsResponseMessage):
             return result.tags
@@ -149,6 +420,10 @@ class Hmi(Host):
         super(Hmi, self).config(**params)
         hmi_mb_client_path = os.path.join(utils.get_pkg_path(), 'hmi_mb_client.py')
         self.cmd('{} {} {} &'.format(sys.executable, hmi_mb_client_path, self.name))
+        # Long-lived connections to the HMI's Modbus client
+        self.pool = ConnectionPool(get_socket_path(self.name, MB_SOCKET_NAME))
+        # Connection for requests, which are in flight concurrently (cf. *_async)
+        self.client = PipelinedClient(get_socket_path(self.name, MB_SOCKET_NAME))
         # TODO: Replace with parser vars
         self.vars = [
             {'name': 'StartConveyorBelt', 'mb_table': 'hr', 'mb_addr': 1, 'value': False},
@@ -168,74 +443,85 @@ class Hmi(Host):
     def remove_var_monitor_clbk(self, clbk):
         self.__var_monitor_clbks.remove(clbk)
 
-    def __create_connection(self):
-        tmp_base = utils.get_tmp_base_path_from_mkfile()
-        hmi_base_path = os.path.join(tmp_base, self.name)
-        address = os.path.join(hmi_base_path, 'mb_socket')
-        self.conn = Client(address)
-
-    def __send(self, msg):
-        self.__create_connection()
-        self.conn.send(msg)
-
-    def __close(self):
-        self.conn.close()
-
-    def get_var_value(self, name):
+    def __get_var(self, name):
         for var in self.vars:
             if var['name'] == name:
-                self.__send(ReadMessage('192.168.0.1', var['mb_table'], var['mb_addr']))
-                result = self.conn.recv()
-                self.__close()
-                val_set = False
-                if isinstance(result, ReadMessageResult):
-                    if type(var['value']) is int:
-                        var['value'] = int(result.value)
-                    elif type(var['value']) is bool:
-                        # Value received via Modbus may be 0/1
-                        var['value'] = result.value == 'True' or result.value == '1' or result.value == 1
-                    else:
-                        raise RuntimeError('Unsupported type \'{}\'.'.format(type(var)))
-                    val_set = True
-                if not val_set:
-                    logger.error('Modbus request timed out.')
-                else:
-                    if self.var_link_clbk is not None:
-                        self.var_link_clbk(var)
-                    for clbk in self.__var_monitor_clbks:
-                        clbk(self, name, var['value'])
-                return str(var['value']) + '\n'
-        return "ERROR: Variable name '{}' does not exist in HMI.\n".format(name)
+                return var
+        return None
+
+    def get_var_value(self, name):
+        var = self.__get_var(name)
+        if var is None:
+            return "ERROR: Variable name '{}' does not exist in HMI.\n".format(name)
+        return self.__on_read(var, self.pool.request(ReadMessage('192.168.0.1', var['mb_table'], var['mb_addr'])))
+
+    def get_var_value_async(self, name):
+        """Returns a future of get_var_value(name), callbacks are invoked by the thread that calls its result()."""
+        var = self.__get_var(name)
+        if var is None:
+            return get_resolved_future("ERROR: Variable name '{}' does not exist in HMI.\n".format(name))
+        future = self.client.request_async(ReadMessage('192.168.0.1', var['mb_table'], var['mb_addr']))
+        return future.then(lambda result: self.__on_read(var, result))
+
+    def __on_read(self, var, result):
+        val_set = False
+        if isinstance(result, ReadMessageResult):
+            if type(var['value']) is int:
+                var['value'] = int(result.value)
+            elif type(var['value']) is bool:
+                # Value received via Modbus may be 0/1
+                var['value'] = result.value == 'True' or result.value == '1' or result.value == 1
+            else:
+                raise RuntimeError('Unsupported type \'{}\'.'.format(type(var)))
+            val_set = True
+        if not val_set:
+            logger.error('Modbus request timed out.')
+        else:
+            self.__notify(var)
+        return str(var['value']) + '\n'
 
     def set_var_value(self, name, value):
-        for var in self.vars:
-            if var['name'] == name:
-                old_value = var['value']
-                # Optimistically set new value in HMI vars
-                if type(var['value']) is int:
-                    var['value'] = int(value)
-                elif type(var['value']) is bool:
-                    var['value'] = value == 'True'
-                    # Convert boolean
-                    value = 1 if var['value'] else 0
-                else:
-                    raise RuntimeError('Unsupported type \'{}\'.'.format(type(var)))
-                logger.info("'{}' value changed {} -> {} in device '{}'.".format(name, old_value, value, self.name))
-
-                self.__send(WriteMessage('192.168.0.1', var['mb_table'], var['mb_addr'], 1, [int(value)]))
-                result = self.conn.recv()
-                self.__close()
-                if not isinstance(result, SuccessHmiMessage):
-                    # Error - rollback
-                    var['value'] = old_value
-                    return 'ERROR: Failed to set value.'
-
-                if self.var_link_clbk is not None:
-                    self.var_link_clbk(var)
-                for clbk in self.__var_monitor_clbks:
-                    clbk(self, name, var['value'])
-                return "\n"
-        return "ERROR: Variable name '{}' does not exist in HMI.\n".format(name)
+        var = self.__get_var(name)
+        if var is None:
+            return "ERROR: Variable name '{}' does not exist in HMI.\n".format(name)
+        old_value, msg = self.__set_var(var, value)
+        return self.__on_write(var, old_value, self.pool.request(msg))
+
+    def set_var_value_async(self, name, value):
+        """Returns a future of set_var_value(name, value), the new value is set optimistically right away."""
+        var = self.__get_var(name)
+        if var is None:
+            return get_resolved_future("ERROR: Variable name '{}' does not exist in HMI.\n".format(name))
+        old_value, msg = self.__set_var(var, value)
+        return self.client.request_async(msg).then(lambda result: self.__on_write(var, old_value, result))
+
+    def __set_var(self, var, value):
+        """Optimistically sets the new value in HMI vars and returns the old value and the Modbus write message."""
+        old_value = var['value']
+        if type(var['value']) is int:
+            var['value'] = int(value)
+        elif type(var['value']) is bool:
+            var['value'] = value == 'True'
+            # Convert boolean
+            value = 1 if var['value'] else 0
+        else:
+            raise RuntimeError('Unsupported type \'{}\'.'.format(type(var)))
+        logger.info("'{}' value changed {} -> {} in device '{}'.".format(var['name'], old_value, value, self.name))
+        return old_value, WriteMessage('192.168.0.1', var['mb_table'], var['mb_addr'], 1, [int(value)])
+
+    def __on_write(self, var, old_value, result):
+        if not isinstance(result, SuccessHmiMessage):
+            # Error - rollback
+            var['value'] = old_value
+            return 'ERROR: Failed to set value.'
+        self.__notify(var)
+        return "\n"
+
+    def __notify(self, var):
+        if self.var_link_clbk is not None:
+            self.var_link_clbk(var)
+        for clbk in self.__var_monitor_clbks:
+            clbk(self, var['name'], var['value'])
 
     def show_tags(self):
         titles = ["Name"]
@@ -258,14 +544,23 @@ class Hmi(Host):
 class Motor(object):
     """A motor."""
 
-    def __init__(self, name, vars, plc, plc_vars_map):
+    def __init__(self, name, vars, plc, plc_vars_map, runtime, physics=None):
         self.name = name
         self.plc = plc
         self.vars = vars
         self.plc_vars_map = plc_vars_map  # Name of PLC var to map : Internal motor var
-        self.shutdown_event = Event()
-        self.motor_thread = PlcMonitorThread(self, plc)
-        self.motor_thread.start()
+        # Simulates the dynamics of the motor, otherwise its vars merely mirror the PLC tags
+        self.physics = physics
+        if physics is not None:
+            self.physics_idx = physics.add_motor(self)
+            # The state vars are written by the simulation
+            self.plc_monitor = PlcVarsMonitor(self, plc, runtime, self.plc_var_clbk, physics.get_command_tags(self))
+        else:
+            self.plc_monitor = PlcVarsMonitor(self, plc, runtime)
+        self.plc_monitor.start()
+
+    def plc_var_clbk(self, idx):
+        self.physics.set_command(self.physics_idx, self.vars[idx]['name'], self.vars[idx]['value'])
 
     def get_status(self):
         titles = ["Name", "Value"]
@@ -286,74 +581,149 @@ class Motor(object):
         return self.vars
 
     def terminate(self):
-        self.shutdown_event.set()
+        self.plc_monitor.stop()
 
     def __str__(self):
         return self.name
 
 
-class PlcMonitorThread(Thread):
+class PlcSubscriptionHub(Thread):
+    """Receives the tag changes of a PLC via a single monitor connection and passes them on to local subscribers.
+
+    Subscribers are invoked by the hub's thread, so they must not block.
+    """
 
-    def __init__(self, dev, plc):
+    def __init__(self, plc):
         Thread.__init__(self)
-        self.dev = dev
+        self.daemon = True
         self.plc = plc
-        self.running = False
-        self.listener_ready = False
-
-    def __create_connection(self):
-        tmp_base = utils.get_tmp_base_path_from_mkfile()
-        plc_base_path = os.path.join(tmp_base, self.plc.name)
-        address = os.path.join(plc_base_path, 'plc_socket')
-        # Wait until listener is ready
-        # TODO: Refactoring needed (anti-pattern)
-        while not self.listener_ready:
-            try:
-                self.conn = Client(address)
-                self.listener_ready = True
-            except socket.error as e:
-                # Check if listener is not yet ready
-                if e.errno == errno.ENOENT:  # socket.error: [Errno 2] No such file or directory
-                    sleep(1)
-                else:
-                    logger.exception("Unknown socket error occurred.")
+        # { tag name: [clbk, ...] }, subscribers of all tags are stored with tag name None
+        self.subscribers = {}
+        # Names of all tags of the PLC and of those monitored via the connection
+        self.tag_names = []
+        self.monitored = set()
+        self.conn = None
+        # Guards subscribers and the connection
+        self.lock = Lock()
+
+    def subscribe(self, tag_names, clbk):
+        with self.lock:
+            for name in [None] if tag_names is None else set(n.upper() for n in tag_names):
+                self.subscribers.setdefault(name, []).append(clbk)
+            self.__monitor()
+
+    def unsubscribe(self, clbk):
+        # Tags remain monitored, as the supervisor monitors a connection's tags until it stops monitoring altogether
+        with self.lock:
+            for name, clbks in self.subscribers.items():
+                if clbk in clbks:
+                    clbks.remove(clbk)
+                    if not clbks:
+                        del self.subscribers[name]
 
     def __monitor(self):
-        self.__create_connection()
-        self.conn.send(MonitorMessage(self.dev.plc_vars_map.keys()))
-
-    def __close(self):
-        self.conn.close()
+        # Must hold lock, monitors the subscribed tags, which are not monitored yet
+        if self.conn is None:
+            return
+        tag_names = self.tag_names if None in self.subscribers else self.subscribers.keys()
+        new_tag_names = [n for n in tag_names if n not in self.monitored]
+        if new_tag_names:
+            # One message per scan cycle with the last value of each changed tag
+            self.conn.send(MonitorMessage(new_tag_names, batch=True))
+            self.monitored.update(new_tag_names)
+
+    def __dispatch(self, name, value, timestamp):
+        with self.lock:
+            clbks = self.subscribers.get(name, []) + self.subscribers.get(None, [])
+        for clbk in clbks:
+            try:
+                clbk(self.plc, name, value, timestamp)
+            except Exception:
+                logger.exception("Subscriber of PLC '%s' failed to handle change of '%s'.", self.plc.name, name)
 
     def run(self):
-        self.__monitor()
-        while not self.dev.shutdown_event.is_set():
+        # Blocks until listener is ready
+        conn = connect_to_plc(self.plc.name)
+        tag_names = self.plc.pool.request(GetAllTagNamesMessage()).tag_names
+        with self.lock:
+            self.conn = conn
+            self.tag_names = [n.upper() for n in tag_names]
+            self.__monitor()
+        while True:
             try:
-                if self.conn.poll():
-                    result = self.conn.recv()
-                    if isinstance(result, UnknownPlcTagException):
-                        raise UnknownPlcTagException(result)
-                    elif isinstance(result, TerminateMessage):
-                        logger.info("Terminating monitoring of '{}'.".format(self.dev.name))
-                        break
-                    elif isinstance(result, MonitorResponseMessage):
-                        dev_var_idx = self.dev.plc_vars_map[result.name]
-                        var = self.dev.vars[dev_var_idx]['value']
-                        if type(var) is int:
-                            self.dev.vars[dev_var_idx]['value'] = int(result.value)
-                        elif type(var) is bool:
-                            self.dev.vars[dev_var_idx]['value'] = result.value
-                        else:
-                            raise RuntimeError('Unsupported type \'{}\'.'.format(type(var)))
-                    else:
-                        logger.error("Received unexpected message type '%s'.", type(result))
-            except EOFError:
-                logger.exception("Received EOF.")
+                result = conn.recv()
+                if isinstance(result, UnknownPlcTagException):
+                    raise UnknownPlcTagException(result)
+                elif isinstance(result, TerminateMessage):
+                    logger.info("Terminating monitoring of PLC '{}'.".format(self.plc.name))
+                    break
+                elif isinstance(result, MonitorBatchResponseMessage):
+                    for name, value in zip(result.names, result.values):
+                        self.__dispatch(name, value, result.timestamp)
+                elif isinstance(result, MonitorResponseMessage):
+                    self.__dispatch(result.name, result.value, result.timestamp)
+                else:
+                    logger.error("Received unexpected message type '%s'.", type(result))
+            except (EOFError, IOError):
+                logger.info("Monitor connection of PLC '%s' closed.", self.plc.name)
                 break
             except UnknownPlcTagException:
                 logger.exception("Unknown PLC Tag.")
+        with self.lock:
+            self.conn = None
+        conn.close()
+
+    def stop(self):
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    self.conn.send(StopMonitoringMessage())
+                    # Wakes up the hub's thread
+                    self.conn.shutdown()
+                except (EOFError, IOError):
+                    pass
+
+
+class PlcVarsMonitor(object):
+    """Keeps the vars of a device up to date with the PLC tags they are mapped to (cf. plc_vars_map).
+
+    Updates are made by the device runtime's thread. If given, clbk is called with the index of the device var after
+    each update. If given, only the tags in tag_names are monitored. During a co-simulation, changes are passed on by
+    the co-simulation master instead of the PLC's subscription hub (cf. DeviceRuntime.dispatch).
+    """
+
+    def __init__(self, dev, plc, runtime, clbk=None, tag_names=None):
+        self.dev = dev
+        self.plc = plc
+        self.runtime = runtime
+        self.clbk = clbk
+        self.tag_names = tag_names if tag_names is not None else dev.plc_vars_map.keys()
+
+    def start(self):
+        self.runtime.add_monitor(self)
+        self.plc.subscribe(self.tag_names, self.on_change)
 
-        self.__close()
+    def stop(self):
+        self.plc.unsubscribe(self.on_change)
+        self.runtime.remove_monitor(self)
+
+    def on_change(self, plc, name, value, timestamp):
+        # Invoked by the PLC's subscription hub, which must not wait for the device
+        if not self.runtime.lockstep:
+            self.runtime.call_soon(self.update, name, value)
+
+    def update(self, name, value):
+        """Updates the device var mapped to the tag, must be called by the device runtime's thread."""
+        dev_var_idx = self.dev.plc_vars_map[name]
+        var = self.dev.vars[dev_var_idx]['value']
+        if type(var) is int:
+            self.dev.vars[dev_var_idx]['value'] = int(value)
+        elif type(var) is bool:
+            self.dev.vars[dev_var_idx]['value'] = value
+        else:
+            raise RuntimeError('Unsupported type \'{}\'.'.format(type(var)))
+        if self.clbk is not None:
+            self.clbk(dev_var_idx)
 
 
 class RfidReaderMqttWiFi(Station):
@@ -370,6 +740,8 @@ class RfidReaderMqttWiFi(Station):
             logger.error("No MQTT topic has been provided for station [name=%s].", self.name)
         mqtt_client_path = os.path.join(utils.get_pkg_path(), 'mqtt_client.py')
         self.cmd('{} {} {} &'.format(sys.executable, mqtt_client_path, self.name))
+        # Long-lived connections to the MQTT client
+        self.pool = ConnectionPool(get_socket_path(self.name, MQTT_SOCKET_NAME))
         self.is_connected = False
         self.read_clbks = []
 
@@ -385,36 +757,21 @@ class RfidReaderMqttWiFi(Station):
         if not self.is_connected:
             self.__connect_to_mqtt_broker()
             self.is_connected = True
-        self.__send(PublishMessage(self.mqtt_topic, value))
-        self.__close()
+        self.pool.send(PublishMessage(self.mqtt_topic, value))
         for clbk in self.read_clbks:
             clbk(value)
         return "\n"
 
     def terminate(self):
         logger.debug("Sending close message to MQTT client [name=%s].", self.name)
-        self.__send(CloseMessage())
+        self.pool.send(CloseMessage())
         self.is_connected = False
-        self.__close()
+        self.pool.close()
         super(RfidReaderMqttWiFi, self).terminate()
 
-    def __create_connection(self):
-        tmp_base = utils.get_tmp_base_path_from_mkfile()
-        rfidr_base_path = os.path.join(tmp_base, self.name)
-        address = os.path.join(rfidr_base_path, 'mqtt_socket')
-        self.conn = Client(address)
-
     def __connect_to_mqtt_broker(self):
         conn_msg = ConnectMessage(self.mqtt_host, auth=self.auth)
-        self.__send(conn_msg)
-        self.__close()
-
-    def __send(self, msg):
-        self.__create_connection()
-        self.conn.send(msg)
-
-    def __close(self):
-        self.conn.close()
+        self.pool.send(conn_msg)
 
 
 class MqttBroker(Host):
@@ -451,81 +808,69 @@ class GenericServer(Host):
 class CandySensor(object):
     """A candy sensor."""
 
-    def __init__(self, name, plc, plc_vars_map, rfidr):
+    def __init__(self, name, plc, plc_vars_map, rfidr, runtime):
         self.name = name
         self.plc = plc
         self.plc_vars_map = plc_vars_map  # Name of PLC var to map : Internal candy sensor var
         self.rfidr = rfidr
+        self.runtime = runtime
         self.vars = [{'name': 'Candy', 'value': None}, {'name': 'ExtractorRunning', 'value': False}]
         self.shutdown_event = Event()
         self.vars_mutex = Lock()
-        self.plc_monitor_thread = PlcMonitorThread(self, plc)
-        self.plc_monitor_thread.start()
-        self.candy_sensor_vars_thread = self.CandySensorVarsThread(self)
-        self.candy_sensor_vars_thread.start()
+        # Remember when extractor started
+        self.extractor_active = False
+        self.plc_monitor = PlcVarsMonitor(self, plc, runtime, self.plc_var_clbk)
+        self.plc_monitor.start()
         # Add callback method in RFID reader twin
         self.rfidr.add_read_clbk(self.rfidr_clbk)
 
+    def __get_var(self, name):
+        var_filter = filter(lambda n: n.get('name') == name, self.vars)
+        if len(var_filter):
+            return var_filter[0]
+        logger.error('Could not find variable [name=%s] in candy sensor [name=%s].', name, self.name)
+        return None
+
     def rfidr_clbk(self, value):
         with self.vars_mutex:
-            candy_filter = filter(lambda n: n.get('name') == 'Candy', self.vars)
-            if len(candy_filter):
-                candy_idx = self.vars.index(candy_filter[0])
-                self.vars[candy_idx]['value'] = value
+            candy = self.__get_var('Candy')
+            if candy is not None:
+                candy['value'] = value
+
+    def plc_var_clbk(self, idx):
+        if self.vars[idx]['name'] != 'ExtractorRunning':
+            return
+        if self.vars[idx]['value']:
+            self.extractor_active = True
+        elif self.extractor_active:
+            # Extractor is done, reset:
+            self.extractor_active = False
+            with self.vars_mutex:
+                candy = self.__get_var('Candy')
+                candy = candy['value'] if candy is not None else None
+            if candy is not None:
+                # TODO: Adapt delay to real sensor latency
+                self.runtime.call_later(2, self.__detect_candy, (candy,), self.plc)
             else:
-                logger.error('Could not find variable [name=Candy] in candy sensor [name=%s].', self.name)
+                logger.warn('Extractor is done, but no candy has been detected by RFID reader beforehand!')
+
+    def __detect_candy(self, candy):
+        if self.shutdown_event.is_set():
+            return
+        logger.info('Candy sensor [name=%s] detected candy [value=%s].', self.name, candy)
+        self.__publish_candy_detected(candy)
+
+    def __publish_candy_detected(self, candy):
+        # Timestamp in ms of the PLC's (virtual) time
+        timestamp = self.plc.get_current_time() // 1000000
+        log = {'timestamp': str(timestamp), 'name': self.name, 'candy': candy}
+        json_log = json.dumps(log, ensure_ascii=False)
+        self.runtime.kafka_producer.send(KAFKA_V_LOGS_TOPIC, key=log['name'], value=json_log)
 
     def __str__(self):
         return self.name
 
     def terminate(self):
         self.rfidr.remove_read_clbk(self.rfidr_clbk)
+        self.plc_monitor.stop()
         self.shutdown_event.set()
-
-    class CandySensorVarsThread(Thread):
-
-        def __init__(self, candy_sensor):
-            Thread.__init__(self)
-            self.candy_sensor = candy_sensor
-            self.kafka_producer = KafkaProducer(bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS)
-
-        def run(self):
-            # Remember when extractor started
-            extractor_active = False
-            while not self.candy_sensor.shutdown_event.is_set():
-                with self.candy_sensor.vars_mutex:
-                    extractor_running_filter = filter(lambda n: n.get('name') == 'ExtractorRunning',
-                                                      self.candy_sensor.vars)
-                    candy_filter = filter(lambda n: n.get('name') == 'Candy', self.candy_sensor.vars)
-                    if len(extractor_running_filter) and len(candy_filter):
-                        extractor_start_idx = self.candy_sensor.vars.index(extractor_running_filter[0])
-                        extractor_start = self.candy_sensor.vars[extractor_start_idx]['value']
-                        candy_idx = self.candy_sensor.vars.index(candy_filter[0])
-                        candy = self.candy_sensor.vars[candy_idx]['value']
-                        if extractor_start:
-                            extractor_active = True
-                        else:
-                            if extractor_active:
-                                # Extractor is done
-                                if candy is not None:
-                                    # TODO: Adapt sleep to real sensor latency
-                                    sleep(2)
-                                    logger.info('Candy sensor [name=%s] detected candy [value=%s].',
-                                                self.candy_sensor.name, candy)
-                                    self._publish_candy_detected(candy)
-                                else:
-                                    logger.warn(
-                                        'Extractor is done, but no candy has been detected by RFID reader beforehand!')
-                            # Extractor is done, reset:
-                            extractor_active = False
-                    else:
-                        logger.error(
-                            'Could not find variables [name=ExtractorRunning,name=Candy] in candy sensor [name=%s].',
-                            self.candy_sensor.name)
-            self.kafka_producer.close()
-
-        def _publish_candy_detected(self, candy):
-            timestamp = int(round(time.time() * 1000))
-            log = {'timestamp': str(timestamp), 'name': self.candy_sensor.name, 'candy': candy}
-            json_log = json.dumps(log, ensure_ascii=False)
-            self.kafka_producer.send(KAFKA_V_LOGS_TOPIC, key=log['name'], value=json_log)
@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 
+from contextlib import contextmanager
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+
 import re
 import os
 import pkgutil
@@ -13,11 +17,22 @@ located_vars_pattern_obj = re.compile(r'__LOCATED_VAR\(([a-zA-Z]+),([_a-zA-Z0-9]
 # Regex pattern of program placeholder
 prog_placeholder_pattern_obj = re.compile(r'\/\/\sPROGRAM', re.M)
 # Regex pattern of vars placeholder
-vars_placeholder_pattern_obj = re.compile(r'\/\/\sPLC_VARS', re.M)
+vars_placeholder_pattern_obj = re.compile(r'\/\/\sPLC_VARS$', re.M)
+# Regex pattern of vars lookup table placeholder
+vars_lookup_placeholder_pattern_obj = re.compile(r'\/\/\sPLC_VARS_LOOKUP$', re.M)
+# Regex pattern of vars info placeholder
+vars_info_placeholder_pattern_obj = re.compile(r'\/\/\sPLC_VARS_INFO$', re.M)
+# Regex pattern of vars names placeholder
+vars_names_placeholder_pattern_obj = re.compile(r'\/\/\sPLC_VARS_NAMES$', re.M)
 # Regex pattern of TMPBASE key
 tmp_base_mkfile_pattern_obj = re.compile(r'TMPBASE=(.*)')
 # Regex pattern of DSTDIR key
 dst_dir_mkfile_pattern_obj = re.compile(r'DSTDIR=(.*)')
+# Namespace type of setns(2)
+CLONE_NEWNET = 0x40000000
+# Network namespace of the calling thread (cf. proc(5))
+THREAD_NETNS_PATH = '/proc/thread-self/ns/net'
+
 # Regex pattern of program comment
 programs_pattern_obj = re.compile(r'\/\/\sPrograms')
 # Regex pattern of variables comment
@@ -124,3 +139,39 @@ def setup_logger(name, log_file, formatter, level=logging.WARNING):
     log.addHandler(handler)
 
     return log
+
+
+def get_netns_path(pid):
+    """Returns the path of the network namespace of the process pid (e.g., the shell of a Mininet host)."""
+    return '/proc/{}/ns/net'.format(pid)
+
+
+def setns(fd):
+    libc = CDLL(find_library('c'), use_errno=True)
+    if libc.setns(fd, CLONE_NEWNET) != 0:
+        errno = get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+@contextmanager
+def netns(path):
+    """Runs the body in the network namespace at path (no-op if None), sockets created by it remain in there.
+
+    Only the calling thread enters the namespace, so that one process can serve sockets of several Mininet hosts.
+    """
+    if path is None:
+        yield
+        return
+    own_fd = os.open(THREAD_NETNS_PATH, os.O_RDONLY)
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            setns(fd)
+        finally:
+            os.close(fd)
+        try:
+            yield
+        finally:
+            setns(own_fd)
+    finally:
+        os.close(own_fd)
@@ -6,19 +6,10 @@ from utils import get_pkg_path
 from os import path, sep
 from cpstwinning.twins import Plc, Hmi, Motor
 from SimpleWebSocketServer import SimpleWebSocketServer, WebSocket
-from multiprocessing.connection import Client
-from cpstwinning.plcmessages import TerminateMessage, MonitorMessage, MonitorResponseMessage, GetTagMessage, \
-    GetTagResponseMessage, GetAllTagNamesMessage, GetAllTagNamesResponseMessage
-from cpstwinning.utils import UnknownPlcTagException
-from time import sleep
-from errno import ENOENT
 
 import json
 import logging
 import re
-import os
-import utils
-import socket
 import threading
 
 logger = logging.getLogger(__name__)
@@ -116,117 +107,44 @@ class VizHttpServer(Thread):
 def get_viz_websocket_handler(cpstw):
     device_to_client_map = {}
 
-    class VariableMonitoringThread(Thread):
-
-        def __init__(self, **kwargs):
-            Thread.__init__(self)
-            # If PLC name is set, we monitor all PLC tags
-            self.plc_name = kwargs.get('plc_name', None)
-            self.motor = None
-            # If no PLC name is set, we check if motor tags should be monitored
-            if self.plc_name is None:
-                self.motor = kwargs.get('motor', None)
-                # No motor supplied, building thread failed. Either PLC name (for monitoring all PLC tags) or motor
-                # (for monitoring motor/PLC tags) must be supplied
-                if self.motor is None:
-                    raise ValueError("No PLC name or motor supplied.")
+    def send_tag_change(dev_name, name, value):
+        if dev_name in device_to_client_map:
+            for client in device_to_client_map[dev_name]:
+                client.sendMessage(u"" + json.dumps({'tag_change': {'name': name, 'value': value}}))
+
+    def plc_tag_callback(plc, name, value, timestamp):
+        send_tag_change(plc.name, name, value)
+
+    def get_motor_tag_callback(motor):
+
+        def motor_tag_callback(plc, name, value, timestamp):
+            if motor.name in device_to_client_map:
+                # We are receiving PLC tag changes, yet we have to transmit the motor tag
+                # The 'plc_vars_map' will contain the mapping: {PLC_TAG_NAME: IDX_MOTOR_VARS}
+                idx_motor_var = motor.plc_vars_map.get(name)
+                if idx_motor_var is not None:
+                    # Set the correct motor tag name
+                    name = motor.vars[idx_motor_var]['name']
                 else:
-                    self.plc_name = self.motor.plc.name
-            self.listener_ready = False
-
-        def __create_connection(self):
-            tmp_base = utils.get_tmp_base_path_from_mkfile()
-            plc_base_path = os.path.join(tmp_base, self.plc_name)
-            address = os.path.join(plc_base_path, 'plc_socket')
-            # Wait until listener is ready
-            # TODO: Refactoring needed (anti-pattern)
-            while not self.listener_ready:
-                try:
-                    self.conn = Client(address)
-                    self.listener_ready = True
-                except socket.error as e:
-                    # Check if listener is not yet ready
-                    if e.errno == ENOENT:  # socket.error: [Errno 2] No such file or directory
-                        sleep(1)
-                    else:
-                        logger.exception("Unknown socket error occurred.")
-
-        def run(self):
-            self.__create_connection()
-            tag_names = []
-            # If motor is none, all PLC tags should be monitored
-            if self.motor is None:
-                self.conn.send(GetAllTagNamesMessage())
-            else:
-                tag_names = self.motor.plc_vars_map.keys()
-                self.conn.send(MonitorMessage(tag_names))
-            while True:
-                try:
-                    result = self.conn.recv()
-                    if isinstance(result, UnknownPlcTagException):
-                        raise UnknownPlcTagException(result)
-                    elif isinstance(result, TerminateMessage):
-                        logger.info("Terminating monitoring of '{}'.".format(', '.join(tag_names)))
-                        break
-                    elif isinstance(result, GetAllTagNamesResponseMessage):
-                        tag_names = result.tag_names
-                        # Recreate connection before sending new message
-                        self.listener_ready = False
-                        self.__create_connection()
-                        self.conn.send(MonitorMessage(tag_names))
-                    elif isinstance(result, MonitorResponseMessage):
-                        dev_name = None
-                        # First check if we are currently monitoring a PLC or motor
-                        if self.motor is None:
-                            # We are monitoring a PLC
-                            if self.plc_name in device_to_client_map:
-                                dev_name = self.plc_name
-                        else:
-                            if self.motor.name in device_to_client_map:
-                                dev_name = self.motor.name
-                                # We have to alter the name of the result set, as we are receiving PLC tag
-                                # changes, yet we have to transmit the motor tag
-                                # The 'plc_vars_map' will contain the mapping: {PLC_TAG_NAME: IDX_MOTOR_VARS}
-                                idx_motor_var = self.motor.plc_vars_map.get(result.name)
-                                if idx_motor_var is not None:
-                                    # Set the correct motor tag name
-                                    result.name = self.motor.vars[idx_motor_var]['name']
-                                else:
-                                    logger.error("Received unknown PLC tag (motor tag map).")
-
-                        if dev_name is not None:
-                            # logger.info("'%s' variable changed [%s=%s].", dev_name, result.name, result.value)
-                            for client in device_to_client_map[dev_name]:
-                                client.sendMessage(
-                                    u"" + json.dumps({'tag_change': {'name': result.name, 'value': result.value}}))
-                    else:
-                        logger.error("Received unexpected message type '%s'.", type(result))
-                except EOFError:
-                    logger.exception("Received EOF.")
-                    break
-                except UnknownPlcTagException:
-                    logger.exception("Unknown PLC Tag.")
+                    logger.error("Received unknown PLC tag (motor tag map).")
+                send_tag_change(motor.name, name, value)
 
-            self.conn.close()
+        return motor_tag_callback
 
     def hmi_tag_callback(hmi, name, value):
         logger.debug("HMI '%s' variable changed [%s=%s].", hmi.name, name, value)
-        if hmi.name in device_to_client_map:
-            for client in device_to_client_map[hmi.name]:
-                client.sendMessage(
-                    u"" + json.dumps({'tag_change': {'name': name, 'value': value}}))
+        send_tag_change(hmi.name, name, value)
 
     for node in cpstw.values():
         if isinstance(node, Plc):
-            plc_mon_thread = VariableMonitoringThread(plc_name=node.name)
-            plc_mon_thread.start()
+            # Monitor all PLC tags
+            node.subscribe(None, plc_tag_callback)
         elif isinstance(node, Hmi):
             node.add_var_monitor_clbk(hmi_tag_callback)
 
     for device in cpstw.physical_devices:
         if isinstance(device, Motor):
-            motor_mon_thread = VariableMonitoringThread(motor=device)
-            motor_mon_thread.start()
+            device.plc.subscribe(device.plc_vars_map.keys(), get_motor_tag_callback(device))
 
     class VizWebsocketHandler(WebSocket):
 
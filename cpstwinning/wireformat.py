@@ -0,0 +1,511 @@
+#!/usr/bin/env python
+
+from cpstwinning import plcmessages, hmimessages, mqttmessages
+from datetime import datetime, timedelta
+
+import struct
+import cPickle as pickle
+
+# Binary frames start with MAGIC, which is not a pickle opcode (pickles sent by multiprocessing start with \x80)
+MAGIC = 0xCB
+VERSION = 4
+# Magic, version, message type, request id (0: not a response to or expecting a response)
+HEADER = struct.Struct('!BBBI')
+# Message type of frames, whose payload is a pickled object (e.g., an exception)
+PICKLED = 0x00
+MAX_REQUEST_ID = 0xFFFFFFFF
+
+# Interned tag names are sent as id (u16); the first occurrence of a name on a connection additionally has
+# TAG_DEFINITION set and is followed by the name
+TAG_DEFINITION = 0x8000
+MAX_TAG_ID = 0x7FFF
+
+U8 = struct.Struct('!B')
+U16 = struct.Struct('!H')
+U32 = struct.Struct('!I')
+I64 = struct.Struct('!q')
+F64 = struct.Struct('!d')
+# Value type followed by the value (or the length of the value)
+TYPED_I64 = struct.Struct('!Bq')
+TYPED_F64 = struct.Struct('!Bd')
+TYPED_LEN = struct.Struct('!BI')
+# Types of packed PLC values
+BOOL_TYPE = chr(0x00)
+INT_TYPE = chr(0x01)
+PLC_VALUE_TYPES = {bool: BOOL_TYPE, int: INT_TYPE, long: INT_TYPE}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class ValueTypes(object):
+    NONE = 0x00
+    FALSE = 0x01
+    TRUE = 0x02
+    INT = 0x03
+    FLOAT = 0x04
+    STR = 0x05
+    UNICODE = 0x06
+    LIST = 0x07
+    TUPLE = 0x08
+    DICT = 0x09
+
+    def __setattr__(self, *_):
+        pass
+
+
+class FieldTypes(object):
+    # Interned tag name
+    TAG = 'tag'
+    # List of interned tag names
+    TAGS = 'tags'
+    # Typed value (None, bool, int, float, str, unicode or a list, tuple or dict thereof)
+    VALUE = 'value'
+    # List of PLC values (bool or int), packed as int64 array
+    PLC_VALUES = 'plc_values'
+    # List of dicts, which all have the same keys (e.g., tags with name and value); keys are sent once only
+    RECORDS = 'records'
+    U8 = 'u8'
+    U16 = 'u16'
+    I64 = 'i64'
+    F64 = 'f64'
+    BOOL = 'bool'
+    STR = 'str'
+    BYTES = 'bytes'
+    # datetime (UTC), sent as int64 ns since epoch
+    TIMESTAMP = 'timestamp'
+
+    def __setattr__(self, *_):
+        pass
+
+
+def to_ns(timestamp):
+    delta = timestamp - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000000 + delta.microseconds * 1000
+
+
+def from_ns(ns):
+    return EPOCH + timedelta(microseconds=ns // 1000)
+
+
+def encode_value(out, value):
+    try:
+        encoder = VALUE_ENCODERS[type(value)]
+    except KeyError:
+        raise TypeError("Type '{}' is not supported.".format(type(value)))
+    encoder(out, value)
+
+
+def decode_value(data, offset):
+    """Returns the value at offset and the offset following it."""
+    return VALUE_DECODERS[ord(data[offset])](data, offset + 1)
+
+
+def encode_none(out, _):
+    out.append(chr(ValueTypes.NONE))
+
+
+def encode_bool(out, value):
+    out.append(chr(ValueTypes.TRUE) if value else chr(ValueTypes.FALSE))
+
+
+def encode_int(out, value):
+    out.append(TYPED_I64.pack(ValueTypes.INT, value))
+
+
+def encode_float(out, value):
+    out.append(TYPED_F64.pack(ValueTypes.FLOAT, value))
+
+
+def encode_str(out, value):
+    out.append(TYPED_LEN.pack(ValueTypes.STR, len(value)))
+    out.append(value)
+
+
+def encode_unicode(out, value):
+    value = value.encode('utf-8')
+    out.append(TYPED_LEN.pack(ValueTypes.UNICODE, len(value)))
+    out.append(value)
+
+
+def encode_sequence(out, value):
+    out.append(TYPED_LEN.pack(ValueTypes.LIST if type(value) is list else ValueTypes.TUPLE, len(value)))
+    for v in value:
+        encode_value(out, v)
+
+
+def encode_dict(out, value):
+    out.append(TYPED_LEN.pack(ValueTypes.DICT, len(value)))
+    for k, v in value.iteritems():
+        encode_value(out, k)
+        encode_value(out, v)
+
+
+def decode_none(data, offset):
+    return None, offset
+
+
+def decode_false(data, offset):
+    return False, offset
+
+
+def decode_true(data, offset):
+    return True, offset
+
+
+def decode_int(data, offset):
+    return I64.unpack_from(data, offset)[0], offset + I64.size
+
+
+def decode_float(data, offset):
+    return F64.unpack_from(data, offset)[0], offset + F64.size
+
+
+def decode_str(data, offset):
+    length, = U32.unpack_from(data, offset)
+    offset += U32.size
+    return data[offset:offset + length], offset + length
+
+
+def decode_unicode(data, offset):
+    value, offset = decode_str(data, offset)
+    return value.decode('utf-8'), offset
+
+
+def decode_list(data, offset):
+    count, = U32.unpack_from(data, offset)
+    offset += U32.size
+    values = []
+    for _ in xrange(count):
+        v, offset = VALUE_DECODERS[ord(data[offset])](data, offset + 1)
+        values.append(v)
+    return values, offset
+
+
+def decode_tuple(data, offset):
+    values, offset = decode_list(data, offset)
+    return tuple(values), offset
+
+
+def decode_dict(data, offset):
+    count, = U32.unpack_from(data, offset)
+    offset += U32.size
+    values = {}
+    for _ in xrange(count):
+        k, offset = VALUE_DECODERS[ord(data[offset])](data, offset + 1)
+        values[k], offset = VALUE_DECODERS[ord(data[offset])](data, offset + 1)
+    return values, offset
+
+
+# bool is not dispatched to encode_int, as types are looked up exactly
+VALUE_ENCODERS = {
+    type(None): encode_none,
+    bool: encode_bool,
+    int: encode_int,
+    long: encode_int,
+    float: encode_float,
+    str: encode_str,
+    unicode: encode_unicode,
+    list: encode_sequence,
+    tuple: encode_sequence,
+    dict: encode_dict
+}
+
+VALUE_DECODERS = {
+    ValueTypes.NONE: decode_none,
+    ValueTypes.FALSE: decode_false,
+    ValueTypes.TRUE: decode_true,
+    ValueTypes.INT: decode_int,
+    ValueTypes.FLOAT: decode_float,
+    ValueTypes.STR: decode_str,
+    ValueTypes.UNICODE: decode_unicode,
+    ValueTypes.LIST: decode_list,
+    ValueTypes.TUPLE: decode_tuple,
+    ValueTypes.DICT: decode_dict
+}
+
+
+def encode_records(out, records):
+    out.append(U32.pack(len(records)))
+    if not records:
+        return
+    keys = records[0].keys()
+    encode_sequence(out, keys)
+    for record in records:
+        if len(record) != len(keys):
+            raise TypeError("Records have different keys.")
+        for k in keys:
+            encode_value(out, record[k])
+
+
+def encode_plc_values(out, values):
+    try:
+        # One type per value, followed by all values
+        types = ''.join([PLC_VALUE_TYPES[type(v)] for v in values])
+    except KeyError:
+        raise TypeError("PLC values must be bool or int.")
+    out.append(U32.pack(len(values)))
+    out.append(types)
+    out.append(struct.pack('!{}q'.format(len(values)), *values))
+
+
+def decode_plc_values(data, offset):
+    count, = U32.unpack_from(data, offset)
+    offset += U32.size
+    types = data[offset:offset + count]
+    offset += count
+    values = list(struct.unpack_from('!{}q'.format(count), data, offset))
+    if BOOL_TYPE in types:
+        values = [bool(v) if t == BOOL_TYPE else v for v, t in zip(values, types)]
+    return values, offset + count * I64.size
+
+
+def decode_records(data, offset):
+    count, = U32.unpack_from(data, offset)
+    offset += U32.size
+    records = []
+    if not count:
+        return records, offset
+    keys, offset = decode_value(data, offset)
+    for _ in xrange(count):
+        record = {}
+        for k in keys:
+            record[k], offset = VALUE_DECODERS[ord(data[offset])](data, offset + 1)
+        records.append(record)
+    return records, offset
+
+
+def encode_bytes(out, value):
+    if type(value) is not str:
+        raise TypeError("Expected byte string.")
+    out.append(U32.pack(len(value)))
+    out.append(value)
+
+
+def get_fixed_field_codec(fixed):
+    """Returns (encoder, decoder) of a fixed-size field, given its struct."""
+
+    def encode(codec, out, new_tags, value):
+        out.append(fixed.pack(value))
+
+    def decode(codec, data, offset):
+        return fixed.unpack_from(data, offset)[0], offset + fixed.size
+
+    return encode, decode
+
+
+# { field type: (encoder(codec, out, new tags, value), decoder(codec, data, offset) -> (value, offset)) }
+FIELD_CODECS = {
+    FieldTypes.TAG: (lambda codec, out, new_tags, value: codec.encode_tag(out, new_tags, value),
+                     lambda codec, data, offset: codec.decode_tag(data, offset)),
+    FieldTypes.TAGS: (lambda codec, out, new_tags, value: codec.encode_tags(out, new_tags, value),
+                      lambda codec, data, offset: codec.decode_tags(data, offset)),
+    FieldTypes.VALUE: (lambda codec, out, new_tags, value: encode_value(out, value),
+                       lambda codec, data, offset: decode_value(data, offset)),
+    FieldTypes.PLC_VALUES: (lambda codec, out, new_tags, value: encode_plc_values(out, value),
+                            lambda codec, data, offset: decode_plc_values(data, offset)),
+    FieldTypes.RECORDS: (lambda codec, out, new_tags, value: encode_records(out, value),
+                         lambda codec, data, offset: decode_records(data, offset)),
+    FieldTypes.U8: get_fixed_field_codec(U8),
+    FieldTypes.U16: get_fixed_field_codec(U16),
+    FieldTypes.I64: get_fixed_field_codec(I64),
+    FieldTypes.F64: get_fixed_field_codec(F64),
+    FieldTypes.BOOL: (lambda codec, out, new_tags, value: out.append(chr(1) if value else chr(0)),
+                      lambda codec, data, offset: (data[offset] != chr(0), offset + 1)),
+    FieldTypes.STR: (lambda codec, out, new_tags, value: encode_bytes(out, value),
+                     lambda codec, data, offset: decode_str(data, offset)),
+    FieldTypes.BYTES: (lambda codec, out, new_tags, value: encode_bytes(out, value),
+                       lambda codec, data, offset: decode_str(data, offset)),
+    FieldTypes.TIMESTAMP: (lambda codec, out, new_tags, value: out.append(I64.pack(to_ns(value))),
+                           lambda codec, data, offset: (from_ns(I64.unpack_from(data, offset)[0]),
+                                                        offset + I64.size))
+}
+
+
+# { message type: (class, [(attribute, field type), ...]) }
+# Type ids and layouts must never be changed without increasing VERSION
+MESSAGE_TYPES = {
+    # PLC supervisor
+    0x01: (plcmessages.StartMessage, []),
+    0x02: (plcmessages.StopMessage, []),
+    0x03: (plcmessages.ShowTagsMessage, []),
+    0x04: (plcmessages.ShowTagsResponseMessage, [('tags', FieldTypes.RECORDS)]),
+    0x05: (plcmessages.GetTagsMessage, []),
+    0x06: (plcmessages.GetTagsResponseMessage, [('tags', FieldTypes.RECORDS)]),
+    0x07: (plcmessages.GetAllValuesMessage, []),
+    0x08: (plcmessages.GetAllValuesResponseMessage, [('values', FieldTypes.BYTES)]),
+    0x09: (plcmessages.GetTagMessage, [('name', FieldTypes.TAG)]),
+    0x0A: (plcmessages.GetTagResponseMessage, [('value', FieldTypes.VALUE)]),
+    0x0B: (plcmessages.SetTagMessage, [('name', FieldTypes.TAG), ('value', FieldTypes.VALUE)]),
+    0x0C: (plcmessages.SetTagResponseMessage, []),
+    0x0D: (plcmessages.SetTimeModeMessage, [('mode', FieldTypes.STR), ('factor', FieldTypes.F64)]),
+    0x0E: (plcmessages.StepMessage, [('n', FieldTypes.I64)]),
+    0x0F: (plcmessages.StepResponseMessage, [('tick', FieldTypes.I64), ('current_time', FieldTypes.I64),
+                                             ('tags', FieldTypes.RECORDS)]),
+    0x10: (plcmessages.GetScanStatsMessage, [('reset', FieldTypes.BOOL)]),
+    0x11: (plcmessages.ScanStatsResponseMessage, [('stats', FieldTypes.VALUE)]),
+    0x12: (plcmessages.MonitorMessage, [('tag_names', FieldTypes.TAGS), ('policy', FieldTypes.U8),
+                                        ('batch', FieldTypes.BOOL), ('min_interval', FieldTypes.F64),
+                                        ('deadband', FieldTypes.F64)]),
+    0x13: (plcmessages.StopMonitoringMessage, []),
+    0x14: (plcmessages.GetAllTagNamesMessage, []),
+    0x15: (plcmessages.GetAllTagNamesResponseMessage, [('tag_names', FieldTypes.TAGS)]),
+    0x16: (plcmessages.MonitorResponseMessage, [('timestamp', FieldTypes.TIMESTAMP), ('name', FieldTypes.TAG),
+                                                ('value', FieldTypes.VALUE)]),
+    0x17: (plcmessages.CloseMessage, []),
+    0x18: (plcmessages.TerminateMessage, []),
+    0x19: (plcmessages.SuccessPlcMessage, []),
+    0x1A: (plcmessages.FailedPlcMessage, []),
+    0x1B: (plcmessages.MonitorBatchResponseMessage, [('timestamp', FieldTypes.TIMESTAMP), ('tick', FieldTypes.I64),
+                                                     ('names', FieldTypes.TAGS), ('values', FieldTypes.PLC_VALUES)]),
+    0x1C: (plcmessages.HostPlcMessage, [('name', FieldTypes.STR), ('st_path', FieldTypes.STR),
+                                        ('mb_map_path', FieldTypes.STR), ('netns_path', FieldTypes.STR),
+                                        ('build_profile', FieldTypes.STR)]),
+    # HMI Modbus client
+    0x40: (hmimessages.CloseMessage, []),
+    0x41: (hmimessages.ReadMessage, [('ip', FieldTypes.STR), ('mb_table', FieldTypes.STR),
+                                     ('starting_addr', FieldTypes.U16), ('quantity', FieldTypes.U16)]),
+    0x42: (hmimessages.ReadMessageResult, [('value', FieldTypes.VALUE)]),
+    0x43: (hmimessages.WriteMessage, [('ip', FieldTypes.STR), ('mb_table', FieldTypes.STR),
+                                      ('starting_addr', FieldTypes.U16), ('quantity', FieldTypes.U16),
+                                      ('values', FieldTypes.VALUE)]),
+    0x44: (hmimessages.SuccessHmiMessage, []),
+    0x45: (hmimessages.FailedHmiMessage, []),
+    # MQTT client
+    0x60: (mqttmessages.CloseMessage, []),
+    0x61: (mqttmessages.ConnectMessage, [('host', FieldTypes.STR), ('port', FieldTypes.U16),
+                                         ('keepalive', FieldTypes.U16), ('bind_address', FieldTypes.STR),
+                                         ('auth', FieldTypes.VALUE)]),
+    0x62: (mqttmessages.PublishMessage, [('topic', FieldTypes.STR), ('payload', FieldTypes.VALUE),
+                                         ('qos', FieldTypes.U8), ('retain', FieldTypes.BOOL)]),
+    0x63: (mqttmessages.DisconnectMessage, []),
+}
+
+# { class: (message type, [(attribute, encoder), ...]) }
+MESSAGE_ENCODERS = dict(
+    (clazz, (msg_type, [(attr, FIELD_CODECS[field_type][0]) for attr, field_type in fields]))
+    for msg_type, (clazz, fields) in MESSAGE_TYPES.iteritems())
+# { message type: (class, [(attribute, decoder), ...]) }
+MESSAGE_DECODERS = dict(
+    (msg_type, (clazz, [(attr, FIELD_CODECS[field_type][1]) for attr, field_type in fields]))
+    for msg_type, (clazz, fields) in MESSAGE_TYPES.iteritems())
+
+
+class Codec(object):
+    """Encodes and decodes the messages sent via one connection.
+
+    Messages of the types in MESSAGE_TYPES are encoded as binary frames, any other object (e.g., exceptions and
+    error texts) is pickled. Each frame carries a request id, which a response repeats, so that responses can be
+    matched with requests sent back to back. Tag names are interned per direction of the connection, so a codec
+    must encode (and decode) messages in the order in which they are sent (and received).
+    """
+
+    def __init__(self):
+        # { tag name: id } of sent names
+        self.out_tags = {}
+        # Received names, indexed by id
+        self.in_tags = []
+
+    def encode(self, obj, request_id=0):
+        spec = MESSAGE_ENCODERS.get(type(obj))
+        if spec is not None:
+            msg_type, fields = spec
+            out = [HEADER.pack(MAGIC, VERSION, msg_type, request_id)]
+            # Names interned by this message, which must be forgotten if it cannot be encoded
+            new_tags = []
+            try:
+                for attr, encoder in fields:
+                    encoder(self, out, new_tags, getattr(obj, attr))
+                return ''.join(out)
+            except (struct.error, TypeError, ValueError, OverflowError, AttributeError):
+                # Not encodable (e.g., int exceeding int64), fall back to pickle
+                for name in new_tags:
+                    del self.out_tags[name]
+        return HEADER.pack(MAGIC, VERSION, PICKLED, request_id) + pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return self.decode_frame(data)[1]
+
+    def decode_frame(self, data):
+        """Returns the request id and the message of a frame."""
+        if not data or ord(data[0]) != MAGIC:
+            # Plain pickle, e.g., sent by a multiprocessing Client
+            return 0, pickle.loads(data)
+        _, version, msg_type, request_id = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ValueError("Unsupported wire format version {}.".format(version))
+        if msg_type == PICKLED:
+            return request_id, pickle.loads(data[HEADER.size:])
+        clazz, fields = MESSAGE_DECODERS[msg_type]
+        # Messages are plain containers, so __init__ (which may set defaults, e.g., timestamps) is skipped
+        obj = clazz.__new__(clazz)
+        offset = HEADER.size
+        for attr, decoder in fields:
+            value, offset = decoder(self, data, offset)
+            setattr(obj, attr, value)
+        return request_id, obj
+
+    def encode_tag(self, out, new_tags, name):
+        """Encodes the id of name (u16), followed by its definition, if it is interned newly."""
+        definitions = []
+        out.append(U16.pack(self.__intern(name, new_tags, definitions)))
+        out.extend(definitions)
+
+    def encode_tags(self, out, new_tags, names):
+        """Encodes the ids of names (u32 count, u16 ids), followed by the definitions of newly interned names."""
+        definitions = []
+        ids = [self.out_tags.get(name) for name in names]
+        if None in ids:
+            ids = [self.__intern(name, new_tags, definitions) for name in names]
+        out.append(struct.pack('!I{}H'.format(len(ids)), len(ids), *ids))
+        out.extend(definitions)
+
+    def __intern(self, name, new_tags, definitions):
+        """Returns the id of name, with TAG_DEFINITION set (and its definition added), if it is interned newly."""
+        tag_id = self.out_tags.get(name)
+        if tag_id is not None:
+            return tag_id
+        if isinstance(name, unicode):
+            name = name.encode('utf-8')
+        elif type(name) is not str:
+            raise TypeError("Tag name must be a string.")
+        tag_id = len(self.out_tags)
+        if tag_id > MAX_TAG_ID:
+            raise ValueError("Too many tags.")
+        self.out_tags[name] = tag_id
+        new_tags.append(name)
+        definitions.append(U16.pack(len(name)))
+        definitions.append(name)
+        return tag_id | TAG_DEFINITION
+
+    def decode_tag(self, data, offset):
+        tag_id, = U16.unpack_from(data, offset)
+        offset += U16.size
+        if not tag_id & TAG_DEFINITION:
+            return self.in_tags[tag_id], offset
+        return self.__decode_definition(data, offset, tag_id)
+
+    def decode_tags(self, data, offset):
+        count, = U32.unpack_from(data, offset)
+        offset += U32.size
+        ids = struct.unpack_from('!{}H'.format(count), data, offset)
+        offset += count * U16.size
+        if not ids or max(ids) < TAG_DEFINITION:
+            # No definitions of newly interned names
+            return [self.in_tags[tag_id] for tag_id in ids], offset
+        names = []
+        for tag_id in ids:
+            if tag_id & TAG_DEFINITION:
+                name, offset = self.__decode_definition(data, offset, tag_id)
+                names.append(name)
+            else:
+                names.append(self.in_tags[tag_id])
+        return names, offset
+
+    def __decode_definition(self, data, offset, tag_id):
+        length, = U16.unpack_from(data, offset)
+        offset += U16.size
+        name = data[offset:offset + length]
+        if tag_id & MAX_TAG_ID != len(self.in_tags):
+            raise ValueError("Tag definitions out of order.")
+        self.in_tags.append(name)
+        return name, offset + length
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import argparse
+import timeit
+import cPickle as pickle
+
+from cpstwinning.plcmessages import GetTagMessage, GetTagResponseMessage, SetTagMessage, SetTagResponseMessage, \
+    MonitorMessage, MonitorResponseMessage, MonitorBatchResponseMessage, GetTagsResponseMessage, \
+    GetAllValuesResponseMessage
+from cpstwinning.hmimessages import ReadMessage, ReadMessageResult
+from cpstwinning.wireformat import Codec
+
+
+def get_messages(tags):
+    names = ['TAG{}'.format(i) for i in range(tags)]
+    return [
+        ('GetTag', GetTagMessage(names[0])),
+        ('GetTagResponse', GetTagResponseMessage(4711)),
+        ('SetTag', SetTagMessage(names[1], 'true')),
+        ('SetTagResponse', SetTagResponseMessage()),
+        ('Monitor', MonitorMessage(names)),
+        ('MonitorResponse', MonitorResponseMessage(names[2], True)),
+        ('MonitorBatchResponse', MonitorBatchResponseMessage(4711, names, range(tags))),
+        ('GetTagsResponse', GetTagsResponseMessage([{'name': n, 'value': i} for i, n in enumerate(names)])),
+        ('GetAllValuesResponse', GetAllValuesResponseMessage('\x00' * 8 * tags)),
+        ('HmiRead', ReadMessage('192.168.0.1', 'hr', 1)),
+        ('HmiReadResult', ReadMessageResult(42))
+    ]
+
+
+def bench(name, msg, number):
+    """Returns [name, pickle size, codec size, pickle us, codec us] per round trip (encode and decode)."""
+    pickled = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+    # Sender and receiver have already interned the names of the message (steady state of a connection)
+    sender, receiver = Codec(), Codec()
+    receiver.decode(sender.encode(msg))
+    encoded = sender.encode(msg)
+    pickle_time = timeit.timeit(lambda: pickle.loads(pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)), number=number)
+    codec_time = timeit.timeit(lambda: receiver.decode(sender.encode(msg)), number=number)
+    return [name, len(pickled), len(encoded), '{:.2f}'.format(pickle_time / number * 1e6),
+            '{:.2f}'.format(codec_time / number * 1e6)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the wire format of supervisor messages with pickle.')
+    parser.add_argument('--number', type=int, default=20000, help='round trips per message type')
+    parser.add_argument('--tags', type=int, default=32, help='number of tags of list messages')
+    args = parser.parse_args()
+    titles = ["Message", "Pickle [B]", "Codec [B]", "Pickle [us]", "Codec [us]"]
+    data = [titles] + [bench(name, msg, args.number) for name, msg in get_messages(args.tags)]
+    out = ""
+    for i, d in enumerate(data):
+        out = out + '|'.join(str(x).ljust(22) for x in d) + '\n'
+        if i == 0:
+            out = out + '-' * len(out) + '\n'
+    print out
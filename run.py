@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 
-from cpstwinning.cpstw import CpsTwinning
+from cpstwinning.cpstw import CpsTwinning, SHARED_SUPERVISOR_ENV
 from cpstwinning.cli import CpsTwinningCli as CLI
 
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +21,7 @@ class CpsTwinningMain(object):
 
 
 if __name__ == "__main__":
-    net = CpsTwinning()
+    net = CpsTwinning(shared_supervisor=os.environ.get(SHARED_SUPERVISOR_ENV) == '1')
 
     demo = CpsTwinningMain(
         name='cps_twinning',
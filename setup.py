@@ -38,7 +38,8 @@ setup(
         'pymodbus==1.4.0',
         'scapy==2.4.3',
         'kafka-python==1.4.0',
-        'paho-mqtt==1.3.1'
+        'paho-mqtt==1.3.1',
+        'numpy==1.16.6'  # Last release supporting Python 2.7
     ],
     package_data={},
     data_files=None,
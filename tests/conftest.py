@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+import sys
+import types
+
+
+class Host(object):
+    """Stands in for mininet.node.Host, as the tests do not start any Mininet hosts."""
+
+
+class Station(Host):
+    """Stands in for mininet.wifi.node.Station."""
+
+
+def stand_in(name, **attrs):
+    """Registers a module of the given attributes as name (and its parent packages), unless it can be imported."""
+    try:
+        __import__(name)
+        return
+    except ImportError:
+        pass
+    parent = None
+    for i, part in enumerate(name.split('.')):
+        module_name = '.'.join(name.split('.')[:i + 1])
+        module = sys.modules.get(module_name)
+        if module is None:
+            module = sys.modules[module_name] = types.ModuleType(module_name)
+            if parent is not None:
+                setattr(parent, part, module)
+        parent = module
+    parent.__dict__.update(attrs)
+
+
+# The twins are Mininet(-WiFi) hosts, whose device models are tested without Mininet-WiFi being installed
+stand_in('mininet.node', Host=Host)
+stand_in('mininet.wifi.node', Station=Station)
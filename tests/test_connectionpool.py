@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+from threading import Thread
+from cpstwinning.ipc import ConnectionPool, Server
+from cpstwinning.plcmessages import GetTagMessage, GetTagResponseMessage, SetTagMessage
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+TIMEOUT = 5
+
+
+class CountingServer(object):
+    """Serves a pool's requests, but fails to handle each SetTagMessage, so that it is not responded to."""
+
+    def __init__(self, address):
+        self.address = address
+        self.handled = []
+        self.server = None
+        self.thread = None
+
+    def handle(self, conn, msg):
+        self.handled.append(msg)
+        if isinstance(msg, SetTagMessage):
+            raise RuntimeError("Not responded to.")
+        conn.send(GetTagResponseMessage(msg.name))
+        return True
+
+    def start(self):
+        self.server = Server(self.address, self.handle)
+        self.thread = Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.thread.join(TIMEOUT)
+
+
+@pytest.fixture
+def server():
+    tmp_path = tempfile.mkdtemp()
+    server = CountingServer(os.path.join(tmp_path, 'socket'))
+    server.start()
+    yield server
+    server.stop()
+    shutil.rmtree(tmp_path)
+
+
+def test_request_is_not_sent_again_when_response_fails(server):
+    pool = ConnectionPool(server.address, timeout=TIMEOUT)
+    # Makes the pool reuse a connection
+    assert pool.request(GetTagMessage('V0')).value == 'V0'
+    with pytest.raises((EOFError, IOError)):
+        pool.request(SetTagMessage('V0', '1'))
+    assert len([msg for msg in server.handled if isinstance(msg, SetTagMessage)]) == 1
+    pool.close()
+
+
+def test_stale_connection_is_replaced(server):
+    pool = ConnectionPool(server.address, timeout=TIMEOUT)
+    assert pool.request(GetTagMessage('V0')).value == 'V0'
+    # Closes the pooled connection
+    server.stop()
+    server.start()
+    assert pool.request(GetTagMessage('V1')).value == 'V1'
+    pool.close()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+from threading import Event
+from cpstwinning.deviceruntime import DeviceRuntime
+from cpstwinning.twins import CandySensor, Motor
+
+import resource
+import time
+
+import pytest
+
+TIMEOUT = 5
+# Number of devices per type
+DEVICES = 100
+# Time in s, in which the CPU usage of the idle devices is measured
+IDLE_TIME = 1.0
+# Share of a core all idle devices may use together
+MAX_IDLE_CPU_SHARE = 0.02
+# Scan cycle interval in ns of a stepped PLC
+TICK_TIME = 10000000
+
+
+class IdlePlc(object):
+    """Stands in for a Plc twin, whose tags never change."""
+
+    name = 'PLC'
+
+    def subscribe(self, tag_names, clbk):
+        pass
+
+    def unsubscribe(self, clbk):
+        pass
+
+    def is_realtime(self):
+        return True
+
+    def get_current_time(self):
+        return int(time.time() * 1e9)
+
+
+class SteppedPlc(object):
+    """Stands in for a Plc twin in the step time mode, whose time only advances when it is stepped."""
+
+    name = 'PLC'
+
+    def __init__(self):
+        self.time = 0
+        self.time_clbks = set()
+
+    def is_realtime(self):
+        return False
+
+    def get_current_time(self):
+        return self.time
+
+    def get_wait_time(self, plc_time):
+        return 0 if self.time >= plc_time else None
+
+    def add_time_clbk(self, clbk):
+        self.time_clbks.add(clbk)
+
+    def step(self, n=1):
+        self.time += n * TICK_TIME
+        for clbk in list(self.time_clbks):
+            clbk(self)
+
+
+class IdleRfidReader(object):
+    """Stands in for a RfidReaderMqttWiFi twin, which never reads a tag."""
+
+    def add_read_clbk(self, clbk):
+        pass
+
+    def remove_read_clbk(self, clbk):
+        pass
+
+
+def get_cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+@pytest.fixture
+def runtime():
+    runtime = DeviceRuntime()
+    runtime.start()
+    yield runtime
+    runtime.stop()
+    runtime.join(TIMEOUT)
+
+
+def test_idle_devices_use_no_cpu(runtime):
+    plc = IdlePlc()
+    devices = [CandySensor('CS{}'.format(i), plc, {'EXTRACTOR': 1}, IdleRfidReader(), runtime)
+               for i in xrange(DEVICES)]
+    devices += [Motor('M{}'.format(i), [{'name': 'Speed', 'value': 0}], plc, {'SPEED': 0}, runtime)
+                for i in xrange(DEVICES)]
+    start, start_cpu = time.time(), get_cpu_time()
+    time.sleep(IDLE_TIME)
+    share = (get_cpu_time() - start_cpu) / (time.time() - start)
+    for device in devices:
+        device.terminate()
+    assert share < MAX_IDLE_CPU_SHARE, "{} idle devices used {:.1%} of a core.".format(len(devices), share)
+
+
+def test_pending_virtual_timer_uses_no_cpu(runtime):
+    plc = SteppedPlc()
+    fired = Event()
+    runtime.call_later(0.05, fired.set, (), plc)
+    start, start_cpu = time.time(), get_cpu_time()
+    time.sleep(IDLE_TIME)
+    share = (get_cpu_time() - start_cpu) / (time.time() - start)
+    assert share < MAX_IDLE_CPU_SHARE, "Pending virtual timer used {:.1%} of a core.".format(share)
+    plc.step(4)
+    assert not fired.wait(0.1)
+    plc.step()
+    assert fired.wait(TIMEOUT)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+from threading import Event, Lock, Thread
+from cpstwinning.ipc import Server, connect, PLC_SOCKET_NAME
+from cpstwinning.plc_supervisor import ListenerThread
+from cpstwinning.plcmessages import StepMessage, StepResponseMessage, GetTagMessage, GetTagResponseMessage, \
+    CloseMessage
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+TIMEOUT = 5
+# Number of connections closed by the server, right after each of which a new connection is made
+CLOSED_CONNECTIONS = 100
+
+
+class SlowStepPlc(object):
+    """Stands in for a PlcSupervisor, whose steps only finish once they are released."""
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.initialized = Event()
+        self.initialized.set()
+        self.lock = Lock()
+        self.stepping = Event()
+        self.released = Event()
+
+    def step(self, n=1):
+        self.stepping.set()
+        self.released.wait(TIMEOUT)
+        return StepResponseMessage(n, 0, [])
+
+    def get_var_value(self, name):
+        return '42\n'
+
+
+def echo(conn, msg):
+    """Responds with the name of a GetTagMessage, lets the server close the connection on a CloseMessage."""
+    if isinstance(msg, CloseMessage):
+        return None
+    conn.send(GetTagResponseMessage(msg.name))
+    return True
+
+
+@pytest.fixture
+def plc():
+    tmp_path = tempfile.mkdtemp()
+    plc = SlowStepPlc(tmp_path)
+    listener = ListenerThread(plc)
+    listener.daemon = True
+    listener.start()
+    yield plc
+    plc.released.set()
+    conn = connect(os.path.join(tmp_path, PLC_SOCKET_NAME), TIMEOUT)
+    conn.send(CloseMessage())
+    listener.join(TIMEOUT)
+    shutil.rmtree(tmp_path)
+
+
+def test_get_tag_is_served_during_step(plc):
+    address = os.path.join(plc.tmp_path, PLC_SOCKET_NAME)
+    stepping_conn = connect(address, TIMEOUT)
+    conn = connect(address, TIMEOUT)
+    stepping_conn.send(StepMessage(5))
+    assert plc.stepping.wait(TIMEOUT)
+    conn.send(GetTagMessage('V0'))
+    assert conn.poll(TIMEOUT)
+    res = conn.recv()
+    assert isinstance(res, GetTagResponseMessage)
+    assert res.value == '42\n'
+    # The step is still in progress
+    assert not stepping_conn.poll(0.1)
+    plc.released.set()
+    assert stepping_conn.poll(TIMEOUT)
+    assert stepping_conn.recv().tick == 5
+    stepping_conn.close()
+    conn.close()
+
+
+@pytest.fixture(params=[True, False], ids=['ordered', 'unordered'])
+def echo_address(request):
+    tmp_path = tempfile.mkdtemp()
+    address = os.path.join(tmp_path, PLC_SOCKET_NAME)
+    server = Server(address, echo, ordered=request.param)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield address
+    server.shutdown()
+    thread.join(TIMEOUT)
+    shutil.rmtree(tmp_path)
+
+
+def test_closed_connection_does_not_affect_new_one(echo_address):
+    for i in xrange(CLOSED_CONNECTIONS):
+        closing_conn = connect(echo_address, TIMEOUT)
+        closing_conn.send(CloseMessage())
+        # May be accepted with the fd of the closing connection
+        conn = connect(echo_address, TIMEOUT)
+        conn.send(GetTagMessage('V{}'.format(i)))
+        assert conn.poll(TIMEOUT)
+        assert conn.recv().value == 'V{}'.format(i)
+        with pytest.raises(EOFError):
+            closing_conn.recv()
+        closing_conn.close()
+        conn.close()
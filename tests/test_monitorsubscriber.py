@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+from cpstwinning.plc_supervisor import MonitorSubscriber, MONITOR_QUEUE_SIZE
+from cpstwinning.plcmessages import MonitorResponseMessage, MonitorBatchResponseMessage, MonitorPolicies, CloseMessage
+
+import time
+
+import pytest
+
+TIMEOUT = 5
+# Number of changes exceeding the capacity of the queue
+OVERFLOW = 10
+# Minimum interval in s between two reported changes of a var
+MIN_INTERVAL = 0.2
+
+
+class RecordingConnection(object):
+    """Stands in for a monitoring connection, which records the messages sent via it."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, msg):
+        self.sent.append(msg)
+
+
+def overflow(policy, batch=False, n_vars=1):
+    """Queues more changes than fit into the queue of a subscriber, returns the messages it sends on closing."""
+    conn = RecordingConnection()
+    subscriber = MonitorSubscriber(conn, policy, batch, lambda _: None)
+    for value in xrange(MONITOR_QUEUE_SIZE + OVERFLOW):
+        idx = value % n_vars
+        subscriber.put(idx, MonitorResponseMessage('V{}'.format(idx), value), value)
+        subscriber.end_cycle()
+    # Sends the queued changes followed by the final message, as the subscriber has not sent any change yet
+    subscriber.close(CloseMessage())
+    subscriber.start()
+    subscriber.join(TIMEOUT)
+    assert not subscriber.is_alive()
+    assert isinstance(conn.sent[-1], CloseMessage)
+    return conn.sent[:-1]
+
+
+def filter_changes(values, min_interval=0.0, deadband=0.0, expected=1, settle=0.0):
+    """Puts a change of V0 per value, returns the values sent by the subscriber once it has sent expected changes
+    and another settle s have passed."""
+    conn = RecordingConnection()
+    subscriber = MonitorSubscriber(conn, MonitorPolicies.DROP_OLDEST, False, lambda _: None)
+    subscriber.set_filter(0, min_interval, deadband)
+    subscriber.start()
+    for value in values:
+        subscriber.put(0, MonitorResponseMessage('V0', value), 0)
+    deadline = time.time() + TIMEOUT
+    while len(conn.sent) < expected and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(settle)
+    subscriber.close()
+    subscriber.join(TIMEOUT)
+    return [msg.value for msg in conn.sent]
+
+
+def test_overflow_drops_oldest():
+    sent = overflow(MonitorPolicies.DROP_OLDEST)
+    assert [msg.value for msg in sent] == range(OVERFLOW, MONITOR_QUEUE_SIZE + OVERFLOW)
+
+
+def test_overflow_drops_newest():
+    sent = overflow(MonitorPolicies.DROP_NEWEST)
+    assert [msg.value for msg in sent] == range(MONITOR_QUEUE_SIZE)
+
+
+def test_overflow_drops_oldest_batches():
+    sent = overflow(MonitorPolicies.DROP_OLDEST, batch=True)
+    assert all(isinstance(msg, MonitorBatchResponseMessage) for msg in sent)
+    assert [msg.tick for msg in sent] == range(OVERFLOW, MONITOR_QUEUE_SIZE + OVERFLOW)
+
+
+@pytest.mark.parametrize('batch', [False, True])
+def test_coalescing_keeps_latest_value_per_var(batch):
+    n_vars = 3
+    sent = overflow(MonitorPolicies.COALESCE, batch=batch, n_vars=n_vars)
+    if batch:
+        msg, = sent
+        changes = zip(msg.names, msg.values)
+    else:
+        changes = [(msg.name, msg.value) for msg in sent]
+    last = MONITOR_QUEUE_SIZE + OVERFLOW - 1
+    assert sorted(changes) == sorted(('V{}'.format(v % n_vars), v) for v in xrange(last - n_vars + 1, last + 1))
+
+
+def test_coalescing_drops_vars_beyond_capacity():
+    # Every change is of another var, so the queue fills up with distinct vars
+    sent = overflow(MonitorPolicies.COALESCE, n_vars=MONITOR_QUEUE_SIZE + OVERFLOW)
+    assert [msg.value for msg in sent] == range(MONITOR_QUEUE_SIZE)
+
+
+def test_deadband_discards_small_changes():
+    # Each change is compared to the value reported last
+    assert filter_changes([0, 3, 4, 6, 8, 12], deadband=5, expected=3) == [0, 6, 12]
+
+
+def test_deadband_does_not_apply_to_bools():
+    assert filter_changes([False, True, False], deadband=5, expected=3) == [False, True, False]
+
+
+def test_min_interval_delays_last_change():
+    start = time.time()
+    # The first change is reported right away, the later ones are delayed and superseded by the last one
+    assert filter_changes([1, 2, 3], min_interval=MIN_INTERVAL, expected=2) == [1, 3]
+    assert time.time() - start >= MIN_INTERVAL
+
+
+def test_change_back_within_deadband_cancels_delayed_change():
+    # 9 is delayed by the minimum interval, but 1 is back within the deadband of the reported 0
+    assert filter_changes([0, 9, 1], min_interval=MIN_INTERVAL, deadband=5, settle=2 * MIN_INTERVAL) == [0]
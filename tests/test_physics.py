@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+from cpstwinning.physics import MotorPhysics, PHYSICS_STEP
+
+# Velocity set by the PLC
+VELOCITY = 10
+# Time in s after which the speed of a motor has settled (multiple time constants)
+SETTLE_TIME = 5.0
+
+
+class StubRuntime(object):
+    """Stands in for the device runtime, its timer is fired by the test."""
+
+    def __init__(self):
+        self.timer = None
+
+    def call_soon(self, clbk, *args):
+        clbk(*args)
+
+    def call_later(self, delay, clbk, args=(), plc=None):
+        self.timer = (clbk, args)
+
+    def fire(self):
+        clbk, args = self.timer
+        self.timer = None
+        clbk(*args)
+
+
+class StubPlc(object):
+    """Stands in for a Plc twin in the step time mode, records the tags written."""
+
+    name = 'PLC'
+
+    def __init__(self):
+        self.time = 0
+        self.writes = []
+
+    def get_current_time(self):
+        return self.time
+
+    def write_var_value_async(self, name, value):
+        self.writes.append((name, value))
+
+    def written(self, name):
+        return [value for tag, value in self.writes if tag == name]
+
+
+class StubMotor(object):
+
+    def __init__(self, run, velocity):
+        self.vars = [{'name': 'Run', 'value': run}, {'name': 'Velocity', 'value': velocity},
+                     {'name': 'Speed', 'value': 0}, {'name': 'Position', 'value': 0}, {'name': 'Load', 'value': 0}]
+        # Load is not mapped to a PLC tag
+        self.plc_vars_map = {'CONVEYORRUN': 0, 'CONVEYORVELOCITY': 1, 'CONVEYORSPEED': 2, 'CONVEYORPOSITION': 3}
+
+    def get_var(self, name):
+        return [v['value'] for v in self.vars if v['name'] == name][0]
+
+
+def start(run=True, velocity=VELOCITY):
+    runtime = StubRuntime()
+    plc = StubPlc()
+    physics = MotorPhysics(runtime, plc)
+    motor = StubMotor(run, velocity)
+    physics.add_motor(motor)
+    physics.start()
+    return runtime, plc, physics, motor
+
+
+def advance(runtime, plc, duration, step=PHYSICS_STEP):
+    for _ in xrange(int(round(duration / step))):
+        plc.time += int(step * 1e9)
+        runtime.fire()
+
+
+def test_command_tags_exclude_state_vars():
+    _, _, physics, motor = start()
+    assert sorted(physics.get_command_tags(motor)) == ['CONVEYORRUN', 'CONVEYORVELOCITY']
+
+
+def test_first_step_is_written_back():
+    runtime, plc, _, motor = start()
+    advance(runtime, plc, PHYSICS_STEP)
+    # Acceleration is (10 - 0) / 0.5 = 20 per s, i.e., speed 1 and position 0.05 after one step
+    assert plc.writes == [('CONVEYORSPEED', 1)]
+    assert motor.get_var('Speed') == 1
+    assert motor.get_var('Position') == 0
+    # Load is 0.2 * 1 + 0.1 * 20 = 2.2, written to the motor var only
+    assert motor.get_var('Load') == 2
+
+
+def test_speed_settles_and_position_advances():
+    runtime, plc, _, motor = start()
+    advance(runtime, plc, SETTLE_TIME)
+    speeds = plc.written('CONVEYORSPEED')
+    positions = plc.written('CONVEYORPOSITION')
+    assert speeds[-1] == VELOCITY
+    assert motor.get_var('Speed') == VELOCITY
+    # Only changed values are written
+    assert all(a != b for a, b in zip(speeds, speeds[1:]))
+    assert positions == sorted(set(positions))
+    assert positions[-1] == motor.get_var('Position') > 0
+    # Steady state load is caused by friction only
+    assert motor.get_var('Load') == 2
+    assert plc.written('CONVEYORRUN') == plc.written('CONVEYORVELOCITY') == []
+
+
+def test_stopped_motor_is_not_written_back():
+    runtime, plc, _, motor = start(run=False)
+    advance(runtime, plc, SETTLE_TIME)
+    assert plc.writes == []
+    assert motor.get_var('Speed') == 0
+
+
+def test_steps_beyond_maximum_are_skipped():
+    runtime, plc, physics, motor = start()
+    advance(runtime, plc, SETTLE_TIME, step=SETTLE_TIME)
+    # Speed after PHYSICS_MAX_STEPS_PER_TICK steps only, i.e., 10 * (1 - 0.9 ** 10) = 6.5
+    assert plc.written('CONVEYORSPEED') == [motor.get_var('Speed')] == [7]
+    # Simulation continues from the PLC's current time
+    assert physics.time == plc.time
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+from cpstwinning.wireformat import Codec, MESSAGE_TYPES, PICKLED, HEADER
+from cpstwinning.plcmessages import GetTagMessage, GetTagResponseMessage, SetTagMessage, GetTagsResponseMessage, \
+    StepResponseMessage, MonitorMessage, MonitorResponseMessage, MonitorBatchResponseMessage, MonitorPolicies, \
+    GetAllTagNamesResponseMessage, HostPlcMessage, StartMessage
+from cpstwinning.hmimessages import WriteMessage
+from cpstwinning.mqttmessages import PublishMessage
+
+import cPickle as pickle
+
+import pytest
+
+
+def round_trip(msgs):
+    """Encodes the messages with one codec and decodes them with another, as sent via one connection."""
+    sender, receiver = Codec(), Codec()
+    return [receiver.decode_frame(sender.encode(msg, request_id)) for request_id, msg in enumerate(msgs)]
+
+
+@pytest.mark.parametrize('msg', [
+    StartMessage(),
+    GetTagMessage('V0'),
+    GetTagResponseMessage(-42),
+    SetTagMessage('V1', 'true'),
+    GetTagsResponseMessage([{'name': 'V0', 'value': 1}, {'name': 'V1', 'value': False}]),
+    StepResponseMessage(7, 70000000, [{'name': 'V0', 'value': 6, 'tick': 6}, {'name': 'V0', 'value': 7, 'tick': 7}]),
+    MonitorMessage(['V0', 'V1'], MonitorPolicies.COALESCE, True, 0.5, 2.0),
+    MonitorResponseMessage('V0', 2 ** 40),
+    MonitorBatchResponseMessage(3, ['V0', 'V1'], [5, True]),
+    GetAllTagNamesResponseMessage(['V0', 'V1', 'V2']),
+    HostPlcMessage('PLC1', '/tmp/plc1.st', None, '/proc/1/ns/net', 'release'),
+    WriteMessage('10.0.0.1', 'hr', 1, 2, [3, 4]),
+    PublishMessage('topic', u'\xfcnicode', 1, True),
+])
+def test_message_round_trip(msg):
+    (request_id, decoded), = round_trip([msg])
+    assert request_id == 0
+    assert type(decoded) is type(msg)
+    assert decoded.__dict__ == msg.__dict__
+
+
+def test_all_message_types_are_encoded_as_frames():
+    for msg_type, (clazz, fields) in MESSAGE_TYPES.iteritems():
+        msg = clazz.__new__(clazz)
+        for attr, _ in fields:
+            setattr(msg, attr, None)
+        data = Codec().encode(msg)
+        # Fields of value None may not be encodable, which then must fall back to pickle
+        assert HEADER.unpack_from(data)[2] in (msg_type, PICKLED)
+
+
+def test_tags_are_interned_per_connection():
+    sender = Codec()
+    first = sender.encode(GetTagMessage('A_LONG_TAG_NAME'))
+    second = sender.encode(GetTagMessage('A_LONG_TAG_NAME'))
+    assert len(second) < len(first)
+    receiver = Codec()
+    assert receiver.decode(first).name == 'A_LONG_TAG_NAME'
+    assert receiver.decode(second).name == 'A_LONG_TAG_NAME'
+
+
+def test_request_ids_are_kept():
+    msgs = [GetTagMessage('V{}'.format(i)) for i in range(3)]
+    assert [request_id for request_id, _ in round_trip(msgs)] == [0, 1, 2]
+
+
+def test_not_encodable_messages_are_pickled():
+    msg = GetTagResponseMessage(2 ** 70)
+    sender = Codec()
+    data = sender.encode(msg, 5)
+    assert HEADER.unpack_from(data)[2] == PICKLED
+    request_id, decoded = Codec().decode_frame(data)
+    assert request_id == 5
+    assert decoded.value == 2 ** 70
+
+
+def test_pickled_fallback_forgets_interned_tags():
+    sender, receiver = Codec(), Codec()
+    # Interns V0, but is not encodable and thus pickled
+    receiver.decode(sender.encode(MonitorResponseMessage('V0', 2 ** 70)))
+    # Must define V0 again, as the receiver has not learned it
+    assert receiver.decode(sender.encode(GetTagMessage('V0'))).name == 'V0'
+
+
+def test_plain_pickles_are_decoded():
+    assert Codec().decode(pickle.dumps('Error', pickle.HIGHEST_PROTOCOL)) == 'Error'